@@ -0,0 +1,28 @@
+from simulation.simulation import WaffleCellSimulator, poisson_arrivals
+
+""" python -m benchmark.bench_dag_jobs
+
+Waffle jobs as task sequences against the same jobs as dependency graphs, with irons that have
+to preheat after they are turned on. As a graph the arm opens the iron and serves other jobs
+while the iron heats instead of waiting for the preheat to end. """
+
+IRONS = (("small iron 1", 1), ("big iron 1", 2), ("big iron 2", 2), ("big iron 3", 2), ("small iron 2", 1))
+
+
+def main(hours=4, seed=1, preheat_time=60):
+    for orders_per_hour in (40, 80):
+        arrivals = poisson_arrivals(orders_per_hour, hours, seed)
+        print(f'{orders_per_hour} orders/h, {preheat_time} s preheat')
+        for robots in (1, 2):
+            for dag in (False, True):
+                report = WaffleCellSimulator(irons=IRONS, robots=robots, preheat_time=preheat_time,
+                                             dag_jobs=dag).run(arrivals)
+                print(f'  {robots} robot(s), {"graph   " if dag else "sequence"}: '
+                      f'{report.get_throughput():5.1f} waffles/h, '
+                      f'p50 latency {report.get_latency_percentile(50):6.0f} s, '
+                      f'p95 latency {report.get_latency_percentile(95):6.0f} s, '
+                      f'arm utilization {report.get_arm_utilization():.0%}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+from simulation.simulation import WaffleCellSimulator, poisson_arrivals
+
+""" python -m benchmark.bench_deadlines
+
+Deadline misses of the frying deadlines (open the iron, serve every waffle) with and without
+reserving arm time ahead of the deadlines, for tolerances from tight to relaxed. """
+
+IRONS = (("small iron 1", 1), ("big iron 1", 2), ("big iron 2", 2), ("big iron 3", 2), ("small iron 2", 1))
+
+
+def main(hours=4, seed=1):
+    for orders_per_hour in (40, 80):
+        arrivals = poisson_arrivals(orders_per_hour, hours, seed)
+        print(f'{orders_per_hour} orders/h')
+        for over_fry_time in (5, 10, 20):
+            for reserve in (False, True):
+                report = WaffleCellSimulator(irons=IRONS, over_fry_time=over_fry_time,
+                                             reserve_arm_time=reserve).run(arrivals)
+                stats = report.deadline_stats
+                print(f'  over-fry {over_fry_time:2} s, reserve arm time {str(reserve):5}: '
+                      f'{stats.misses:4} of {stats.tasks} missed ({stats.get_miss_rate():5.1%}), '
+                      f'{stats.missed_by_task.get("open for retrieving", 0):3} late opens, '
+                      f'{report.get_throughput():5.1f} waffles/h')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import logging
+import time
+from robot.robot_logging import set_component_levels
+from robot.fake_controller import FakeMelfaController
+from robot.robot import MySerial, RobotMovement, MelfaMessage, MelfaResponseType
+
+""" python -m benchmark.bench_fake_controller
+
+End-to-end command rates of the real MySerial and RobotMovement against the fake controller:
+over a TCP socket and a pseudo terminal with instant transfer, at 9600 baud and with a share of
+the answers dropped. Every WH round trip skips the pose cache. """
+
+
+def where_rate(movement: RobotMovement, seconds):
+    """ WH round trips per second and the number that timed out """
+    count = timeouts = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        movement.pose_cache.invalidate()
+        try:
+            movement.get_position()
+        except TimeoutError:
+            timeouts += 1
+        count += 1
+    return count / seconds, timeouts
+
+
+def pipelined_rate(serial: MySerial, seconds, burst=10):
+    count = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        serial.send_melfa_msgs([MelfaMessage("WH", MelfaResponseType.POSITION) for _ in range(burst)])
+        count += burst
+    return count / seconds
+
+
+def run(name, controller: FakeMelfaController, pty=False, seconds=2.0, r_timeout=2):
+    address = controller.serve_pty() if pty else f'socket://127.0.0.1:{controller.serve_socket()}'
+    serial = MySerial(address, r_timeout=r_timeout)
+    movement = RobotMovement(serial)
+    try:
+        rate, timeouts = where_rate(movement, seconds)
+        pipelined = pipelined_rate(serial, seconds) if controller.error_rate == 0 else None
+    finally:
+        serial.close()
+        controller.stop()
+    line = f'{name:26} {rate:9,.0f} WH/s'
+    if pipelined is not None:
+        line += f', pipelined {pipelined:9,.0f} WH/s'
+    if timeouts:
+        line += f', {timeouts} timeouts'
+    print(line)
+
+
+def main():
+    # the timeouts of the dropped answers would log a warning each
+    set_component_levels(serial=logging.ERROR)
+    run("socket, instant", FakeMelfaController())
+    run("pty, instant", FakeMelfaController(), pty=True)
+    run("socket, 9600 baud", FakeMelfaController(baudrate=9600))
+    run("socket, 5% dropped", FakeMelfaController(error_rate=0.05, seed=1), r_timeout=0.05)
+
+
+if __name__ == "__main__":
+    main()
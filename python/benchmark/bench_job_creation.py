@@ -0,0 +1,62 @@
+import logging
+import timeit
+from robotic_waffles import *
+
+""" python -m benchmark.bench_job_creation
+
+Jobs created per second from the compiled waffle blueprint against building the task sequence
+by hand with every task looking up its equipment in the constructor, as the jobs used to. """
+
+
+def legacy_waffle_job(res_handler, iron, slots, fry_time=5, over_fry_time=20.0, serve_time=30.0):
+    """ WaffleJob as it was: tasks appended one by one, equipment looked up right away """
+    job = BaseJob(res_handler, iron)
+
+    def add(task):
+        # the constructors used to look up their robot, tool stand, bowl and tray
+        for attr in ("robot", "tool_stand", "bowl", "tray"):
+            if hasattr(type(task), attr):
+                getattr(task, attr)
+        job.task_queue.appendleft(task)
+        return task
+
+    add(OperateIron("start iron", iron, res_handler, "turn on"))
+    add(OperateIron("open for fill", iron, res_handler, "open"))
+    for slot in range(1, slots + 1):
+        add(PourBatter("pouring batter slot " + str(slot), iron, res_handler, slot))
+    add(OperateIron("close for frying", iron, res_handler, "close"))
+    frying = add(WaitingTask("waiting while frying", fry_time))
+    frying.add_deadline_task(add(OperateIron("open for retrieving", iron, res_handler, "open", 3)), over_fry_time)
+    for slot in range(1, slots + 1):
+        frying.add_deadline_task(add(ServeWaffle("serving waffle slot " + str(slot), iron, res_handler, slot)),
+                                 over_fry_time + slot * serve_time)
+    add(OperateIron("turn off iron", iron, res_handler, "turn off"))
+    add(OperateIron("close finish", iron, res_handler, "close"))
+    return job
+
+
+def jobs_per_second(func, number):
+    return number / min(timeit.repeat(func, number=number, repeat=3))
+
+
+def main(number=5000):
+    logging.disable(logging.INFO)
+    res_handler = WaffleResourceHandler()
+    for num in range(8):
+        res_handler.add_item("iron", WaffleIron(None, "iron " + str(num), 2))
+        arm = RobotArm(None, "arm " + str(num))
+        res_handler.add_item("robot", arm)
+        res_handler.add_item("tool", arm.get_tool_stand())
+    res_handler.add_item("bowl", Bowl(None, "bowl"))
+    res_handler.add_item("tray", Tray(None, "tray"))
+    iron = res_handler.items["iron"][0]
+
+    for slots in (1, 2, 4):
+        legacy = jobs_per_second(lambda: legacy_waffle_job(res_handler, iron, slots), number)
+        current = jobs_per_second(lambda: WaffleJob(res_handler, iron, slots=slots), number)
+        print(f'{slots} slot(s): legacy {legacy:9,.0f} jobs/s, blueprint {current:9,.0f} jobs/s '
+              f'({current / legacy:.1f}x)')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import logging
+import os
+import tempfile
+import time
+from log_pipeline.log_pipeline import LogPipeline, DEFAULT_FORMAT
+
+""" python -m benchmark.bench_log_pipeline
+
+Time the logging thread spends per DEBUG record, in bursts as the scheduler logs them, with the handler
+setup robotic_waffles used to have, a FileHandler that writes and flushes every record on the
+calling thread, against the LogPipeline that only queues the record. Reports the mean and the
+p99/max of single calls, the file writes show up as the tail. """
+
+
+def log_latencies(logger: logging.Logger, number, burst=50, pause=0.002):
+    """ Bursts of records with a pause in between, like dispatch rounds waiting on the robot """
+    latencies = list()
+    for inx in range(number):
+        start = time.perf_counter()
+        logger.debug("Job %s runs task %s on %s", inx, "pouring batter slot 1", "Big nasty iron")
+        latencies.append(time.perf_counter() - start)
+        if inx % burst == burst - 1:
+            time.sleep(pause)
+    return sorted(latencies)
+
+
+def report(name, latencies):
+    mean = sum(latencies) / len(latencies)
+    p99 = latencies[int(len(latencies) * 0.99)]
+    print(f'{name:18} mean {mean * 1e6:6.1f} us  p99 {p99 * 1e6:7.1f} us  max {latencies[-1] * 1e6:8.1f} us')
+
+
+def main(number=50000):
+    directory = tempfile.mkdtemp()
+    logger = logging.getLogger("bench")
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG)
+
+    handler = logging.FileHandler(os.path.join(directory, "direct.log"), "w")
+    handler.setFormatter(logging.Formatter(DEFAULT_FORMAT))
+    root.addHandler(handler)
+    direct = log_latencies(logger, number)
+    root.removeHandler(handler)
+    handler.close()
+
+    pipeline = LogPipeline(os.path.join(directory, "pipeline.log"), console_level=None)
+    with pipeline:
+        queued = log_latencies(logger, number)
+    dropped = pipeline.get_dropped()
+
+    report("direct FileHandler", direct)
+    report("LogPipeline", queued)
+    if dropped:
+        print(f'{dropped} records dropped')
+
+
+if __name__ == "__main__":
+    main()
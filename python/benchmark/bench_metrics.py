@@ -0,0 +1,38 @@
+import logging
+import time
+from metrics.metrics import MetricsRegistry, set_metrics, get_metrics
+from simulation.simulation import WaffleCellSimulator, poisson_arrivals
+
+""" python -m benchmark.bench_metrics
+
+Cost of the instrumentation: the wall time of the same simulated rush hour with the metrics
+off, timing one call in 16 and timing every call. Counters are on whenever timing is. """
+
+
+def run_seconds(arrivals, registry):
+    set_metrics(registry)
+    start = time.perf_counter()
+    WaffleCellSimulator().run(arrivals)
+    return time.perf_counter() - start
+
+
+def main(orders_per_hour=80, hours=8, repeat=7):
+    logging.disable(logging.INFO)
+    arrivals = poisson_arrivals(orders_per_hour, hours, 1)
+    configs = (("off", MetricsRegistry(enabled=False)),
+               ("sample 1/16", MetricsRegistry(sample_every=16)),
+               ("every call", MetricsRegistry()))
+    # the configurations take turns so drift of the machine hits them alike, the best run counts
+    best = dict()
+    for _ in range(repeat):
+        for name, registry in configs:
+            seconds = run_seconds(arrivals, registry)
+            best[name] = min(best.get(name, seconds), seconds)
+    for name, _ in configs:
+        print(f'metrics {name:12} {best[name] * 1000:8.1f} ms ({(best[name] / best["off"] - 1) * 100:+5.1f}%)')
+    claims = get_metrics().histogram("claim_next_job_seconds")
+    print(f'claim_next_job p50/p99: {claims.get_quantile(0.5) * 1e6:.1f}/{claims.get_quantile(0.99) * 1e6:.1f} us')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+from simulation.simulation import WaffleCellSimulator, poisson_arrivals
+
+""" python -m benchmark.bench_multi_robot
+
+Simulated throughput of a waffle cell with a growing number of robot arms sharing the same
+coordinator, irons, bowl and tray. The order rate is set high enough that the arm is the
+bottleneck with a single robot. """
+
+IRONS = (("small iron 1", 1), ("big iron 1", 2), ("big iron 2", 2), ("big iron 3", 2))
+
+
+def main(orders_per_hour=200, hours=4, seed=1):
+    arrivals = poisson_arrivals(orders_per_hour, hours, seed)
+    baseline = None
+    for robots in (1, 2, 3):
+        report = WaffleCellSimulator(irons=IRONS, robots=robots).run(arrivals)
+        baseline = baseline or report.get_throughput()
+        print(f'{robots} robot(s): {report.get_throughput():6.1f} waffles/h '
+              f'({report.get_throughput() / baseline:.2f}x), '
+              f'p95 latency {report.get_latency_percentile(95):7.1f} s, '
+              f'arm utilization {report.get_arm_utilization():.0%}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+from simulation.simulation import WaffleCellSimulator, poisson_arrivals
+
+""" python -m benchmark.bench_order_batching
+
+The latency/throughput trade-off of the order batcher: the longer orders may wait to fill a
+multi-slot iron, the more waffles are fried per cycle. Irons with 1 to 4 slots. """
+
+IRONS = (("single iron", 1), ("dual iron", 2), ("triple iron", 3), ("quad iron", 4))
+
+
+def main(hours=4, seed=1):
+    for orders_per_hour in (30, 60, 120):
+        arrivals = poisson_arrivals(orders_per_hour, hours, seed)
+        print(f'{orders_per_hour} orders/h')
+        for max_wait in (0, 30, 60, 120, 300):
+            report = WaffleCellSimulator(irons=IRONS, max_wait=max_wait).run(arrivals)
+            print(f'  max wait {max_wait:4} s: {report.get_throughput():5.1f} waffles/h, '
+                  f'p50 latency {report.get_latency_percentile(50):6.0f} s, '
+                  f'p95 latency {report.get_latency_percentile(95):6.0f} s, '
+                  f'{report.get_waffles_per_job():4.2f} waffles/job')
+
+
+if __name__ == "__main__":
+    main()
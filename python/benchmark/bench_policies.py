@@ -0,0 +1,51 @@
+from control.control import PriorityPolicy
+from control.policy import ToolBatchingPolicy, EarliestDeadlinePolicy, ShortestRemainingWorkPolicy
+from simulation.simulation import WaffleCellSimulator, poisson_arrivals
+import argparse
+
+""" python -m benchmark.bench_policies [--trace arrivals.txt]
+
+Replays the same order trace through the simulated cell once per scheduling policy and reports
+throughput and order latency percentiles. A trace file has one arrival time in seconds per line,
+without one a Poisson trace is generated. """
+
+IRONS = (("small iron 1", 1), ("big iron 1", 2), ("big iron 2", 2), ("big iron 3", 2), ("small iron 2", 1))
+
+
+def load_trace(path):
+    with open(path) as trace:
+        return sorted(float(line) for line in trace if line.strip())
+
+
+def make_policies(simulator: WaffleCellSimulator):
+    return [
+        ("priority", PriorityPolicy()),
+        ("tool batching", ToolBatchingPolicy()),
+        ("earliest deadline first", EarliestDeadlinePolicy()),
+        ("shortest remaining work", ShortestRemainingWorkPolicy(simulator.get_task_duration)),
+    ]
+
+
+def main(arrivals, irons=IRONS):
+    print(f'{len(arrivals)} orders')
+    print(f'{"policy":26} {"waffles/h":>10} {"p50":>8} {"p95":>8} {"p99":>8} {"tool changes":>13}')
+    for name, policy in make_policies(WaffleCellSimulator(irons=irons)):
+        report = WaffleCellSimulator(irons=irons, policy=policy).run(arrivals)
+        latencies = [report.get_latency_percentile(p) for p in (50, 95, 99)]
+        print(f'{name:26} {report.get_throughput():10.1f} '
+              + " ".join(f'{latency:8.0f}' for latency in latencies)
+              + f' {report.tool_changes:13}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare scheduling policies on one order trace")
+    parser.add_argument("--trace", help="file with one order arrival time in seconds per line")
+    parser.add_argument("--orders-per-hour", type=float, default=60)
+    parser.add_argument("--hours", type=float, default=4)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.trace is not None:
+        main(load_trace(args.trace))
+    else:
+        main(poisson_arrivals(args.orders_per_hour, args.hours, args.seed))
@@ -0,0 +1,54 @@
+import contextlib
+import io
+import re
+import timeit
+from robot.robot import Position
+
+""" python -m benchmark.bench_position_parse
+
+Parses per second of the position string parser, before and after precompiling the pattern
+and removing the prints, plus the bulk parser for a position table dump. """
+
+pos_line = "+500.00,+0.00,-46.30,+0.01,-179.99,R,A,C"
+
+
+def legacy_pos_string_to_dict(string: str) -> dict:
+    """ Position.pos_string_to_dict as it was: compiles the pattern and prints on every call """
+    RV_E3J_pos_pattern = r"^([\+|-]\d+.\d+),([\+|-]\d+.\d+),([\+|-]\d+.\d+),([\+|-]\d+.\d+),([\+|-]\d+.\d+)," \
+                         r"([R|L]),([A|B]),([O|C])$"
+    pattern = re.compile(RV_E3J_pos_pattern)
+    groups = pattern.match(string)
+
+    keys = ["x","y","z","A","B","arg1","arg2","grip"]
+    if groups.lastindex==len(keys):
+        pos_values = list(groups.groups())
+        pos_values[:5] = [float(x) for x in pos_values[:5]]
+        print("successfully parsed position string")
+        pos_dict = dict(zip(keys,pos_values))
+        print("dict:"+str(pos_dict))
+        return pos_dict
+    else:
+        raise SyntaxError("Illegal position format:"+str(string))
+
+
+def parses_per_second(func, number):
+    return number / min(timeit.repeat(func, number=number, repeat=3))
+
+
+def main(number=20000):
+    # the prints go to a buffer so the terminal speed does not dominate the legacy numbers
+    with contextlib.redirect_stdout(io.StringIO()):
+        legacy = parses_per_second(lambda: legacy_pos_string_to_dict(pos_line), number)
+    current = parses_per_second(lambda: Position.pos_string_to_dict(pos_line), number)
+    from_string = parses_per_second(lambda: Position.from_string(pos_line), number)
+    table = [pos_line] * 1000
+    bulk = parses_per_second(lambda: Position.parse_position_table(table), number // 1000) * len(table)
+
+    print(f'legacy pos_string_to_dict:   {legacy:12,.0f} parses/s')
+    print(f'pos_string_to_dict:          {current:12,.0f} parses/s ({current / legacy:.1f}x)')
+    print(f'Position.from_string:        {from_string:12,.0f} parses/s')
+    print(f'parse_position_table:        {bulk:12,.0f} parses/s ({bulk / legacy:.1f}x)')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import argparse
+import statistics
+from control.policy import ToolBatchingPolicy
+from recording.recording import TraceRecorder, Trace, load_trace, compare_dispatches, replay_melfa, ReplaySerial
+from simulation.simulation import WaffleCellSimulator
+import io
+import json
+
+""" python -m benchmark.bench_replay trace.jsonl [--against baseline.jsonl] [--save replayed.jsonl]
+
+Replays the order arrivals of a recorded session through the simulated cell of this build and
+compares the dispatched tasks and order latencies with the recording, or with another trace of
+the same arrivals, e.g. one saved from the previous build. The recorded Melfa commands are sent
+through MySerial against a ReplayPort that answers with the recorded responses.
+
+Record a trace with robotic_waffles.py --trace or simulation.simulation --record. """
+
+
+def replay_orders(trace: Trace, simulator_args: dict) -> Trace:
+    stream = io.StringIO()
+    recorder = TraceRecorder(stream)
+    report = WaffleCellSimulator(recorder=recorder, **simulator_args).run(trace.get_arrivals())
+    print(report)
+    recorder.flush()
+    return Trace([json.loads(line) for line in stream.getvalue().splitlines()])
+
+
+def main(path, against=None, save=None, simulator_args=None):
+    trace = load_trace(path)
+    print(f'{len(trace.orders)} orders, {len(trace.dispatches)} dispatches, {len(trace.melfa)} Melfa commands')
+    replayed = replay_orders(trace, simulator_args or dict())
+    if save is not None:
+        with open(save, "w", encoding="utf-8") as out:
+            out.writelines(json.dumps(event) + "\n" for event in replayed.events)
+    print(compare_dispatches(load_trace(against) if against is not None else trace, replayed))
+
+    if trace.melfa:
+        times = replay_melfa(trace, ReplaySerial(trace))
+        recorded = [event["seconds"] for event in trace.melfa]
+        print(f'Melfa round trip mean: recorded {statistics.mean(recorded) * 1e3:.2f} ms, '
+              f'replayed {statistics.mean(times) * 1e3:.3f} ms without the controller')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a recorded session against this build")
+    parser.add_argument("trace")
+    parser.add_argument("--against", default=None, help="compare with this trace instead of the recording")
+    parser.add_argument("--save", default=None, help="write the replayed trace to this file")
+    parser.add_argument("--tool-batching", action="store_true")
+    parser.add_argument("--dag", action="store_true")
+    args = parser.parse_args()
+    main(args.trace, args.against, args.save,
+         dict(policy=ToolBatchingPolicy() if args.tool_batching else None, dag_jobs=args.dag))
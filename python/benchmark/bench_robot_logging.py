@@ -0,0 +1,67 @@
+import logging
+import os
+import tempfile
+import timeit
+from robot.robot import MySerial, RobotMovement
+from robot.robot_logging import set_component_levels, start_queue_logging
+
+""" python -m benchmark.bench_robot_logging
+
+Serial round trips per second through MySerial and RobotMovement on a loop:// port, every
+command is written and its echo read back, with the robot layer logging off, logging at DEBUG
+straight to a file and logging at DEBUG to the same file through the queue listener. """
+
+
+def round_trip(movement: RobotMovement):
+    movement.move_straight(10, 0, 0)
+    movement.controller.get_response()
+
+
+def commands_per_second(movement: RobotMovement, number):
+    return number / timeit.timeit(lambda: round_trip(movement), number=number)
+
+
+def logging_off(movement, file_handler, number):
+    set_component_levels(logging.WARNING)
+    return commands_per_second(movement, number)
+
+
+def logging_to_file(movement, file_handler, number):
+    set_component_levels(logging.DEBUG)
+    robot_logger = logging.getLogger("robot.robot")
+    robot_logger.addHandler(file_handler)
+    try:
+        return commands_per_second(movement, number)
+    finally:
+        robot_logger.removeHandler(file_handler)
+
+
+def logging_through_queue(movement, file_handler, number):
+    set_component_levels(logging.DEBUG)
+    listener = start_queue_logging(file_handler)
+    try:
+        return commands_per_second(movement, number)
+    finally:
+        listener.stop()
+
+
+def main(number=5000, repeat=5):
+    movement = RobotMovement(MySerial("loop://"))
+    logging.getLogger("robot.robot").propagate = False
+    file_handler = logging.FileHandler(os.path.join(tempfile.mkdtemp(), "robot.log"))
+    configs = (("logging off", logging_off), ("DEBUG to file", logging_to_file),
+               ("DEBUG through queue", logging_through_queue))
+    # the configurations take turns so drift of the machine hits them alike, the best run counts
+    best = dict()
+    for _ in range(repeat):
+        for name, run in configs:
+            best[name] = max(best.get(name, 0), run(movement, file_handler, number))
+    file_handler.close()
+    movement.controller.close()
+
+    for name, _ in configs:
+        print(f'{name + ":":21} {best[name]:10,.0f} commands/s ({best[name] / best["logging off"]:.2f}x)')
+
+
+if __name__ == "__main__":
+    main()
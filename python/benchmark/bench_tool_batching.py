@@ -0,0 +1,32 @@
+from control.control import PriorityPolicy
+from control.policy import ToolBatchingPolicy
+from simulation.simulation import WaffleCellSimulator, poisson_arrivals
+
+""" python -m benchmark.bench_tool_batching
+
+Tool changes of the priority policy against the tool batching policy in the simulated cell.
+Saved changes per hour are counted per waffle, (baseline changes per waffle - changes per waffle)
+times the throughput, so a policy is not credited for serving fewer waffles. """
+
+IRONS = (("small iron 1", 1), ("big iron 1", 2), ("big iron 2", 2), ("big iron 3", 2), ("small iron 2", 1))
+
+
+def main(hours=4, seed=1):
+    for orders_per_hour in (40, 80, 160):
+        arrivals = poisson_arrivals(orders_per_hour, hours, seed)
+        baseline = WaffleCellSimulator(irons=IRONS, policy=PriorityPolicy()).run(arrivals)
+        print(f'{orders_per_hour} orders/h')
+        policies = [("priority", PriorityPolicy())]
+        policies += [(f'tool batching, max batch {max_batch}', ToolBatchingPolicy(max_batch=max_batch))
+                     for max_batch in (8, 16, 1000)]
+        for name, policy in policies:
+            report = WaffleCellSimulator(irons=IRONS, policy=policy).run(arrivals)
+            per_waffle = report.tool_changes / report.waffles
+            saved = (baseline.tool_changes / baseline.waffles - per_waffle) * report.get_throughput()
+            print(f'  {name:32} {report.get_throughput():5.1f} waffles/h, '
+                  f'{per_waffle:4.2f} tool changes/waffle, {saved:6.1f} saved/h, '
+                  f'p95 latency {report.get_latency_percentile(95):7.0f} s')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import logging
+import time
+from robot.fake_controller import FakeMelfaController
+from robot.robot import MySerial, RobotMovement
+from robot.robot_logging import set_component_levels
+
+""" python -m benchmark.bench_trajectory
+
+Time until the arm is done with an approach and retreat of many small moves, as a task does
+before and after grabbing something: sent one by one with move_straight and move_tool_straight
+against streamed as a Trajectory. The fake controller runs at 9600 baud and 250 mm/s and every
+motion costs 50 ms of speeding up and stopping. A WH after the moves returns once the arm
+stands still. """
+
+APPROACH = [(0, 0, -5)] * 8 + [(0, 0, -1)] * 4
+RETREAT = [(0, 0, 1)] * 4 + [(0, 0, 5)] * 8
+
+
+def one_by_one(movement: RobotMovement):
+    for x, y, z in APPROACH:
+        movement.move_straight(x, y, z)
+    movement.move_tool_straight(10)
+    movement.move_tool_straight(-10)
+    for x, y, z in RETREAT:
+        movement.move_straight(x, y, z)
+
+
+def streamed(movement: RobotMovement):
+    trajectory = movement.trajectory()
+    for x, y, z in APPROACH:
+        trajectory.straight(x, y, z)
+    trajectory.tool_straight(10).tool_straight(-10)
+    for x, y, z in RETREAT:
+        trajectory.straight(x, y, z)
+    return trajectory.send()
+
+
+def seconds_until_done(movement: RobotMovement, moves):
+    start = time.perf_counter()
+    moves(movement)
+    movement.pose_cache.invalidate()
+    movement.get_position()
+    return time.perf_counter() - start
+
+
+def main():
+    set_component_levels(logging.WARNING)
+    controller = FakeMelfaController(baudrate=9600, speed=250, settle_time=0.05)
+    movement = RobotMovement(MySerial(f'socket://127.0.0.1:{controller.serve_socket()}', r_timeout=10))
+    try:
+        movement.get_position()
+        single = seconds_until_done(movement, one_by_one)
+        commands_before = controller.commands
+        stream = seconds_until_done(movement, streamed)
+        commands = controller.commands - commands_before - 1
+    finally:
+        movement.controller.close()
+        controller.stop()
+    moves = len(APPROACH) + len(RETREAT) + 2
+    print(f'one by one: {moves} commands, {single:.2f} s')
+    print(f'trajectory: {commands} commands, {stream:.2f} s ({single / stream:.1f}x faster)')
+
+
+if __name__ == "__main__":
+    main()
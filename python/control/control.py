@@ -1,21 +1,32 @@
 from world.world import Equipment
-from typing import Tuple, List
+from control.orders import Order, OrderBatcher
+from control.deadlines import DeadlineScheduler
+from timer.timer import get_timer_service
+from metrics.metrics import timed, get_metrics
+from typing import Tuple, List, Dict
 from collections import deque
+from enum import Enum
+import bisect
+import heapq
+import queue
+import threading
 import logging
 
 logger = logging.getLogger(__name__)
 
+CoordinatorEvent = Enum('CoordinatorEvent', 'ORDER ORDERS_DUE JOB_READY STOP')
+
 
 class JobFactory:
 
     def __init__(self):
         pass
 
-    def create_job(self, jobtype:str, iron:Equipment, res_handler):
+    def create_job(self, jobtype:str, iron:Equipment, res_handler, orders=None):
         if jobtype == "base":
-            return BaseJob(jobtype, res_handler)
+            return BaseJob(res_handler, iron, jobtype)
         elif jobtype == "big":
-            return BaseJob(jobtype, res_handler)
+            return BaseJob(res_handler, iron, jobtype)
         else:
             return None
 
@@ -26,10 +37,38 @@ class BaseTask:
         self.robot = robot
         self.name = name
         self.prio = prio
+        self.deadline = None
+        self.prereqs: List['BaseTask'] = list()
+        self.started = False
 
-    def need_toolchange(self):
+    def need_toolchange(self, robot=None):
         return False
 
+    def get_tool_affinity(self):
+        """ Key of the tool this task needs. Tasks sharing a key always agree on need_toolchange() """
+        return None
+
+    def can_run_on(self, robot):
+        return True
+
+    def assign_robot(self, robot):
+        self.robot = robot
+
+    def get_shared_resources(self) -> Tuple[str, ...]:
+        """ Item types the task needs for itself while it runs, checked out when it is dispatched """
+        return ()
+
+    def bind_resource(self, item_name, item):
+        pass
+
+    def set_finished_listener(self, listener):
+        self.finished_listener = listener
+
+    def _notify_finished(self):
+        listener = getattr(self, "finished_listener", None)
+        if listener is not None:
+            listener(self)
+
     def _get_equipment(self):
         pass
 
@@ -42,8 +81,20 @@ class BaseTask:
     def get_priority(self):
         return self.prio
 
+    def get_finish_time(self):
+        """ When the task finishes by itself on the timer service clock, None if it does not or is not started """
+        return None
+
+    def get_deadline(self):
+        """ Latest start of the task on the timer service clock, None if it has no hard deadline """
+        return self.deadline
+
     def prereq_met(self):
-        pass
+        """ True when every task this one depends on has been run and is finished """
+        return all(task.is_done() for task in self.prereqs)
+
+    def is_done(self):
+        return self.started and self.is_finished()
 
     def is_finished(self):
         return True
@@ -60,11 +111,54 @@ class BaseJob:
         self.name=name
         self.res_handler = res_handler
         self.iron = iron
-        pass
+        self.change_listener = None
+        self.deadline = None
+        self.orders: List[Order] = list()
+
+    def set_change_listener(self, listener):
+        """ listener(job) is called when the next task or the readiness of the job changes """
+        self.change_listener = listener
+
+    def _notify_changed(self, *args):
+        if self.change_listener is not None:
+            self.change_listener(self)
+
+    def need_toolchange(self, robot=None):
+        task = self._get_next_task()
+        if robot is None:
+            return task.need_toolchange()
+        return task.need_toolchange(robot)
 
-    def need_toolchange(self):
+    def can_run_on(self, robot):
         task = self._get_next_task()
-        return task.need_toolchange()
+        return task != 0 and task.can_run_on(robot)
+
+    def get_next_task(self):
+        """ The task that runs next, None if the job is finished """
+        task = self._get_next_task()
+        return None if task == 0 else task
+
+    def get_tool_affinity(self):
+        task = self._get_next_task()
+        if task == 0:
+            return None
+        return task.get_tool_affinity()
+
+    def get_deadline(self):
+        """ When the job should be done on the timer service clock, None if it has no deadline """
+        return self.deadline
+
+    def get_upcoming_tasks(self):
+        """ The tasks left to run, next task first """
+        return reversed(self.task_queue)
+
+    def get_ready_time(self, now):
+        """ When the job will be ready on the timer service clock, None if that is not known """
+        if self.is_ready():
+            return now
+        if self.current_task is not None and self.current_task.get_finish_time() is not None:
+            return max(now, self.current_task.get_finish_time())
+        return None
 
     def get_current_task_name(self):
         pass
@@ -77,15 +171,20 @@ class BaseJob:
     def _get_next_task(self):
         if len(self.task_queue) == 0:
             return 0
-        task = self.task_queue.pop()
-        self.task_queue.append(task)
-        return task
+        return self.task_queue[-1]
 
-    def run_next_task(self):
+    def run_next_task(self, robot=None):
         task = self.task_queue.pop()
+        if robot is not None:
+            task.assign_robot(robot)
         self.current_task = task
+        task.started = True
+        task.set_finished_listener(self._notify_changed)
         logging.info("Running Task:"+str(task) + " in job:"+str(self))
         task.run()
+        if not self.is_finished():
+            self._notify_changed()
+        return task
 
     def cancel(self):
         pass
@@ -102,27 +201,227 @@ class BaseJob:
         pass
 
 
+class DagJob(BaseJob):
+    """ Job whose tasks form a dependency graph instead of a sequence.
+
+    Any task whose prerequisites are done can be dispatched, so robot work of the job goes on
+    while e.g. one of its WaitingTasks runs, and independent tasks are not ordered needlessly.
+    Among the runnable tasks the highest priority goes first, then the one added first. The job
+    is finished when every task has run and finished. """
+
+    def __init__(self, res_handler, iron, name=None):
+        super().__init__(res_handler, iron, name)
+        self.tasks: List[BaseTask] = list()
+        self.pending: List[BaseTask] = list()
+        self.running: List[BaseTask] = list()
+
+    def add_task(self, task: BaseTask, after=()) -> BaseTask:
+        """ Add a task that may only run once the tasks in after are done """
+        task.prereqs = list(after)
+        self.tasks.append(task)
+        self.pending.append(task)
+        return task
+
+    def get_runnable_tasks(self) -> List[BaseTask]:
+        return [task for task in self.pending if task.prereq_met()]
+
+    def _get_next_task(self):
+        runnable = self.get_runnable_tasks()
+        if len(runnable) == 0:
+            return 0
+        return min(runnable, key=lambda x: -x.get_priority())
+
+    def get_upcoming_tasks(self):
+        task = self._get_next_task()
+        if task == 0:
+            return iter(self.pending)
+        return iter([task] + [other for other in self.pending if other is not task])
+
+    def get_ready_time(self, now):
+        if self.is_ready():
+            return now
+        finish_times = [task.get_finish_time() for task in self.running if task.get_finish_time() is not None]
+        if len(finish_times) == 0:
+            return None
+        return max(now, min(finish_times))
+
+    def run_next_task(self, robot=None):
+        task = self._get_next_task()
+        if task == 0:
+            return None
+        self.pending.remove(task)
+        if robot is not None:
+            task.assign_robot(robot)
+        self.current_task = task
+        task.started = True
+        task.set_finished_listener(self._notify_changed)
+        logger.info("Running Task:" + str(task) + " in job:" + str(self))
+        task.run()
+        if not task.is_finished():
+            self.running.append(task)
+        if not self.is_finished():
+            self._notify_changed()
+        return task
+
+    def _notify_changed(self, *args):
+        self.running = [task for task in self.running if not task.is_finished()]
+        super()._notify_changed(*args)
+
+    def is_ready(self) -> bool:
+        return any(task.prereq_met() for task in self.pending)
+
+    def is_finished(self):
+        return len(self.pending) == 0 and all(task.is_finished() for task in self.running)
+
+    def tasks_left(self) -> int:
+        return len(self.pending)
+
+
+class FreeItemIndex:
+    """ The free items of one item type, bucketed by capacity.
+
+    Each capacity bucket is a heap of (insertion order, item). Items that are checked out stay in
+    their heap until they come up and are then dropped, check in pushes them back. """
+
+    def __init__(self):
+        self.capacities = list()
+        self.buckets: Dict[int, list] = dict()
+        self.order = dict()
+        self.indexed = set()
+
+    def add(self, item, seq):
+        capacity = item.get_capacity()
+        if capacity not in self.buckets:
+            bisect.insort(self.capacities, capacity)
+            self.buckets[capacity] = list()
+        self.order[item] = seq
+        self.update(item)
+
+    def update(self, item):
+        if item.is_free() and item not in self.indexed and item in self.order:
+            self.indexed.add(item)
+            heapq.heappush(self.buckets[item.get_capacity()], (self.order[item], item))
+
+    def _peek(self, capacity):
+        heap = self.buckets[capacity]
+        while heap and not heap[0][1].is_free():
+            self.indexed.discard(heapq.heappop(heap)[1])
+        return heap[0] if heap else None
+
+    def free_capacities(self):
+        return [capacity for capacity in self.capacities if self._peek(capacity) is not None]
+
+    def first_free(self):
+        """ The free item that was added first """
+        tops = [entry for entry in (self._peek(capacity) for capacity in self.capacities) if entry is not None]
+        return min(tops)[1] if tops else None
+
+    def best_fit_free(self, capacity):
+        """ The free item with the smallest capacity of at least the requested, the first added on ties """
+        for inx in range(bisect.bisect_left(self.capacities, capacity), len(self.capacities)):
+            entry = self._peek(self.capacities[inx])
+            if entry is not None:
+                return entry[1]
+        return None
+
+    def get_order(self, item):
+        return self.order[item]
+
+    def closest_free(self, capacity):
+        """ The free item with the capacity closest to the requested, the first added on ties """
+        above = bisect.bisect_left(self.capacities, capacity)
+        below = above - 1
+        while below >= 0 or above < len(self.capacities):
+            distance_below = capacity - self.capacities[below] if below >= 0 else None
+            distance_above = self.capacities[above] - capacity if above < len(self.capacities) else None
+            if distance_above is None or (distance_below is not None and distance_below < distance_above):
+                candidates = [self._peek(self.capacities[below])]
+                below -= 1
+            elif distance_below is None or distance_above < distance_below:
+                candidates = [self._peek(self.capacities[above])]
+                above += 1
+            else:
+                candidates = [self._peek(self.capacities[below]), self._peek(self.capacities[above])]
+                below -= 1
+                above += 1
+            candidates = [entry for entry in candidates if entry is not None]
+            if candidates:
+                return min(candidates)[1]
+        return None
+
+
+class LazyResource:
+    """ Task attribute holding an item of the task's res_handler, looked up when first used.
+
+    Tasks can be created before equipment is chosen, the coordinator usually binds the item at
+    dispatch time and the lookup never happens. """
+
+    def __init__(self, item_name):
+        self.item_name = item_name
+        self.attr = None
+
+    def __set_name__(self, owner, name):
+        self.attr = "_" + name
+
+    def __get__(self, task, owner=None):
+        if task is None:
+            return self
+        item = task.__dict__.get(self.attr)
+        if item is None:
+            item = task.res_handler.get_free_equipment_by_string(self.item_name)
+            task.__dict__[self.attr] = item
+        return item
+
+    def __set__(self, task, item):
+        task.__dict__[self.attr] = item
+
+
 class ResourceHandler:
 
     def __init__(self):
         self.items=dict()
+        self.free_index: Dict[str, FreeItemIndex] = dict()
+        self.locks: Dict[str, threading.RLock] = dict()
+        self.registry_lock = threading.Lock()
+        self.added = 0
+
+    def get_lock(self, item_name):
+        with self.registry_lock:
+            if item_name not in self.locks:
+                self.locks[item_name] = threading.RLock()
+            return self.locks[item_name]
 
     def add_item(self, item_name, item):
-        if item_name in self.items.keys():
-            self.items[item_name].append(item)
-        else:
-            self.items[item_name] = list()
-            self.items[item_name].append(item)
+        with self.get_lock(item_name):
+            if item_name in self.items.keys():
+                self.items[item_name].append(item)
+            else:
+                self.items[item_name] = list()
+                self.items[item_name].append(item)
+                self.free_index[item_name] = FreeItemIndex()
+            index = self.free_index[item_name]
+            item.add_free_listener(lambda x: self._on_free_changed(item_name, x))
+            index.add(item, self.added)
+            self.added += 1
+
+    def _on_free_changed(self, item_name, item):
+        with self.get_lock(item_name):
+            self.free_index[item_name].update(item)
 
     def get_free_equipment_by_string(self, item_name: str):
         if item_name not in self.items.keys():
             return None
-        else:
-            for item in self.items[item_name]:
-                if item.is_free():
-                    return item
-        return None
+        with self.get_lock(item_name):
+            return self.free_index[item_name].first_free()
 
+    def get_free_capacities(self, item_name: str) -> List[int]:
+        """ The capacities, ascending, that a free item of the type has """
+        if item_name not in self.items.keys():
+            return list()
+        with self.get_lock(item_name):
+            return self.free_index[item_name].free_capacities()
+
+    @timed("checkout_prechecked_item_seconds")
     def checkout_prechecked_item(self, item_name, capacity=1)-> Equipment:
         ''' Get an item that is free and with the most suitable capacity '''
         if item_name not in self.items.keys():
@@ -135,16 +434,13 @@ class ResourceHandler:
             # 2. Occupied but not reserved
             # 3. Occupied and with a capacity reserved
 
-            #if desired capacity is not found, look for one step lower capacity
-            free_items = list(filter(lambda x: x.is_free(),self.items[item_name]))
-            closest_capacity_sort = sorted(free_items,key=lambda x: abs(x.get_capacity()-capacity))
-
-            for item in closest_capacity_sort:
-                item.free = False
+            # closest capacity wins, on equal distance the item added first
+            with self.get_lock(item_name):
+                item = self.free_index[item_name].closest_free(capacity)
+                if item is not None:
+                    item.free = False
                 return item
 
-        return None
-
     # For single responsibility, let the resourcehandler decide whats free or not
     def check_in(self,item):
         item.free = True
@@ -154,29 +450,267 @@ class ResourceHandler:
 
 
 
+def need_toolchange(job: BaseJob, robot=None) -> bool:
+    """ True if the next task of job needs a tool change, on robot or on its own robot if None """
+    return job.need_toolchange() if robot is None else job.need_toolchange(robot)
+
+
+class ReadyJobQueue:
+    """ Incrementally maintained index of the ready jobs of a JobCoordinator.
+
+    Ready jobs live in one heap ordered by (priority, arrival) and in one heap per tool affinity.
+    Ready jobs whose next task has a deadline are also kept in a heap ordered by that deadline,
+    and all jobs whose upcoming tasks start with a deadline task are tracked, ready or not.
+    Entries are replaced rather than removed, stale entries are skipped lazily when peeking. """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._heap = []
+        self._affinity_heaps: Dict[object, list] = dict()
+        self._entries = dict()
+        self._deadline_heap = []
+        self._deadline_entries = dict()
+        self._deadline_jobs = set()
+        self._order = dict()
+        self._claimed = set()
+        self._next_seq = 0
+
+    def add(self, job):
+        """ Register a job, its arrival order is used as tiebreak between equal priorities """
+        with self._lock:
+            if job not in self._order:
+                self._order[job] = self._next_seq
+                self._next_seq += 1
+            self.update(job)
+
+    def update(self, job):
+        """ Re-index a job after its next task or readiness has changed """
+        with self._lock:
+            if job not in self._order:
+                return
+            self._entries.pop(job, None)
+            self._deadline_entries.pop(job, None)
+            upcoming = next(iter(job.get_upcoming_tasks()), None)
+            if upcoming is not None and upcoming.get_deadline() is not None:
+                self._deadline_jobs.add(job)
+            else:
+                self._deadline_jobs.discard(job)
+            if job in self._claimed or not job.is_ready():
+                return
+            entry = (-job.get_current_priority(), self._order[job], job)
+            self._entries[job] = entry
+            heapq.heappush(self._heap, entry)
+            heapq.heappush(self._affinity_heaps.setdefault(job.get_tool_affinity(), []), entry)
+            task = job.get_next_task()
+            if task is not None and task.get_deadline() is not None:
+                deadline_entry = (task.get_deadline(),) + entry
+                self._deadline_entries[job] = deadline_entry
+                heapq.heappush(self._deadline_heap, deadline_entry)
+            if len(self._heap) > 2 * len(self._entries) + 16:
+                self._compact()
+
+    def _compact(self):
+        live = set(id(entry) for entry in self._entries.values())
+        self._heap = [entry for entry in self._heap if id(entry) in live]
+        heapq.heapify(self._heap)
+        for affinity, heap in self._affinity_heaps.items():
+            heap[:] = [entry for entry in heap if id(entry) in live]
+            heapq.heapify(heap)
+        self._deadline_heap = list(self._deadline_entries.values())
+        heapq.heapify(self._deadline_heap)
+
+    def remove(self, job):
+        with self._lock:
+            self._entries.pop(job, None)
+            self._deadline_entries.pop(job, None)
+            self._deadline_jobs.discard(job)
+            self._order.pop(job, None)
+            self._claimed.discard(job)
+
+    def claim(self, job):
+        """ Take a job out of selection while one of its tasks is being executed """
+        with self._lock:
+            self._entries.pop(job, None)
+            self._deadline_entries.pop(job, None)
+            self._claimed.add(job)
+
+    def is_claimed(self, job):
+        return job in self._claimed
+
+    def release(self, job):
+        with self._lock:
+            self._claimed.discard(job)
+            self.update(job)
+
+    def clear(self):
+        with self._lock:
+            self._heap = []
+            self._affinity_heaps = dict()
+            self._entries = dict()
+            self._deadline_heap = []
+            self._deadline_entries = dict()
+            self._deadline_jobs = set()
+            self._order = dict()
+            self._claimed = set()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def ready_jobs(self) -> List[BaseJob]:
+        """ Ready jobs in selection order, highest priority first """
+        with self._lock:
+            return [entry[2] for entry in sorted(self._entries.values())]
+
+    def _peek(self, heap):
+        while heap and self._entries.get(heap[0][2]) is not heap[0]:
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def has_deadline_jobs(self) -> bool:
+        """ True if a job waits to run or runs next a task with a deadline """
+        return len(self._deadline_jobs) > 0
+
+    def get_deadline_jobs(self) -> List[BaseJob]:
+        """ The jobs whose upcoming tasks start with a deadline task, ready or not, in arrival order """
+        with self._lock:
+            return sorted(self._deadline_jobs, key=self._order.get)
+
+    def get_due(self, accept=None):
+        """ The ready job with the earliest deadline on its next task, then in selection order.
+            accept(job) can rule out jobs, None if no ready job has a deadline """
+        with self._lock:
+            heap = self._deadline_heap
+            while heap and self._deadline_entries.get(heap[0][3]) is not heap[0]:
+                heapq.heappop(heap)
+            if not heap:
+                return None
+            if accept is None or accept(heap[0][3]):
+                return heap[0][3]
+            for entry in sorted(self._deadline_entries.values()):
+                if accept(entry[3]):
+                    return entry[3]
+            return None
+
+    def get_best(self, high_prio_treshold=3, robot=None, accept=None):
+        """ Highest priority job if it reaches the treshold, otherwise the highest priority job
+            that does not need a toolchange, otherwise the highest priority job.
+            robot is the robot that would run the task, accept(job) can rule out jobs """
+        with self._lock:
+            best = self._get_best_indexed(high_prio_treshold, robot)
+            if best is None or accept is None or accept(best):
+                return best
+            # rare case, the preferred job is not possible right now: select among the acceptable
+            jobs = [job for job in self.ready_jobs() if accept(job)]
+            if len(jobs) == 0:
+                return None
+            if jobs[0].get_current_priority() >= high_prio_treshold:
+                return jobs[0]
+            for job in jobs:
+                if not need_toolchange(job, robot):
+                    return job
+            return jobs[0]
+
+    def _get_best_indexed(self, high_prio_treshold, robot):
+        top = self._peek(self._heap)
+        if top is None:
+            return None
+        if -top[0] >= high_prio_treshold:
+            return top[2]
+
+        best = None
+        for affinity in list(self._affinity_heaps.keys()):
+            entry = self._peek(self._affinity_heaps[affinity])
+            if entry is None:
+                del self._affinity_heaps[affinity]
+            elif not need_toolchange(entry[2], robot) and (best is None or entry < best):
+                best = entry
+        if best is None:
+            best = top
+        return best[2]
+
+
+class SchedulingPolicy:
+    """ Scheduling strategy of a JobCoordinator.
+
+    Decides which ready job a robot works on next and which iron capacity the waiting orders
+    are assigned to. clock() gives the time on the timer service clock. """
+
+    def __init__(self, clock=None):
+        self.clock = clock
+
+    def now(self):
+        return self.clock() if self.clock is not None else get_timer_service().now()
+
+    def select_job(self, coordinator: 'JobCoordinator', robot=None, accept=None, high_prio_treshold=3):
+        raise NotImplementedError
+
+    def get_preferred_capacity(self, coordinator: 'JobCoordinator', item_name="iron"):
+        """ Capacity of the item to check out for the waiting orders, None to not create a job now """
+        return coordinator.order_batcher.get_capacity(coordinator.get_pending_orders(),
+                                                      coordinator.res_handler.get_free_capacities(item_name),
+                                                      self.now())
+
+    def job_created(self, coordinator: 'JobCoordinator', job: BaseJob):
+        """ Called when the coordinator has created a job from orders, before it is scheduled """
+        pass
+
+
+class PriorityPolicy(SchedulingPolicy):
+    """ Highest priority first, avoiding tool changes below the high priority treshold """
+
+    def select_job(self, coordinator, robot=None, accept=None, high_prio_treshold=3):
+        return coordinator.ready_queue.get_best(high_prio_treshold, robot, accept)
+
+
 # Creates Jobs that are based on a specific Equipment with a specific slot capacity for
 # processing orders in parallel. Such as an big Equipment doing multiple orders or
 # a small doing a single order.
 class JobCoordinator:
 
-    def __init__(self, job_factory, res_handler:ResourceHandler):
+    def __init__(self, job_factory, res_handler:ResourceHandler, policy: SchedulingPolicy = None,
+                 order_batcher: OrderBatcher = None, deadline_scheduler: DeadlineScheduler = None):
         self.running_jobs: List[BaseJob]=[]
-        self.orders = 0
+        self.pending_orders = deque()
+        self.order_batcher = order_batcher if order_batcher is not None else OrderBatcher()
+        self.order_timer = None
+        self.deadline_scheduler = deadline_scheduler if deadline_scheduler is not None else DeadlineScheduler()
         self.finished_jobs = list()
         self.waiting_jobs = list()
         self.factory = job_factory
         self.res_handler = res_handler
+        self.ready_queue = ReadyJobQueue()
+        self.event_sink = None
+        self.lock = threading.RLock()
+        self.claimed_resources: Dict[BaseJob, list] = dict()
+        self.policy = policy if policy is not None else PriorityPolicy()
+        # a recording.TraceRecorder that gets the orders and dispatched tasks
+        self.recorder = None
+
+    def set_policy(self, policy: SchedulingPolicy):
+        with self.lock:
+            self.policy = policy
+
+    @property
+    def orders(self) -> int:
+        """ Number of orders waiting for a job """
+        return len(self.pending_orders)
+
+    def get_pending_orders(self) -> List[Order]:
+        """ The waiting orders, oldest first """
+        with self.lock:
+            return list(self.pending_orders)
+
+    def set_event_sink(self, event_sink):
+        """ event_sink(event, payload) is called whenever a running job becomes ready """
+        self.event_sink = event_sink
 
     # Should based on the order-list generate jobs and add to either reserved or
     # running list
     def get_equip_for_orders(self, job_equipment:str):
         #Find resources to fill the order
         #the reshandler will first return free items, then reserved items of desired slot size
-        if self.orders > 1:
-            pref_cap = 2
-        elif self.orders == 1:
-            pref_cap = 1
-        else:
+        pref_cap = self.policy.get_preferred_capacity(self, job_equipment)
+        if pref_cap is None:
             return None
 
         iron = self.res_handler.checkout_prechecked_item(job_equipment, capacity=pref_cap)
@@ -184,35 +718,159 @@ class JobCoordinator:
         return iron
 
     def process_orders(self):
-        job = self._create_job_from_orders()
-        if job is not None:
-            self.running_jobs.append(job)
+        self.process_orders_if_possible()
+
+    def process_orders_if_possible(self) -> bool:
+        """ Create a job from the orders if equipment is available, returns True if a job was created """
+        with self.lock:
+            job = self._create_job_from_orders()
+            if job is not None:
+                self.policy.job_created(self, job)
+                self.running_jobs.append(job)
+                self._track_job(job)
+                return True
+            self._schedule_order_timer()
+            return False
 
-    def add_order(self):
-        self.orders += 1
+    def _schedule_order_timer(self):
+        # the batcher holds the orders back to fill an iron, come back when they must go
+        if self.order_timer is not None and self.order_timer.is_active():
+            return
+        timer_service = get_timer_service()
+        dispatch_time = self.order_batcher.get_dispatch_time(self.get_pending_orders())
+        if dispatch_time is not None and dispatch_time > timer_service.now():
+            self.order_timer = timer_service.schedule(dispatch_time - timer_service.now(), self._on_orders_due)
+
+    def _on_orders_due(self):
+        self.order_timer = None
+        if self.event_sink is not None:
+            self.event_sink(CoordinatorEvent.ORDERS_DUE, None)
+
+    def _track_job(self, job: BaseJob):
+        job.set_change_listener(self._on_job_changed)
+        self.ready_queue.add(job)
+
+    def _on_job_changed(self, job: BaseJob):
+        # a job can finish in the background, when the last task of a DagJob was a WaitingTask
+        with self.lock:
+            if job.current_task is not None and job.is_finished() and not self.ready_queue.is_claimed(job) \
+                    and job in self.running_jobs:
+                self.finish_job(job)
+                return
+        self.ready_queue.update(job)
+        if self.event_sink is not None and job.is_ready():
+            self.event_sink(CoordinatorEvent.JOB_READY, job)
+
+    def has_ready_job(self) -> bool:
+        return len(self.ready_queue) > 0
+
+    def add_order(self, order: Order = None) -> Order:
+        with self.lock:
+            if order is None:
+                order = Order()
+            self.pending_orders.append(order)
+            if self.recorder is not None:
+                self.recorder.order_added(order)
+            return order
 
     def remove_orders(self, number=1)->bool:
-        if self.orders >= number:
-            self.orders -= number
-            return True
+        return self.take_orders(number) is not None
+
+    def take_orders(self, number=1) -> List[Order]:
+        """ Remove the oldest orders, None if there are fewer waiting """
+        with self.lock:
+            if self.orders >= number:
+                return [self.pending_orders.popleft() for _ in range(number)]
+            else:
+                return None
+
+    def execute_next_job_task(self, robot=None):
+        """ Run the next task of the most prioritized job, returns the task or None when idling """
+        job = self.claim_next_job(robot)
+        if job is not None:
+            task = self.run_claimed_task(job, robot)
+            self.complete_claimed_task(job)
+            return task
         else:
-            return False
+            logger.info("No tasks to execute. Idling")
+            return None
 
-    def execute_next_job_task(self):
-        job = self.get_highest_priority_job(3)
-        if job is not None:
-            job.run_next_task()
+    @timed("claim_next_job_seconds")
+    def claim_next_job(self, robot=None, high_prio_treshold=3) -> BaseJob:
+        """ Select the best job whose next task robot can run and take it out of selection until
+            complete_claimed_task, so several robots can work on the coordinator at once.
+            The shared equipment the task needs is checked out for it. """
+        with self.lock:
+            # tasks with a deadline preempt the policy, other work must leave the arm time for them
+            job = None
+            if self.ready_queue.has_deadline_jobs():
+                job = self.deadline_scheduler.select_due(self, lambda x: self._can_dispatch(x, robot))
+            if job is None:
+                can_start = self.deadline_scheduler.get_start_check(self)
+                if can_start is None:
+                    accept = lambda x: self._can_dispatch(x, robot)
+                else:
+                    accept = lambda x: self._can_dispatch(x, robot) and can_start(x)
+                job = self.policy.select_job(self, robot, accept, high_prio_treshold)
+            if job is None:
+                get_metrics().inc("idles")
+                return None
+            self.ready_queue.claim(job)
+            self._checkout_shared_resources(job)
+            return job
+
+    def run_claimed_task(self, job: BaseJob, robot=None):
+        task = job.get_next_task()
+        if task is not None:
+            self.deadline_scheduler.record_start(task)
+            if self.recorder is not None:
+                self.recorder.task_dispatched(job, task, robot)
+        metrics = get_metrics()
+        start = metrics.start_timing()
+        try:
+            return job.run_next_task(robot)
+        finally:
+            if task is not None:
+                metrics.stop_timing(start, "task_run_seconds", task=type(task).__name__)
+
+    def complete_claimed_task(self, job: BaseJob):
+        """ The robot is done with the task of a claimed job """
+        with self.lock:
+            for item in self.claimed_resources.pop(job, list()):
+                self.res_handler.check_in(item)
             if job.is_finished():
                 self.finish_job(job)
-        else:
-            logger.info("No tasks to execute. Idling")
+            else:
+                self.ready_queue.release(job)
+
+    def _can_dispatch(self, job: BaseJob, robot) -> bool:
+        if robot is not None and not job.can_run_on(robot):
+            return False
+        task = job.get_next_task()
+        if task is None:
+            return True
+        return all(self.res_handler.get_free_equipment_by_string(item_name) is not None
+                   for item_name in task.get_shared_resources())
+
+    def _checkout_shared_resources(self, job: BaseJob):
+        task = job.get_next_task()
+        if task is None:
+            return
+        items = list()
+        for item_name in task.get_shared_resources():
+            item = self.res_handler.checkout_prechecked_item(item_name)
+            task.bind_resource(item_name, item)
+            items.append(item)
+        self.claimed_resources[job] = items
 
     def finish_job(self,job:BaseJob):
         # release the iron so it can be used to fulfill other orders
-        self.res_handler.check_in(job.iron)
+        with self.lock:
+            self.res_handler.check_in(job.iron)
 
-        self.running_jobs.remove(job)
-        self.finished_jobs.append(job)
+            self.ready_queue.remove(job)
+            self.running_jobs.remove(job)
+            self.finished_jobs.append(job)
         logger.info("Job:" + str(job) + " is completed")
 
     def _create_job_from_orders(self):
@@ -221,37 +879,155 @@ class JobCoordinator:
 
         if iron is None:
             return None
-        logger.info("Iron " + iron.get_name() + " is checked out by job "+str(self))
+        logger.info("Iron %s is checked out by job %s", iron.get_name(), self)
 
-        if self.orders >= iron.get_capacity() == 2:
-            new_job = self.factory.create_job("big", iron, self.res_handler)
-            self.remove_orders(2)
-        else:
-            new_job = self.factory.create_job("base", iron, self.res_handler)
-            self.remove_orders(1)
+        orders = self.take_orders(min(self.orders, iron.get_capacity()))
+        jobtype = "base" if len(orders) == 1 else "big"
+        new_job = self.factory.create_job(jobtype, iron, self.res_handler, orders=orders)
+        if new_job is not None:
+            new_job.orders = orders
 
         return new_job
 
+    @timed("get_highest_priority_job_seconds")
     def get_highest_priority_job(self,high_prio_treshold=3):
-        # Prio for a job is based on its next tasks prio, 1 is low, 2 is default, 3 high,
-        ready_jobs = list(filter(lambda x: x.is_ready(), self.running_jobs))
-        jobs_prio_sort = sorted(ready_jobs,key=lambda x:(x.get_current_priority()),reverse=True)
-
-        if len(jobs_prio_sort) == 0:
-            return None
-
-        #first look for high prio, that is more important than tool change
-        if jobs_prio_sort[0].get_current_priority() >= high_prio_treshold:
-            return jobs_prio_sort[0]
-
-        jobs_tool_sort = sorted(ready_jobs, key=lambda x: (not x.need_toolchange(), x.get_current_priority())
-                                , reverse=True)
-        print(str(jobs_tool_sort))
-        return jobs_tool_sort[0]
+        # With the default policy the prio for a job is based on its next tasks prio, 1 is low,
+        # 2 is default, 3 high, high prio is more important than tool change, otherwise prefer
+        # jobs not needing a tool change
+        with self.lock:
+            return self.policy.select_job(self, None, None, high_prio_treshold)
 
     def cancel_job(self, job: BaseJob):
+        self.ready_queue.remove(job)
         self.running_jobs.remove(job)
 
     #For test only
     def add_run_jobs(self, joblist):
         self.running_jobs = joblist
+        self.ready_queue.clear()
+        for job in joblist:
+            self._track_job(job)
+
+
+class CoordinatorEventLoop:
+    """ Runs a JobCoordinator from a central event queue instead of polling it.
+
+    New orders are posted as events and jobs post an event when their running task finishes,
+    e.g. when a WaitingTask timer expires. The loop sleeps on the queue until something happens
+    and then dispatches tasks until no job is ready. """
+
+    def __init__(self, coordinator: JobCoordinator):
+        self.coordinator = coordinator
+        self.events = queue.Queue()
+        self.thread = None
+        self.running = False
+        self.coordinator.set_event_sink(self._on_coordinator_event)
+
+    def post(self, event, payload=None):
+        self.events.put((event, payload))
+
+    def _on_coordinator_event(self, event, payload):
+        # jobs becoming ready on the loop thread itself are picked up by the running dispatch
+        if threading.current_thread() is not self.thread:
+            self.post(event, payload)
+
+    def post_order(self, order: Order = None):
+        self.post(CoordinatorEvent.ORDER, order)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="coordinator-loop", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        self.post(CoordinatorEvent.STOP)
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def run(self):
+        self.running = True
+        while self.running:
+            self.handle_event(*self.events.get())
+            # drain the events that piled up meanwhile, one dispatch round serves all of them
+            while self.running:
+                try:
+                    self.handle_event(*self.events.get_nowait())
+                except queue.Empty:
+                    break
+            if self.running:
+                self.dispatch()
+
+    def handle_event(self, event, payload=None):
+        if event == CoordinatorEvent.ORDER:
+            logger.info("Order received")
+            self.coordinator.add_order(payload)
+        elif event == CoordinatorEvent.STOP:
+            self.running = False
+
+    def dispatch(self):
+        """ Create jobs for waiting orders and run tasks until no job is ready """
+        while True:
+            while self.coordinator.orders > 0 and self.coordinator.process_orders_if_possible():
+                pass
+            if not self.coordinator.has_ready_job():
+                return
+            self.coordinator.execute_next_job_task()
+
+
+class RobotWorkerPool:
+    """ Drives a JobCoordinator with several robots at once.
+
+    Every robot gets a worker thread that claims the best ready job whose next task it can run,
+    runs that task and hands the job back. Shared equipment is arbitrated by the coordinator
+    through the ResourceHandler. Workers without work sleep until a job becomes ready. """
+
+    def __init__(self, coordinator: JobCoordinator, robots):
+        self.coordinator = coordinator
+        self.robots = list(robots)
+        self.condition = threading.Condition()
+        self.generation = 0
+        self.running = False
+        self.threads = list()
+        self.coordinator.set_event_sink(lambda event, payload: self.wake())
+
+    def wake(self):
+        with self.condition:
+            self.generation += 1
+            self.condition.notify_all()
+
+    def post_order(self, order: Order = None):
+        self.coordinator.add_order(order)
+        self.wake()
+
+    def start(self):
+        self.running = True
+        for robot in self.robots:
+            thread = threading.Thread(target=self._work, args=(robot,), name="robot-worker", daemon=True)
+            self.threads.append(thread)
+            thread.start()
+
+    def stop(self, timeout=None):
+        self.running = False
+        self.wake()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = list()
+
+    def _work(self, robot):
+        while self.running:
+            with self.condition:
+                generation = self.generation
+            while self.coordinator.orders > 0 and self.coordinator.process_orders_if_possible():
+                pass
+            job = self.coordinator.claim_next_job(robot)
+            if job is None:
+                with self.condition:
+                    if self.running and generation == self.generation:
+                        self.condition.wait()
+                continue
+            try:
+                self.coordinator.run_claimed_task(job, robot)
+            finally:
+                self.coordinator.complete_claimed_task(job)
+            # the finished task may have made this or another job ready for an idle robot
+            self.wake()
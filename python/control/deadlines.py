@@ -0,0 +1,120 @@
+from timer.timer import get_timer_service
+from typing import List
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineStats:
+    """ Deadline hits and misses of the tasks that had a deadline when they were started """
+
+    def __init__(self):
+        self.tasks = 0
+        self.misses = 0
+        self.max_lateness = 0.0
+        self.total_lateness = 0.0
+        self.missed_by_task = dict()
+
+    def record(self, task, start_time):
+        deadline = task.get_deadline()
+        if deadline is None:
+            return
+        self.tasks += 1
+        lateness = start_time - deadline
+        if lateness > 0:
+            self.misses += 1
+            self.total_lateness += lateness
+            self.max_lateness = max(self.max_lateness, lateness)
+            self.missed_by_task[task.get_name()] = self.missed_by_task.get(task.get_name(), 0) + 1
+            logger.warning("Task %s started %.1f s after its deadline", task, lateness)
+
+    def get_miss_rate(self):
+        if self.tasks == 0:
+            return 0.0
+        return self.misses / self.tasks
+
+    def __str__(self):
+        return f'{self.misses} of {self.tasks} deadlines missed, at most {self.max_lateness:.1f} s late'
+
+
+class DeadlineScheduler:
+    """ Keeps tasks with a hard deadline, e.g. the latest time to open a frying iron, on time.
+
+    Ready jobs whose next task has a deadline go before any other work, earliest deadline first.
+    Other work is only started if the arm is still free in time for the deadline tasks that are
+    coming up, judged by task_duration(task) estimates and the finish time of the task each of
+    those jobs waits on. The reservation models a single arm, with more robots it is cautious.
+    Without duration estimates no arm time is reserved. """
+
+    def __init__(self, task_duration=None, margin=0.0, clock=None):
+        self.task_duration = task_duration
+        self.margin = margin
+        self.clock = clock
+        self.stats = DeadlineStats()
+
+    def now(self):
+        return self.clock() if self.clock is not None else get_timer_service().now()
+
+    def record_start(self, task):
+        self.stats.record(task, self.now())
+
+    def select_due(self, coordinator, accept=None):
+        """ The ready job with the earliest deadline on its next task, None if there is none """
+        return coordinator.ready_queue.get_due(accept)
+
+    def get_upcoming(self, coordinator) -> List[tuple]:
+        """ (ready time, tasks) of every job whose next tasks have deadlines, the tasks in job order """
+        now = self.now()
+        upcoming = list()
+        for job in coordinator.ready_queue.get_deadline_jobs():
+            tasks = list()
+            for task in job.get_upcoming_tasks():
+                if task.get_deadline() is None:
+                    break
+                tasks.append(task)
+            if len(tasks) == 0:
+                continue
+            ready_time = job.get_ready_time(now)
+            if ready_time is None:
+                continue
+            upcoming.append((ready_time, tasks))
+        return upcoming
+
+    def can_start(self, coordinator, job) -> bool:
+        """ False if running the next task of job now would make the upcoming deadline tasks later """
+        check = self.get_start_check(coordinator)
+        return check is None or check(job)
+
+    def get_start_check(self, coordinator):
+        """ can_start for the candidates of one selection, with the upcoming deadline tasks looked up
+            once. None if every job can start """
+        if self.task_duration is None or not coordinator.ready_queue.has_deadline_jobs():
+            return None
+        upcoming = self.get_upcoming(coordinator)
+        if len(upcoming) == 0:
+            return None
+        now = self.now()
+        lateness = self._lateness(now, upcoming)
+
+        def check(job):
+            task = job.get_next_task()
+            if task is None or task.get_deadline() is not None:
+                return True
+            return self._lateness(now + self.task_duration(task), upcoming) <= lateness
+        return check
+
+    def _lateness(self, arm_free, upcoming):
+        """ Total lateness of the upcoming deadline tasks if the arm is free from arm_free on """
+        # earliest deadline first over the jobs, a job's tasks run one after the other
+        chains = [[ready_time, list(tasks)] for ready_time, tasks in upcoming]
+        lateness = 0.0
+        while chains:
+            chain = min(chains, key=lambda x: x[1][0].get_deadline())
+            task = chain[1].pop(0)
+            start = max(arm_free, chain[0])
+            lateness += max(0.0, start - (task.get_deadline() - self.margin))
+            arm_free = start + self.task_duration(task)
+            chain[0] = arm_free
+            if len(chain[1]) == 0:
+                chains.remove(chain)
+        return lateness
@@ -0,0 +1,58 @@
+from timer.timer import get_timer_service
+from typing import List
+import itertools
+
+_order_ids = itertools.count(1)
+
+
+class Order:
+    """ A customer order for one waffle of a variant, created is on the timer service clock """
+
+    def __init__(self, variant="plain", created=None):
+        self.id = next(_order_ids)
+        self.variant = variant
+        self.created = created if created is not None else get_timer_service().now()
+
+    def get_variant(self):
+        return self.variant
+
+    def get_age(self, now):
+        return now - self.created
+
+    def __str__(self):
+        return f'Order {self.id} ({self.variant})'
+
+
+class OrderBatcher:
+    """ Decides how many waiting orders go to an iron and when.
+
+    An iron whose slots can all be filled is used right away, like the largest free iron when
+    there are more orders than it has slots. An iron that would be left partly empty is only
+    used once the oldest order has waited max_wait seconds, so more orders can come in and fill
+    it. max_wait is the latency/throughput trade-off: 0 dispatches immediately, a longer wait
+    fills the big irons better and fries more waffles per cycle. """
+
+    def __init__(self, max_wait=0.0):
+        self.max_wait = max_wait
+
+    def get_capacity(self, orders: List[Order], free_capacities: List[int], now):
+        """ Slot count of the iron to fill from the free capacities, None to keep waiting """
+        if len(orders) == 0 or len(free_capacities) == 0:
+            return None
+        count = len(orders)
+        fitting = [capacity for capacity in free_capacities if capacity >= count]
+        if len(fitting) == 0:
+            return max(free_capacities)
+        if min(fitting) == count or orders[0].get_age(now) >= self.max_wait:
+            return min(fitting)
+        # fill a smaller iron completely while the rest waits for company
+        smaller = [capacity for capacity in free_capacities if capacity < count]
+        if smaller:
+            return max(smaller)
+        return None
+
+    def get_dispatch_time(self, orders: List[Order]):
+        """ When a partly filled iron is used at the latest, None without orders """
+        if len(orders) == 0:
+            return None
+        return orders[0].created + self.max_wait
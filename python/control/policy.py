@@ -0,0 +1,126 @@
+from control.control import SchedulingPolicy, BaseJob, need_toolchange
+from typing import Dict
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def leading_run(job: BaseJob):
+    """ Tool affinity of the next task and how many tasks in a row from there need it """
+    affinity = None
+    length = 0
+    for task in job.get_upcoming_tasks():
+        if length == 0:
+            affinity = task.get_tool_affinity()
+        elif task.get_tool_affinity() != affinity:
+            break
+        length += 1
+    return affinity, length
+
+
+def urgent_or_ready(coordinator, accept, high_prio_treshold):
+    """ The acceptable ready jobs in ready queue order, only the top priority ones if they are urgent """
+    jobs = [job for job in coordinator.ready_queue.ready_jobs() if accept is None or accept(job)]
+    if jobs and jobs[0].get_current_priority() >= high_prio_treshold:
+        top_prio = jobs[0].get_current_priority()
+        jobs = [job for job in jobs if job.get_current_priority() == top_prio]
+    return jobs
+
+
+class ToolBatchingPolicy(SchedulingPolicy):
+    """ Groups tasks that need the same tool to save tool changes.
+
+    Jobs at or above the high priority treshold, like serving a waffle or starting a frying timer,
+    always go first, but jobs of the same urgent priority are grouped by tool among themselves.
+    The robot keeps its tool as long as a ready job can use it, for at most max_batch tasks in a
+    row while work for other tools waits. When the tool has to change,
+    the tool with the most work queued up is picked: the leading run of same-tool tasks of every
+    ready job, plus that of the jobs whose running task (e.g. a WaitingTask) finishes within
+    horizon seconds, so the tool the fryer needs next is not switched away just before. """
+
+    def __init__(self, horizon=30.0, max_batch=16, clock=None):
+        super().__init__(clock)
+        self.horizon = horizon
+        self.max_batch = max_batch
+        self.batch_length: Dict[object, int] = dict()
+
+    def select_job(self, coordinator, robot=None, accept=None, high_prio_treshold=3):
+        # urgent jobs of the top priority are only reordered among themselves, by tool
+        jobs = urgent_or_ready(coordinator, accept, high_prio_treshold)
+        if len(jobs) == 0:
+            return None
+
+        same_tool = [job for job in jobs if not need_toolchange(job, robot)]
+        if same_tool and (len(same_tool) == len(jobs) or self.batch_length.get(robot, 0) < self.max_batch):
+            return self._selected(same_tool[0], robot)
+
+        demand = self.get_tool_demand(coordinator, jobs)
+        other_tool = [job for job in jobs if job not in same_tool]
+        # most work first, then priority and arrival as the ready queue orders them
+        best = max(enumerate(other_tool), key=lambda x: (demand.get(x[1].get_tool_affinity(), 0), -x[0]))[1]
+        return self._selected(best, robot)
+
+    def get_tool_demand(self, coordinator, ready_jobs) -> Dict[object, int]:
+        """ Tasks that will want each tool soon, keyed by tool affinity """
+        demand = dict()
+        now = self.now()
+        upcoming = list(ready_jobs)
+        for job in coordinator.running_jobs:
+            if job.is_ready():
+                continue
+            ready_time = job.get_ready_time(now)
+            if ready_time is not None and ready_time - now <= self.horizon:
+                upcoming.append(job)
+        for job in upcoming:
+            affinity, length = leading_run(job)
+            demand[affinity] = demand.get(affinity, 0) + length
+        return demand
+
+    def _selected(self, job: BaseJob, robot):
+        if need_toolchange(job, robot):
+            self.batch_length[robot] = 1
+            logger.debug("Tool change for job " + str(job))
+        else:
+            self.batch_length[robot] = self.batch_length.get(robot, 0) + 1
+        return job
+
+
+class EarliestDeadlinePolicy(SchedulingPolicy):
+    """ The job with the earliest deadline first, urgent tasks still go before anything else.
+
+    Jobs get the deadline created + due_time unless they already have one, jobs without a
+    deadline come last in the ready queue order. """
+
+    def __init__(self, due_time=600.0, clock=None):
+        super().__init__(clock)
+        self.due_time = due_time
+
+    def job_created(self, coordinator, job):
+        if job.get_deadline() is None:
+            job.deadline = self.now() + self.due_time
+
+    def select_job(self, coordinator, robot=None, accept=None, high_prio_treshold=3):
+        jobs = urgent_or_ready(coordinator, accept, high_prio_treshold)
+        if len(jobs) == 0:
+            return None
+        return min(enumerate(jobs), key=lambda x: (x[1].get_deadline() is None, x[1].get_deadline() or 0, x[0]))[1]
+
+
+class ShortestRemainingWorkPolicy(SchedulingPolicy):
+    """ The job with the least work left first, so finished waffles leave the cell sooner.
+
+    task_duration(task) estimates the robot time of a task, by default every task counts as one.
+    Urgent tasks still go before anything else. """
+
+    def __init__(self, task_duration=None, clock=None):
+        super().__init__(clock)
+        self.task_duration = task_duration if task_duration is not None else lambda task: 1
+
+    def get_remaining_work(self, job: BaseJob):
+        return sum(self.task_duration(task) for task in job.get_upcoming_tasks())
+
+    def select_job(self, coordinator, robot=None, accept=None, high_prio_treshold=3):
+        jobs = urgent_or_ready(coordinator, accept, high_prio_treshold)
+        if len(jobs) == 0:
+            return None
+        return min(enumerate(jobs), key=lambda x: (self.get_remaining_work(x[1]), x[0]))[1]
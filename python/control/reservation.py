@@ -0,0 +1,264 @@
+from control.control import ResourceHandler
+from world.world import Equipment
+from typing import Dict, List
+import bisect
+import heapq
+import itertools
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Reservation:
+    """ Handle for capacity reserved on one Equipment, release it when done """
+
+    def __init__(self, manager: 'ReservationManager', item_name, item: Equipment, capacity, expires_at=None):
+        self.manager = manager
+        self.item_name = item_name
+        self.item = item
+        self.capacity = capacity
+        self.expires_at = expires_at
+        self.active = True
+
+    def release(self):
+        self.manager.release(self)
+
+    def is_active(self):
+        return self.active
+
+    def get_item(self) -> Equipment:
+        return self.item
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def __str__(self):
+        return f'Reservation of {self.capacity} on {self.item.get_name()}'
+
+
+class ReservedItemIndex:
+    """ The reserved items of one item type that have capacity left, bucketed by capacity left.
+
+    Each bucket is a heap of (insertion order, version, item). An item is pushed again whenever
+    its capacity left changes, entries of older versions are dropped when they come up. """
+
+    def __init__(self):
+        self.lefts = list()
+        self.buckets: Dict[int, list] = dict()
+        self.versions = dict()
+        self._version = itertools.count()
+
+    def update(self, item: Equipment, order):
+        version = next(self._version)
+        self.versions[item] = version
+        left = item.get_reserve_capacity_left()
+        if left <= 0:
+            return
+        if left not in self.buckets:
+            bisect.insort(self.lefts, left)
+            self.buckets[left] = list()
+        heapq.heappush(self.buckets[left], (order, version, item))
+
+    def remove(self, item: Equipment):
+        self.versions.pop(item, None)
+
+    def best_fit(self, capacity):
+        """ (capacity left, insertion order, item) of the item with the least capacity left that
+            fits, the first added on ties, None if none fits """
+        for inx in range(bisect.bisect_left(self.lefts, capacity), len(self.lefts)):
+            left = self.lefts[inx]
+            heap = self.buckets[left]
+            while heap and self.versions.get(heap[0][2]) != heap[0][1]:
+                heapq.heappop(heap)
+            if heap:
+                return left, heap[0][0], heap[0][2]
+        return None
+
+
+class ReservationStats:
+    """ Counters for one item type """
+
+    def __init__(self):
+        self.attempts = 0
+        self.granted = 0
+        self.denied = 0
+        self.released = 0
+        self.expired = 0
+        self.contended = 0
+        self.lock_wait_time = 0.0
+        self.reserve_wait_time = 0.0
+
+    def as_dict(self) -> dict:
+        return dict(self.__dict__)
+
+
+class ReservationManager:
+    """ Atomic capacity reservations on the equipment of a ResourceHandler.
+
+    A reservation takes capacity of one item, a free item is checked out by its first reservation
+    and checked in again when its last reservation is released or expires. Each item type is
+    guarded by its own lock in the ResourceHandler, so requesters of different types never wait
+    for each other and checkout_prechecked_item cannot hand out a reserved item. """
+
+    def __init__(self, res_handler: ResourceHandler, default_ttl=None, clock=time.monotonic):
+        self.res_handler = res_handler
+        self.default_ttl = default_ttl
+        self.clock = clock
+        # the active reservations per item type, in reservation order
+        self.reservations: Dict[str, Dict[Reservation, None]] = dict()
+        # per item type the items checked out by reservations, free items come from the free index
+        self.checked_out: Dict[str, set] = dict()
+        self.reserved_index: Dict[str, ReservedItemIndex] = dict()
+        # per item type a heap of (expires_at, seq, reservation), released ones are skipped when due
+        self.expiry: Dict[str, list] = dict()
+        self._seq = itertools.count()
+        self.conditions: Dict[str, threading.Condition] = dict()
+        self.stats: Dict[str, ReservationStats] = dict()
+        self.registry_lock = threading.Lock()
+
+    def _condition(self, item_name) -> threading.Condition:
+        with self.registry_lock:
+            if item_name not in self.conditions:
+                self.conditions[item_name] = threading.Condition(self.res_handler.get_lock(item_name))
+                self.reservations[item_name] = dict()
+                self.checked_out[item_name] = set()
+                self.reserved_index[item_name] = ReservedItemIndex()
+                self.expiry[item_name] = list()
+                self.stats[item_name] = ReservationStats()
+            return self.conditions[item_name]
+
+    def _acquire(self, item_name) -> threading.Condition:
+        condition = self._condition(item_name)
+        if not condition.acquire(blocking=False):
+            start = time.perf_counter()
+            condition.acquire()
+            self.stats[item_name].contended += 1
+            self.stats[item_name].lock_wait_time += time.perf_counter() - start
+        return condition
+
+    def try_reserve(self, item_name, capacity=1, ttl=None) -> Reservation:
+        """ Reserve capacity on the best fitting item without waiting, None if nothing fits """
+        condition = self._acquire(item_name)
+        try:
+            return self._try_reserve_locked(item_name, capacity, ttl)
+        finally:
+            condition.release()
+
+    def reserve(self, item_name, capacity=1, timeout=None, ttl=None) -> Reservation:
+        """ Like try_reserve but waits up to timeout seconds for capacity to be released """
+        condition = self._acquire(item_name)
+        start = time.perf_counter()
+        try:
+            deadline = None if timeout is None else start + timeout
+            while True:
+                reservation = self._try_reserve_locked(item_name, capacity, ttl)
+                if reservation is not None:
+                    return reservation
+                remaining = None if deadline is None else deadline - time.perf_counter()
+                if remaining is not None and remaining <= 0:
+                    return None
+                # expiring reservations do not notify, so poll for them at least once a second
+                condition.wait(1.0 if remaining is None else min(remaining, 1.0))
+        finally:
+            self.stats[item_name].reserve_wait_time += time.perf_counter() - start
+            condition.release()
+
+    def _try_reserve_locked(self, item_name, capacity, ttl) -> Reservation:
+        stats = self.stats[item_name]
+        stats.attempts += 1
+        self._expire_locked(item_name)
+
+        best = self._best_fit_locked(item_name, capacity)
+        if best is None:
+            stats.denied += 1
+            return None
+
+        if best.is_free():
+            best.free = False
+            self.checked_out[item_name].add(best)
+        best.reserve_capacity_used += capacity
+        best.has_reservation = True
+        self.reserved_index[item_name].update(best, self.res_handler.free_index[item_name].get_order(best))
+        ttl = self.default_ttl if ttl is None else ttl
+        reservation = Reservation(self, item_name, best, capacity, None if ttl is None else self.clock() + ttl)
+        self.reservations[item_name][reservation] = None
+        if reservation.expires_at is not None:
+            heapq.heappush(self.expiry[item_name], (reservation.expires_at, next(self._seq), reservation))
+        stats.granted += 1
+        return reservation
+
+    def _best_fit_locked(self, item_name, capacity) -> Equipment:
+        """ The item with the least capacity left that still fits, the first added on ties, from the
+            free index of the ResourceHandler or the index of the items reserved already """
+        index = self.res_handler.free_index.get(item_name)
+        if index is None:
+            return None
+        best = index.best_fit_free(capacity)
+        reserved = self.reserved_index[item_name].best_fit(capacity)
+        if reserved is not None and (best is None or reserved[:2] < (best.get_reserve_capacity_left(),
+                                                                     index.get_order(best))):
+            return reserved[2]
+        return best
+
+    def release(self, reservation: Reservation):
+        condition = self._acquire(reservation.item_name)
+        try:
+            if self._release_locked(reservation):
+                self.stats[reservation.item_name].released += 1
+        finally:
+            condition.release()
+
+    def _release_locked(self, reservation: Reservation) -> bool:
+        if not reservation.active:
+            return False
+        reservation.active = False
+        del self.reservations[reservation.item_name][reservation]
+        item = reservation.item
+        item.reserve_capacity_used -= reservation.capacity
+        reserved_index = self.reserved_index[reservation.item_name]
+        if item.reserve_capacity_used <= 0:
+            item.reserve_capacity_used = 0
+            item.has_reservation = False
+            reserved_index.remove(item)
+            checked_out = self.checked_out[reservation.item_name]
+            if item in checked_out:
+                checked_out.discard(item)
+                self.res_handler.check_in(item)
+        else:
+            reserved_index.update(item, self.res_handler.free_index[reservation.item_name].get_order(item))
+        self.conditions[reservation.item_name].notify_all()
+        return True
+
+    def expire_reservations(self, item_name):
+        condition = self._acquire(item_name)
+        try:
+            self._expire_locked(item_name)
+        finally:
+            condition.release()
+
+    def _expire_locked(self, item_name):
+        heap = self.expiry[item_name]
+        now = self.clock()
+        while heap and heap[0][0] <= now:
+            reservation = heapq.heappop(heap)[2]
+            if reservation.active:
+                logger.info(str(reservation) + " expired")
+                if self._release_locked(reservation):
+                    self.stats[item_name].expired += 1
+
+    def get_reservations(self, item_name) -> List[Reservation]:
+        condition = self._acquire(item_name)
+        try:
+            return list(self.reservations[item_name])
+        finally:
+            condition.release()
+
+    def get_stats(self) -> Dict[str, dict]:
+        """ Contention metrics per item type """
+        with self.registry_lock:
+            return {item_name: stats.as_dict() for item_name, stats in self.stats.items()}
@@ -0,0 +1,114 @@
+from control.control import BaseJob, DagJob
+from collections import namedtuple
+from typing import Tuple
+
+
+class Param:
+    """ Placeholder in a template, resolved from the bindings of each job.
+
+    Param("iron") is the bound value, Param("orders", 0) an item of a bound sequence or None
+    if the sequence is shorter. """
+
+    __slots__ = ("name", "index")
+
+    def __init__(self, name, index=None):
+        self.name = name
+        self.index = index
+
+    def resolve(self, bindings):
+        value = bindings[self.name]
+        if self.index is None:
+            return value
+        return value[self.index] if self.index < len(value) else None
+
+
+class Computed(Param):
+    """ Value computed from the bindings of each job by func(bindings) """
+
+    __slots__ = ("func",)
+
+    def __init__(self, func):
+        super().__init__(None)
+        self.func = func
+
+    def resolve(self, bindings):
+        return self.func(bindings)
+
+
+TaskStep = namedtuple("TaskStep", "key task_cls name static_args params deadline_after slack after")
+
+
+class JobBlueprint:
+    """ A compiled JobTemplate, the immutable task sequence that jobs are instantiated from """
+
+    __slots__ = ("name", "steps")
+
+    def __init__(self, name, steps: Tuple[TaskStep, ...]):
+        self.name = name
+        self.steps = steps
+
+    def instantiate(self, job: BaseJob, **bindings) -> BaseJob:
+        """ Fill a new job with one task per step.
+
+        A DagJob gets the dependencies of the steps, a step without after depends on the step
+        before it. Other jobs run the steps in order, which satisfies every dependency. """
+        tasks = dict()
+        previous = None
+        for step in self.steps:
+            args = dict(step.static_args)
+            for key, param in step.params:
+                args[key] = param.resolve(bindings)
+            task = step.task_cls(step.name, **args)
+            if isinstance(job, DagJob):
+                if step.after is not None:
+                    job.add_task(task, [tasks[key] for key in step.after])
+                else:
+                    job.add_task(task, [previous] if previous is not None else [])
+            else:
+                job.task_queue.appendleft(task)
+            previous = task
+            if step.key is not None:
+                tasks[step.key] = task
+            if step.deadline_after is not None:
+                slack = step.slack.resolve(bindings) if isinstance(step.slack, Param) else step.slack
+                tasks[step.deadline_after].add_deadline_task(task, slack)
+        return job
+
+    def __len__(self):
+        return len(self.steps)
+
+
+class JobTemplate:
+    """ Declarative description of the tasks of a job, in execution order.
+
+    Task arguments are either constants or Params bound per job. A step with deadline_after has
+    to start at most slack seconds after the keyed waiting step is over. after lists the keys of
+    the steps a step depends on, by default it depends on the step before it. """
+
+    def __init__(self, name):
+        self.name = name
+        self.steps = list()
+
+    def add(self, task_cls, name, key=None, deadline_after=None, slack=0.0, after=None, **args) -> 'JobTemplate':
+        self.steps.append((key, task_cls, name, args, deadline_after, slack, after))
+        return self
+
+    def compile(self) -> JobBlueprint:
+        steps = list()
+        keys = set()
+        for key, task_cls, name, args, deadline_after, slack, after in self.steps:
+            if deadline_after is not None and deadline_after not in keys:
+                raise ValueError("Step " + name + " has a deadline after unknown step " + str(deadline_after))
+            if after is not None:
+                after = tuple(after)
+                for prereq in after:
+                    if prereq not in keys:
+                        raise ValueError("Step " + name + " depends on unknown step " + str(prereq))
+            if key is not None:
+                if key in keys:
+                    raise ValueError("Duplicate step key " + str(key))
+                keys.add(key)
+            static_args = tuple((k, v) for k, v in args.items() if not isinstance(v, Param))
+            params = tuple((k, v) for k, v in args.items() if isinstance(v, Param))
+            steps.append(TaskStep(key, task_cls, name, static_args, params, deadline_after, slack, after))
+        return JobBlueprint(self.name, tuple(steps))
@@ -0,0 +1,258 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+from typing import Iterator
+from metrics.metrics import get_metrics
+
+""" Logging that keeps disk and console I/O off the threads that log.
+
+The loggers only put records on a queue, a listener thread formats them and writes them in
+batches to a size and time rotated log file, the console and optionally a JSON lines event file
+that can be read back and replayed later:
+
+    pipeline = LogPipeline("debug.log", events_path="events.jsonl")
+    pipeline.start()
+    ...
+    pipeline.stop()
+    for record in read_events("events.jsonl"): ... """
+
+DEFAULT_FORMAT = '%(asctime)s %(name)s %(levelname)s:%(message)s'
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """ QueueHandler that leaves formatting to the listener thread and never blocks.
+
+    The stock QueueHandler formats every record before queuing it, on the logging thread. The
+    records are passed on unformatted instead, which is fine within a process. When the queue
+    is full the record is dropped and counted rather than waiting for the listener. """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            get_metrics().inc("log_records_dropped")
+
+
+class FlushingQueueListener(logging.handlers.QueueListener):
+    """ QueueListener that flushes its handlers whenever the queue has been idle for flush_interval,
+        so batching handlers do not hold records back while nothing is logged.
+
+    A listener can be attached to a logger, stopping it then takes the queue handler off the
+    logger again and restores its propagation. """
+
+    def __init__(self, log_queue, *handlers, flush_interval=1.0):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.flush_interval = flush_interval
+        self.logger = None
+        self.queue_handler = None
+        self.propagate = True
+
+    def attach(self, logger: logging.Logger, queue_handler: logging.handlers.QueueHandler, propagate=False):
+        """ Send the records of logger through queue_handler, which has to feed this listener """
+        self.logger = logger
+        self.queue_handler = queue_handler
+        self.propagate = logger.propagate
+        logger.addHandler(queue_handler)
+        logger.propagate = propagate
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(block, self.flush_interval if block else None)
+            except queue.Empty:
+                if not block:
+                    raise
+                for handler in self.handlers:
+                    handler.flush()
+
+    def stop(self):
+        if self.logger is not None:
+            self.logger.removeHandler(self.queue_handler)
+            self.logger.propagate = self.propagate
+            self.logger = None
+        super().stop()
+        for handler in self.handlers:
+            handler.flush()
+
+
+class BatchingRotatingFileHandler(logging.handlers.BaseRotatingHandler):
+    """ Log file written in batches and rotated by size and/or age.
+
+    Records are written to the file buffer and flushed to disk once batch_size records are
+    pending or the oldest pending record is flush_interval seconds old, instead of once per
+    record. The file rolls over to path.1 ... path.<backup_count> when it would grow beyond
+    about max_bytes or has been open for rotate_interval seconds, 0 disables either limit. """
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, rotate_interval=0.0, backup_count=5,
+                 batch_size=256, flush_interval=1.0, mode="a", encoding="utf-8", clock=time.monotonic):
+        super().__init__(path, mode, encoding, delay=False)
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.opened_at = clock()
+        self.size = self._file_size()
+        self.pending = 0
+        self.oldest_pending = None
+
+    def _file_size(self):
+        return os.path.getsize(self.baseFilename) if os.path.exists(self.baseFilename) else 0
+
+    def emit(self, record):
+        try:
+            text = self.format(record) + self.terminator
+            if self._should_rollover(text):
+                self.doRollover()
+            self.stream.write(text)
+            self.size += len(text)
+            self.pending += 1
+            if self.oldest_pending is None:
+                self.oldest_pending = self.clock()
+            if self.pending >= self.batch_size or self.clock() - self.oldest_pending >= self.flush_interval:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        super().flush()
+        self.pending = 0
+        self.oldest_pending = None
+
+    def _should_rollover(self, text):
+        if self.stream is None or self.size == 0:
+            return False
+        if self.rotate_interval > 0 and self.clock() - self.opened_at >= self.rotate_interval:
+            return True
+        # counted in characters, stream.tell() would flush the batch
+        return 0 < self.max_bytes < self.size + len(text)
+
+    def doRollover(self):
+        if self.stream:
+            self.flush()
+            self.stream.close()
+            self.stream = None
+        if self.backup_count > 0:
+            for inx in range(self.backup_count - 1, 0, -1):
+                source = self.rotation_filename(f'{self.baseFilename}.{inx}')
+                if os.path.exists(source):
+                    os.replace(source, self.rotation_filename(f'{self.baseFilename}.{inx + 1}'))
+            self.rotate(self.baseFilename, self.rotation_filename(self.baseFilename + ".1"))
+        else:
+            # without backups the file starts over
+            self.mode = "w"
+        self.stream = self._open()
+        self.opened_at = self.clock()
+        self.size = 0
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """ One JSON object per record with the fields needed to rebuild it by read_events """
+
+    def format(self, record):
+        event = {"created": record.created, "name": record.name, "levelno": record.levelno,
+                 "levelname": record.levelname, "threadName": record.threadName, "msg": record.getMessage()}
+        if record.exc_info:
+            event["exc_text"] = self.formatException(record.exc_info)
+        return json.dumps(event)
+
+
+def read_events(path) -> Iterator[logging.LogRecord]:
+    """ The records of a JSON lines event file as LogRecords, the message already formatted """
+    with open(path, encoding="utf-8") as events:
+        for line in events:
+            if line.strip():
+                yield logging.makeLogRecord(json.loads(line))
+
+
+def replay(path, min_level=logging.NOTSET):
+    """ Send the records of an event file to the loggers they came from again, e.g. to run
+        them through other handlers or filters. Returns the number of records replayed """
+    count = 0
+    for record in read_events(path):
+        if record.levelno >= min_level:
+            logger = logging.getLogger(record.name)
+            if logger.isEnabledFor(record.levelno):
+                logger.handle(record)
+                count += 1
+    return count
+
+
+class LogPipeline:
+    """ Routes the root logger through a queue to a rotated log file, the console and optionally
+        a JSON lines event file, all written on one listener thread """
+
+    def __init__(self, path="debug.log", level=logging.DEBUG, console_level=logging.DEBUG, events_path=None,
+                 max_bytes=10 * 1024 * 1024, rotate_interval=0.0, backup_count=5, batch_size=256,
+                 flush_interval=1.0, max_records=100000, fmt=DEFAULT_FORMAT):
+        self.level = level
+        self.handlers = list()
+        if path is not None:
+            self.handlers.append(self._with_format(
+                BatchingRotatingFileHandler(path, max_bytes, rotate_interval, backup_count, batch_size, flush_interval),
+                logging.Formatter(fmt)))
+        if console_level is not None:
+            console = logging.StreamHandler(sys.stdout)
+            console.setLevel(console_level)
+            self.handlers.append(console)
+        if events_path is not None:
+            self.handlers.append(self._with_format(
+                BatchingRotatingFileHandler(events_path, max_bytes, rotate_interval, backup_count, batch_size,
+                                            flush_interval),
+                JsonLinesFormatter()))
+        self.queue_handler = DeferredQueueHandler(queue.Queue(max_records))
+        self.listener = FlushingQueueListener(self.queue_handler.queue, *self.handlers, flush_interval=flush_interval)
+        self.previous_handlers = list()
+        self.previous_level = None
+
+    @staticmethod
+    def _with_format(handler: logging.Handler, formatter: logging.Formatter) -> logging.Handler:
+        handler.setFormatter(formatter)
+        return handler
+
+    def start(self):
+        """ Replace the handlers of the root logger by the queue """
+        root = logging.getLogger()
+        self.previous_handlers = list(root.handlers)
+        self.previous_level = root.level
+        for handler in self.previous_handlers:
+            root.removeHandler(handler)
+        root.addHandler(self.queue_handler)
+        root.setLevel(self.level)
+        self.listener.start()
+
+    def stop(self):
+        """ Write out what is queued, close the files and restore the root logger """
+        root = logging.getLogger()
+        root.removeHandler(self.queue_handler)
+        for handler in self.previous_handlers:
+            root.addHandler(handler)
+        if self.previous_level is not None:
+            root.setLevel(self.previous_level)
+        self.listener.stop()
+        for handler in self.handlers:
+            if isinstance(handler, logging.FileHandler):
+                handler.close()
+
+    def get_dropped(self) -> int:
+        return self.queue_handler.dropped
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,229 @@
+import bisect
+import functools
+import itertools
+import json
+import math
+import threading
+import time
+from typing import Dict, List, Tuple
+
+# upper bounds in seconds, roughly 1-2.5-5 steps from 10 us to 10 s
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    """ Monotonic count of an event """
+
+    def __init__(self, name, labels: Tuple[tuple, ...] = ()):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def snapshot(self) -> dict:
+        return {"name": self.name, "labels": dict(self.labels), "value": self.value}
+
+
+class Histogram:
+    """ Distribution of observed values, e.g. call latencies in seconds, in fixed buckets.
+
+    Only counts per bucket are kept, so observing is constant time and memory does not grow.
+    Quantiles are interpolated within the bucket they fall in. """
+
+    def __init__(self, name, labels: Tuple[tuple, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # the last count is for values above the largest bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        inx = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[inx] += 1
+            self.count += 1
+            self.sum += value
+            if value < self.min:
+                self.min = value
+            if value > self.max:
+                self.max = value
+
+    def get_mean(self):
+        return self.sum / self.count if self.count > 0 else 0.0
+
+    def get_quantile(self, q):
+        """ Estimated value below which a fraction q of the observations lie, 0 without data """
+        with self.lock:
+            counts = list(self.counts)
+            count, low, high = self.count, self.min, self.max
+        if count == 0:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for inx, bucket_count in enumerate(counts):
+            if bucket_count > 0 and seen + bucket_count >= rank:
+                lower = max(low, self.buckets[inx - 1]) if inx > 0 else low
+                upper = min(high, self.buckets[inx]) if inx < len(self.buckets) else high
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return high
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            counts = list(self.counts)
+            count, total = self.count, self.sum
+            low, high = self.min, self.max
+        return {"name": self.name, "labels": dict(self.labels), "count": count, "sum": total,
+                "min": low if count else 0.0, "max": high if count else 0.0,
+                "p50": self.get_quantile(0.5), "p90": self.get_quantile(0.9), "p99": self.get_quantile(0.99),
+                "buckets": [[bound, bucket_count] for bound, bucket_count in zip(self.buckets + (math.inf,), counts)]}
+
+
+class MetricsRegistry:
+    """ The counters and latency histograms of a process, by name and labels.
+
+    Counters are always counted. Timings are taken for one call in sample_every, so histogram
+    counts are of the sampled calls; sample_every=1 times every call. A disabled registry skips
+    both, timed functions then cost one attribute check. """
+
+    def __init__(self, enabled=True, sample_every=1, clock=time.perf_counter):
+        self.enabled = enabled
+        self.sample_every = sample_every
+        self.clock = clock
+        self.counters: Dict[tuple, Counter] = dict()
+        self.histograms: Dict[tuple, Histogram] = dict()
+        self.lock = threading.Lock()
+        self._calls = itertools.count()
+
+    def configure(self, enabled=None, sample_every=None):
+        if enabled is not None:
+            self.enabled = enabled
+        if sample_every is not None:
+            if sample_every < 1:
+                raise ValueError("sample_every must be at least 1")
+            self.sample_every = sample_every
+
+    def counter(self, name, **labels) -> Counter:
+        key = (name, tuple(sorted(labels.items())) if labels else ())
+        counter = self.counters.get(key)
+        if counter is None:
+            with self.lock:
+                counter = self.counters.setdefault(key, Counter(name, key[1]))
+        return counter
+
+    def histogram(self, name, **labels) -> Histogram:
+        key = (name, tuple(sorted(labels.items())) if labels else ())
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram(name, key[1]))
+        return histogram
+
+    def inc(self, name, amount=1, **labels):
+        if self.enabled:
+            self.counter(name, **labels).inc(amount)
+
+    def start_timing(self):
+        """ Start time of a sampled call, None if the call is not timed """
+        if not self.enabled or (self.sample_every > 1 and next(self._calls) % self.sample_every != 0):
+            return None
+        return self.clock()
+
+    def stop_timing(self, start, name, **labels):
+        """ Record the time since start_timing, nothing if that call was not sampled """
+        if start is not None:
+            self.histogram(name, **labels).observe(self.clock() - start)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            counters = list(self.counters.values())
+            histograms = list(self.histograms.values())
+        return {"sample_every": self.sample_every,
+                "counters": [counter.snapshot() for counter in counters],
+                "histograms": [histogram.snapshot() for histogram in histograms]}
+
+    def to_json(self) -> str:
+        # json has no infinity, the overflow bucket is written as "+Inf" like in prometheus
+        snapshot = self.snapshot()
+        for histogram in snapshot["histograms"]:
+            histogram["buckets"][-1][0] = "+Inf"
+        return json.dumps(snapshot)
+
+    def to_prometheus(self) -> str:
+        """ The snapshot in the Prometheus text exposition format """
+        snapshot = self.snapshot()
+        lines: List[str] = list()
+        typed = set()
+        for counter in snapshot["counters"]:
+            name = counter["name"] + "_total"
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name}{_prometheus_labels(counter["labels"])} {counter["value"]}')
+        for histogram in snapshot["histograms"]:
+            name = histogram["name"]
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} histogram')
+            cumulative = 0
+            for bound, bucket_count in histogram["buckets"]:
+                cumulative += bucket_count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(f'{name}_bucket{_prometheus_labels(histogram["labels"], le=le)} {cumulative}')
+            lines.append(f'{name}_sum{_prometheus_labels(histogram["labels"])} {histogram["sum"]!r}')
+            lines.append(f'{name}_count{_prometheus_labels(histogram["labels"])} {histogram["count"]}')
+        return "\n".join(lines) + "\n"
+
+
+def _prometheus_labels(labels: dict, **extra) -> str:
+    labels = dict(labels, **extra)
+    if len(labels) == 0:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels.keys(), escaped)) + "}"
+
+
+def timed(name, **labels):
+    """ Decorator recording the duration of every sampled call in the histogram name """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            metrics = _default_registry
+            start = metrics.start_timing()
+            if start is None:
+                return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metrics.stop_timing(start, name, **labels)
+        return wrapper
+    return decorator
+
+
+_default_registry = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    """ The shared MetricsRegistry the instrumented code records to """
+    return _default_registry
+
+
+def set_metrics(registry: MetricsRegistry):
+    """ Replace the shared MetricsRegistry, e.g. with a fresh one in tests and benchmarks """
+    global _default_registry
+    _default_registry = registry
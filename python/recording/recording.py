@@ -0,0 +1,265 @@
+import json
+import logging
+import queue
+import threading
+import time
+from typing import List, Dict, Optional
+from timer.timer import get_timer_service
+from robot.robot import MelfaMessage, MelfaResponseType, MySerial
+
+""" Session traces: order arrivals, dispatched tasks and Melfa traffic, for replaying later.
+
+A TraceRecorder is attached to a JobCoordinator and/or a MySerial and writes one JSON object
+per event. load_trace reads it back; the arrivals can be run through the simulator again and the
+Melfa commands through MySerial against a ReplayPort, and the outcome compared with the
+recording by compare_dispatches. """
+
+logger = logging.getLogger(__name__)
+
+# queued by TraceRecorder.close after the last event
+_STOP = object()
+
+
+class TraceRecorder:
+    """ Writes the events of a session as JSON lines, times in seconds since the recorder started.
+
+    Times come from clock, by default the shared TimerService at the time of the event, so a
+    trace of a simulation has the simulated times. Orders are referred to by their arrival number
+    in the trace, as the order ids are not the same in another run.
+
+    The recording threads only queue the events, a writer thread serializes and writes them in
+    batches. flush waits until everything queued is written, close also closes the stream. When
+    writing fails the error is logged, later events are dropped and flush raises the error. """
+
+    def __init__(self, stream, clock=None, batch_size=256):
+        self.stream = stream
+        self.clock = clock
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.order_numbers: Dict[int, int] = dict()
+        self.start = self.now()
+        self.events = queue.Queue()
+        self.closed = False
+        self.error: Optional[Exception] = None
+        self.writer = threading.Thread(target=self._write_events, name="trace-recorder", daemon=True)
+        self.writer.start()
+
+    def now(self):
+        return self.clock() if self.clock is not None else get_timer_service().now()
+
+    def reset_clock(self):
+        """ Count the times from now, e.g. once a simulation has set its virtual clock """
+        self.start = self.now()
+
+    @classmethod
+    def open(cls, path, clock=None) -> 'TraceRecorder':
+        return cls(open(path, "w", encoding="utf-8"), clock)
+
+    def attach(self, coordinator=None, serial=None):
+        if coordinator is not None:
+            coordinator.recorder = self
+        if serial is not None:
+            serial.recorder = self
+
+    def record(self, kind, **fields):
+        if self.error is not None:
+            return
+        fields["kind"] = kind
+        fields["t"] = round(self.now() - self.start, 6)
+        self.events.put(fields)
+
+    def _write_events(self):
+        while True:
+            events = [self.events.get()]
+            try:
+                while len(events) < self.batch_size:
+                    events.append(self.events.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                if self.error is None:
+                    self.stream.write("".join(json.dumps(event) + "\n" for event in events if event is not _STOP))
+            except Exception as error:
+                logger.exception("Writing the trace failed, recording stops")
+                self.error = error
+            finally:
+                for _ in events:
+                    self.events.task_done()
+            if events[-1] is _STOP:
+                return
+
+    def order_added(self, order):
+        with self.lock:
+            number = self.order_numbers.setdefault(order.id, len(self.order_numbers))
+        self.record("order", order=number, variant=order.get_variant())
+
+    def task_dispatched(self, job, task, robot=None):
+        orders = job.orders if job.orders is not None else list()
+        self.record("dispatch", task=task.get_name(), type=type(task).__name__,
+                    robot=robot.get_name() if robot is not None else None,
+                    iron=job.iron.get_name() if job.iron is not None else None,
+                    orders=[self.order_numbers.get(order.id) for order in orders])
+
+    def melfa_round_trip(self, content, response, seconds):
+        self.record("melfa", cmd=content, response=response, seconds=round(seconds, 6))
+
+    def flush(self):
+        self.events.join()
+        if self.error is not None:
+            raise self.error
+        self.stream.flush()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        self.events.put(_STOP)
+        self.writer.join()
+        self.stream.close()
+
+
+class Trace:
+    """ The events of a recorded session by kind, in recording order """
+
+    def __init__(self, events: List[dict]):
+        self.events = events
+        self.orders = [event for event in events if event["kind"] == "order"]
+        self.dispatches = [event for event in events if event["kind"] == "dispatch"]
+        self.melfa = [event for event in events if event["kind"] == "melfa"]
+
+    def get_arrivals(self) -> List[float]:
+        return [event["t"] for event in self.orders]
+
+    def get_variants(self) -> List[str]:
+        return [event["variant"] for event in self.orders]
+
+    def get_order_latencies(self, task_type="ServeWaffle") -> Dict[int, float]:
+        """ Seconds from the arrival of each order until its task_type task was dispatched """
+        arrivals = {event["order"]: event["t"] for event in self.orders}
+        latencies = dict()
+        for event in self.dispatches:
+            if event["type"] == task_type:
+                for order in event["orders"]:
+                    if order in arrivals and order not in latencies:
+                        latencies[order] = event["t"] - arrivals[order]
+        return latencies
+
+
+def load_trace(path) -> Trace:
+    with open(path, encoding="utf-8") as trace:
+        return Trace([json.loads(line) for line in trace if line.strip()])
+
+
+class TraceDiff:
+    """ Where two traces of the same arrivals first dispatched different tasks, and how the order
+        latencies moved between them """
+
+    def __init__(self, recorded: Trace, replayed: Trace):
+        self.recorded = recorded
+        self.replayed = replayed
+        self.first_divergence = self._find_divergence()
+        recorded_latency = recorded.get_order_latencies()
+        replayed_latency = replayed.get_order_latencies()
+        self.latency_changes = {order: replayed_latency[order] - latency
+                                for order, latency in recorded_latency.items() if order in replayed_latency}
+
+    @staticmethod
+    def _key(event):
+        return event["task"], event["iron"], tuple(event["orders"])
+
+    def _find_divergence(self) -> Optional[int]:
+        recorded, replayed = self.recorded.dispatches, self.replayed.dispatches
+        for inx, (old, new) in enumerate(zip(recorded, replayed)):
+            if self._key(old) != self._key(new):
+                return inx
+        return None if len(recorded) == len(replayed) else min(len(recorded), len(replayed))
+
+    def is_identical(self):
+        return self.first_divergence is None
+
+    def get_mean_latency_change(self):
+        if len(self.latency_changes) == 0:
+            return 0.0
+        return sum(self.latency_changes.values()) / len(self.latency_changes)
+
+    def __str__(self):
+        lines = [f'dispatches: {len(self.recorded.dispatches)} recorded, {len(self.replayed.dispatches)} replayed']
+        if self.first_divergence is None:
+            lines.append("same dispatch order")
+        else:
+            inx = self.first_divergence
+            old = self.recorded.dispatches[inx] if inx < len(self.recorded.dispatches) else None
+            new = self.replayed.dispatches[inx] if inx < len(self.replayed.dispatches) else None
+            lines.append(f'first difference at dispatch {inx}: recorded {old and self._key(old)}, '
+                         f'replayed {new and self._key(new)}')
+        lines.append(f'mean order latency change: {self.get_mean_latency_change():+.1f} s '
+                     f'over {len(self.latency_changes)} orders')
+        return "\n".join(lines)
+
+
+def compare_dispatches(recorded: Trace, replayed: Trace) -> TraceDiff:
+    return TraceDiff(recorded, replayed)
+
+
+class ReplayMismatchError(AssertionError):
+    """ Raised when a replay sends a different Melfa command than the recording """
+
+
+class ReplayPort:
+    """ Stands in for the serial port of a MySerial and answers like the recorded controller did.
+
+    Every written command has to be the next recorded one, readline returns its recorded
+    response. """
+
+    def __init__(self, melfa_events: List[dict]):
+        self.events = list(melfa_events)
+        self.position = 0
+        self.responses = list()
+        self.is_open = True
+
+    def write(self, data: bytes):
+        for line in data.decode("ascii").split("\r\n")[:-1]:
+            if self.position >= len(self.events):
+                raise ReplayMismatchError(f'command {line} was not recorded')
+            event = self.events[self.position]
+            if event["cmd"] != line:
+                raise ReplayMismatchError(f'command {self.position} is {line}, recorded {event["cmd"]}')
+            self.position += 1
+            if event["response"]:
+                self.responses.append(event["response"])
+        return len(data)
+
+    def readline(self) -> bytes:
+        if len(self.responses) == 0:
+            return b""
+        return (self.responses.pop(0) + "\r\n").encode("ascii")
+
+    def is_done(self):
+        return self.position == len(self.events)
+
+    def close(self):
+        self.is_open = False
+
+
+def replay_melfa(trace: Trace, serial) -> List[float]:
+    """ Send the recorded Melfa commands through serial, a MySerial, in order.
+        Returns the round trip times of the replay, in seconds """
+    times = list()
+    for event in trace.melfa:
+        response_type = MelfaResponseType.POSITION if event["response"] else MelfaResponseType.NONE
+        start = time.perf_counter()
+        serial.send_melfa_msg(MelfaMessage(event["cmd"], response_type))
+        times.append(time.perf_counter() - start)
+    return times
+
+
+class ReplaySerial(MySerial):
+    """ MySerial that talks to a ReplayPort of the trace instead of a serial port """
+
+    def __init__(self, trace: Trace, r_timeout=2):
+        self.trace = trace
+        super().__init__("replay", r_timeout=r_timeout)
+
+    def open_serial(self, comport, w_timeout):
+        self.ser = ReplayPort(self.trace.melfa)
@@ -0,0 +1,143 @@
+import asyncio
+from typing import List
+from robot.robot import BaseRobotMovement, MelfaMessage, MySerial, Position, WorkspaceLimits
+from metrics.metrics import get_metrics
+
+""" asyncio counterparts of MySerial and RobotMovement.
+
+The coordinator can await robot commands instead of blocking its thread on serial I/O,
+so planning the next task overlaps with the arm moving. """
+
+
+class AsyncMySerial:
+    """ Melfa line protocol over an asyncio stream reader/writer pair (socket, pty, ...) """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, r_timeout=2):
+        self.reader = reader
+        self.writer = writer
+        self.r_timeout = r_timeout
+        self.lock = asyncio.Lock()
+        self.last_msg = None
+
+    @classmethod
+    async def open_connection(cls, host, port, r_timeout=2) -> 'AsyncMySerial':
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer, r_timeout)
+
+    @classmethod
+    async def from_socket(cls, sock, r_timeout=2) -> 'AsyncMySerial':
+        reader, writer = await asyncio.open_connection(sock=sock)
+        return cls(reader, writer, r_timeout)
+
+    async def send_melfa_msg(self, msg: MelfaMessage) -> str:
+        metrics = get_metrics()
+        start = metrics.start_timing()
+        try:
+            async with self.lock:
+                self.writer.write(msg.encode())
+                await self.writer.drain()
+                self.last_msg = msg
+                if msg.expects_response():
+                    return await self._read_response(msg)
+            return ""
+        finally:
+            metrics.stop_timing(start, "melfa_round_trip_seconds")
+
+    async def send_melfa_msgs(self, msgs: List[MelfaMessage]) -> List[str]:
+        """ Write all messages in one burst, then read the responses in message order """
+        if len(msgs) == 0:
+            return list()
+        metrics = get_metrics()
+        metrics.inc("melfa_burst_messages", len(msgs))
+        start = metrics.start_timing()
+        try:
+            async with self.lock:
+                self.writer.write(b"".join(msg.encode() for msg in msgs))
+                await self.writer.drain()
+                self.last_msg = msgs[-1]
+                return [await self._read_response(msg) if msg.expects_response() else "" for msg in msgs]
+        finally:
+            metrics.stop_timing(start, "melfa_burst_seconds")
+
+    async def _read_response(self, msg: MelfaMessage) -> str:
+        try:
+            response = await asyncio.wait_for(self.reader.readline(), self.r_timeout)
+        except asyncio.TimeoutError:
+            response = b""
+        if len(response) == 0:
+            get_metrics().inc("melfa_timeouts")
+            raise TimeoutError(f'cmd {msg.content} timed out')
+        response = str(response, "utf-8").rstrip()
+        msg.validate_response(response)
+        return response
+
+    def get_last_msg_content(self):
+        return self.last_msg.content
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+class AsyncSerialAdapter:
+    """ Awaitable wrapper of a blocking MySerial, the I/O runs in the default executor """
+
+    def __init__(self, controller: MySerial):
+        self.controller = controller
+
+    async def send_melfa_msg(self, msg: MelfaMessage) -> str:
+        return await asyncio.get_running_loop().run_in_executor(None, self.controller.send_melfa_msg, msg)
+
+    async def send_melfa_msgs(self, msgs: List[MelfaMessage]) -> List[str]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.controller.send_melfa_msgs, msgs)
+
+    def get_last_msg_content(self):
+        return self.controller.get_last_msg_content()
+
+    async def close(self):
+        self.controller.close()
+
+
+class AsyncRobotMovement(BaseRobotMovement):
+    """ RobotMovement with awaitable commands, controller is an AsyncMySerial or AsyncSerialAdapter """
+
+    def __init__(self, controller, limits: WorkspaceLimits = None):
+        super().__init__(controller, limits)
+        self.de_power_task = None
+
+    async def get_position(self) -> Position:
+        """ WHERE - Get current position """
+        curr_pos_str = await self.controller.send_melfa_msg(self._where_msg())
+        return Position.from_string(curr_pos_str)
+
+    async def read_position_inx(self, pos_inx) -> Position:
+        curr_pos_str = await self.controller.send_melfa_msg(self._read_position_msg(pos_inx))
+        return Position.from_string(curr_pos_str)
+
+    async def write_pos_to_controller(self, position, pos_inx):
+        await self.controller.send_melfa_msg(self._write_position_msg(position, pos_inx))
+
+    async def move_straight(self, x=0, y=0, z=0):
+        """ DRAW STRAIGHT - Move from current position with linear interpolation"""
+        await self.controller.send_melfa_msg(self._move_straight_msg(x, y, z))
+
+    async def move_tool_straight(self, distance):
+        await self.controller.send_melfa_msg(self._move_tool_straight_msg(distance))
+
+    async def close_gripper(self):
+        await self._gripper_call(self.gripper_close_port, self.gripper_duration)
+
+    async def open_gripper(self):
+        await self._gripper_call(self.gripper_open_port, self.gripper_duration)
+
+    async def _gripper_call(self, bit_number, duration):
+        """ Returns when the output is set, the output is reset in the background after duration """
+        await self.controller.send_melfa_msg(self._gripper_msg(bit_number))
+        self.de_power_task = asyncio.ensure_future(self._de_power_gripper_later(duration))
+
+    async def _de_power_gripper_later(self, duration):
+        await asyncio.sleep(duration)
+        await self.de_power_gripper()
+
+    async def de_power_gripper(self):
+        await self.controller.send_melfa_msgs(self._de_power_gripper_msgs())
@@ -0,0 +1,243 @@
+import logging
+import os
+import random
+import re
+import select
+import socket
+import threading
+import time
+from typing import Dict, Optional
+from robot.robot import Position
+
+""" A stand-in for the Melfa controller that speaks the line protocol of MySerial.
+
+It runs on a thread behind a TCP socket, for MySerial("socket://127.0.0.1:<port>"), or behind a
+pseudo terminal, for MySerial(<pty name>), and keeps the arm pose, the position table and the
+output bits. Transfer time, motion time and failures can be configured to load test the real
+MySerial and RobotMovement path:
+
+    controller = FakeMelfaController(baudrate=9600, speed=250)
+    port = controller.serve_socket()
+    movement = RobotMovement(MySerial(f'socket://127.0.0.1:{port}'))
+    ...
+    controller.stop() """
+
+logger = logging.getLogger(__name__)
+
+# start bit, 8 data bits, even parity and two stop bits per character, as MySerial configures the port
+BITS_PER_CHAR = 12
+COMMAND_PATTERN = re.compile(r"^(WH|PR|PD|MA|DS|OB)\s*(.*)$")
+# the argument counts each command accepts
+ARGUMENT_COUNTS = {
+    "WH": (0,),
+    "PR": (1,),
+    "PD": (6, 7, 8, 9),
+    "MA": (6, 7, 8, 9),
+    "DS": (1, 3),
+    "OB": (1,),
+}
+
+
+def format_position(position: Position) -> str:
+    """ Position as the controller writes it, e.g. +500.00,+0.00,+46.30,+0.00,+179.99,R,A,O """
+    return ",".join(f'{value:+.2f}' for value in position.get_coordinates()) + \
+        f',{position.arg1},{position.arg2},{position.grip}'
+
+
+def parse_position(values) -> Position:
+    """ Position from x,y,z,A,B[,arg1,arg2,grip], the flags default to R,A,O """
+    if not 5 <= len(values) <= 8:
+        raise ValueError("a position has 5 to 8 values, got " + str(len(values)))
+    coords = [float(value) for value in values[:5]]
+    flags = list(values[5:8]) + ["R", "A", "O"][len(values[5:8]):]
+    return Position(*coords, *flags)
+
+
+class FakeMelfaController:
+    """ Answers WH, PR, PD, MA, DS and OB commands like the controller does.
+
+    baudrate: the transfer time of every command and response, None transfers instantly.
+    speed: mm/s of MA and DS motions, None moves instantly. A command arriving while the arm
+        still moves is handled once the motion is over.
+    settle_time: seconds every motion takes on top, for speeding up and stopping.
+    error_rate: probability that a command gets no answer at all (error_mode "drop") or a
+        garbled one ("garble"), decided by a random generator seeded with seed. """
+    # the gripper ports of RobotMovement and the grip flag they leave in the pose
+    GRIP_BITS = {0: "C", 1: "O"}
+
+    def __init__(self, baudrate=None, speed=None, error_rate=0.0, error_mode="drop", seed=None,
+                 home: Position = None, settle_time=0.0):
+        if error_mode not in ("drop", "garble"):
+            raise ValueError("error_mode must be drop or garble")
+        self.baudrate = baudrate
+        self.speed = speed
+        self.settle_time = settle_time
+        self.error_rate = error_rate
+        self.error_mode = error_mode
+        self.random = random.Random(seed)
+        self.position = home.copy() if home is not None else Position(500, 0, 46.3, 0, 180)
+        self.table: Dict[int, Position] = dict()
+        self.outputs = set()
+        self.commands = 0
+        self.errors = 0
+        self.busy_until = 0.0
+        self.lock = threading.Lock()
+        self.running = False
+        self.threads = list()
+        self.closers = list()
+
+    def handle_line(self, line: str) -> Optional[str]:
+        """ Execute one command, returns the response line or None for commands without one.
+            Raises ValueError for unknown commands and wrong arguments """
+        match = COMMAND_PATTERN.match(line.strip())
+        if match is None:
+            raise ValueError("unknown command:" + line)
+        command, args = match.group(1), [arg for arg in match.group(2).split(",") if arg != ""]
+        if len(args) not in ARGUMENT_COUNTS[command]:
+            raise ValueError(f'{command} takes {" or ".join(map(str, ARGUMENT_COUNTS[command]))} arguments: {line}')
+        with self.lock:
+            self.commands += 1
+            if command == "WH":
+                return format_position(self.position)
+            if command == "PR":
+                return format_position(self.table.get(int(args[0]), Position()))
+            if command == "PD":
+                self.table[int(args[0])] = parse_position(args[1:])
+            elif command == "MA":
+                base = self.table.get(int(args[0]), Position())
+                offset = parse_position(args[1:])
+                target = Position(*[b + o for b, o in zip(base.get_coordinates(), offset.get_coordinates())],
+                                  base.arg1, base.arg2, self.position.grip)
+                self._move_to(target)
+            elif command == "DS":
+                target = self.position.copy()
+                if len(args) == 1:
+                    # along the tool axis, the tool points down
+                    target.z -= float(args[0])
+                else:
+                    target.x, target.y, target.z = [c + float(d) for c, d in zip(self.position.get_coordinates(), args)]
+                self._move_to(target)
+            elif command == "OB":
+                bit = abs(int(args[0]))
+                if args[0].startswith("-"):
+                    self.outputs.discard(bit)
+                else:
+                    self.outputs.add(bit)
+                    if bit in self.GRIP_BITS:
+                        self.position.grip = self.GRIP_BITS[bit]
+            return None
+
+    def _move_to(self, target: Position):
+        duration = self.settle_time
+        if self.speed is not None:
+            distance = sum((a - b) ** 2 for a, b in zip(target.get_coordinates()[:3],
+                                                        self.position.get_coordinates()[:3])) ** 0.5
+            duration += distance / self.speed
+        if duration > 0:
+            self.busy_until = max(self.busy_until, time.monotonic()) + duration
+        self.position = target
+
+    def transfer_time(self, data: bytes) -> float:
+        if self.baudrate is None:
+            return 0.0
+        return len(data) * BITS_PER_CHAR / self.baudrate
+
+    def respond(self, line: bytes, write):
+        """ Handle a received command line with the configured timing, write(bytes) answers """
+        time.sleep(self.transfer_time(line))
+        time.sleep(max(0.0, self.busy_until - time.monotonic()))
+        try:
+            response = self.handle_line(line.decode("ascii"))
+        except Exception:
+            # like the controller, a bad command gets no answer but the next one does
+            logger.warning("Fake controller got an illegal command %r", line, exc_info=True)
+            response = None
+        if response is None:
+            return
+        if self.error_rate > 0 and self.random.random() < self.error_rate:
+            self.errors += 1
+            if self.error_mode == "drop":
+                return
+            response = response.replace(",", ";", 2)
+        data = (response + "\r\n").encode("ascii")
+        time.sleep(self.transfer_time(data))
+        write(data)
+
+    def serve_socket(self, host="127.0.0.1", port=0) -> int:
+        """ Accept MySerial connections on a TCP port, one at a time. Returns the port """
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((host, port))
+        server.listen(1)
+        server.settimeout(0.2)
+        self.closers.append(server.close)
+        self._start(self._serve_socket, server)
+        return server.getsockname()[1]
+
+    def _serve_socket(self, server: socket.socket):
+        while self.running:
+            try:
+                connection, _ = server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection.settimeout(0.2)
+            with connection:
+                self._serve(lambda: connection.recv(4096), connection.sendall)
+
+    def serve_pty(self) -> str:
+        """ Serve on a pseudo terminal, POSIX only. Returns the device name to open MySerial on """
+        master, slave = os.openpty()
+        name = os.ttyname(slave)
+        self.closers.append(lambda: os.close(master))
+        self.closers.append(lambda: os.close(slave))
+        self._start(self._serve_pty, master)
+        return name
+
+    def _serve_pty(self, master):
+        def read():
+            readable, _, _ = select.select([master], [], [], 0.2)
+            return os.read(master, 4096) if readable else None
+
+        def write(data):
+            os.write(master, data)
+        self._serve(read, write)
+
+    def _serve(self, read, write):
+        buffer = b""
+        while self.running:
+            try:
+                data = read()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            if data is None:
+                continue
+            if data == b"":
+                return
+            buffer += data
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                if line.strip():
+                    self.respond(line.strip(), write)
+
+    def _start(self, target, *args):
+        self.running = True
+        thread = threading.Thread(target=target, args=args, name="fake-melfa-controller", daemon=True)
+        self.threads.append(thread)
+        thread.start()
+
+    def stop(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join()
+        for close in self.closers:
+            try:
+                close()
+            except OSError:
+                pass
+        self.threads = list()
+        self.closers = list()
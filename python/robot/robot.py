@@ -1,7 +1,19 @@
 import serial
+import logging
+import math
 import re
 import threading
+import time
+from array import array
 from enum import Enum
+from typing import List, Iterable, Tuple
+from timer.timer import TimerService, get_timer_service
+from metrics.metrics import timed, get_metrics
+
+logger = logging.getLogger(__name__)
+serial_logger = logger.getChild("serial")
+movement_logger = logger.getChild("movement")
+position_logger = logger.getChild("position")
 
 
 # Example position format
@@ -9,8 +21,14 @@ from enum import Enum
 
 MelfaResponseType = Enum('MelfaResponseType', 'POSITION NONE')
 
+RV_E3J_POS_PATTERN = re.compile(r"^([\+|-]\d+.\d+),([\+|-]\d+.\d+),([\+|-]\d+.\d+),([\+|-]\d+.\d+),"
+                                r"([\+|-]\d+.\d+),([R|L]),([A|B]),([O|C])$")
+RV_E3J_POS_TABLE_PATTERN = re.compile(RV_E3J_POS_PATTERN.pattern, re.MULTILINE)
+
 
 class Position:
+    __slots__ = ("x", "y", "z", "A", "B", "arg1", "arg2", "grip")
+
     def __init__(self, x=0, y=0, z=0, A=0, B=0, arg1="R", arg2="A", grip="O"):
         self.x = x
         self.y = y
@@ -29,39 +47,207 @@ class Position:
     @staticmethod
     def pos_string_to_dict(string: str) -> dict:
         """ extract values in pos string like "+500.00,+0.00,+46.30,+0.00,+179.99,R,A,O" """
-        RV_E3J_pos_pattern = "^([\+|-]\d+.\d+),([\+|-]\d+.\d+),([\+|-]\d+.\d+),([\+|-]\d+.\d+),([\+|-]\d+.\d+)," \
-                            "([R|L]),([A|B]),([O|C])$"
-        pattern = re.compile(RV_E3J_pos_pattern)
-        groups = pattern.match(string)
-
-        keys = ["x","y","z","A","B","arg1","arg2","grip"]
-        if groups.lastindex==len(keys):
-            pos_values = list(groups.groups())
-            pos_values[:5] = [float(x) for x in pos_values[:5]]
-            print("successfully parsed position string")
-            pos_dict = dict(zip(keys,pos_values))
-            print("dict:"+str(pos_dict))
-            return pos_dict
-        else:
+        groups = RV_E3J_POS_PATTERN.match(string)
+        if groups is None:
             raise SyntaxError("Illegal position format:"+str(string))
+        x, y, z, A, B, arg1, arg2, grip = groups.groups()
+        return {"x": float(x), "y": float(y), "z": float(z), "A": float(A), "B": float(B),
+                "arg1": arg1, "arg2": arg2, "grip": grip}
+
+    @staticmethod
+    def parse_position_table(lines: Iterable[str]) -> Tuple[array, str]:
+        """ Parse many position strings, e.g. a position table dump, in one go.
+            Returns the coordinates as a flat array of doubles, x,y,z,A,B per position,
+            and the arg1,arg2,grip flags as one string with three characters per position """
+        lines = [line.rstrip() for line in lines]
+        positions = RV_E3J_POS_TABLE_PATTERN.findall("\n".join(lines))
+        if len(positions) != len(lines):
+            for inx, line in enumerate(lines):
+                if RV_E3J_POS_PATTERN.match(line) is None:
+                    raise SyntaxError(f'Illegal position format on line {inx}:{line}')
+        coords = array('d', [float(c) for pos in positions for c in pos[:5]])
+        flags = "".join([pos[5] + pos[6] + pos[7] for pos in positions])
+        return coords, flags
 
     def is_empty(self):
-        keys = ["x", "y", "z", "A", "B"]
-        positions=[self.__dict__.get(x) for x in keys]
-        all_zero = all(x==0 for x in positions)
-        return all_zero
+        return self.x == 0 and self.y == 0 and self.z == 0 and self.A == 0 and self.B == 0
+
+    def get_coordinates(self) -> Tuple[float, float, float, float, float]:
+        return self.x, self.y, self.z, self.A, self.B
+
+    def get_flags(self) -> str:
+        return self.arg1 + self.arg2 + self.grip
+
+    def copy(self) -> 'Position':
+        return Position(self.x, self.y, self.z, self.A, self.B, self.arg1, self.arg2, self.grip)
 
     def __str__(self):
         posString = f'{self.x},{self.y},{self.z},{self.A},{self.B},{self.arg1},{self.arg2},{self.grip}'
         return posString
 
 
-class RobotMovement:
-    """ Responsible for all movement changes and position of the robot"""
-    def __init__(self,controller: 'MySerial'):
+class PositionArray:
+    """ Many positions in two contiguous buffers: x,y,z,A,B doubles per position and
+        the arg1,arg2,grip flag characters per position.
+
+    The operations work column-wise on the whole buffer instead of position by position. """
+    AXES = 5
+
+    def __init__(self, coords: array = None, flags: bytes = b""):
+        self.coords = coords if coords is not None else array('d')
+        self.flags = bytearray(flags)
+        if len(self.coords) != self.AXES * (len(self.flags) // 3) or len(self.flags) % 3 != 0:
+            raise ValueError("coordinates and flags describe a different number of positions")
+
+    @classmethod
+    def from_strings(cls, lines: Iterable[str]) -> 'PositionArray':
+        coords, flags = Position.parse_position_table(lines)
+        return cls(coords, flags.encode("ascii"))
+
+    @classmethod
+    def from_coordinates(cls, rows, flags="RAO") -> 'PositionArray':
+        """ From N rows of x,y,z,A,B, all positions get the same flags """
+        coords = array('d')
+        for row in rows:
+            if len(row) != cls.AXES:
+                raise ValueError("expected x,y,z,A,B per position, got:"+str(row))
+            coords.extend(row)
+        return cls(coords, flags.encode("ascii") * (len(coords) // cls.AXES))
+
+    @classmethod
+    def from_positions(cls, positions: Iterable[Position]) -> 'PositionArray':
+        pos_array = cls()
+        for position in positions:
+            pos_array.append(position)
+        return pos_array
+
+    def append(self, position: Position):
+        self.coords.extend(position.get_coordinates())
+        self.flags.extend(position.get_flags().encode("ascii"))
+
+    def __len__(self):
+        return len(self.flags) // 3
+
+    def __getitem__(self, inx) -> Position:
+        if inx < 0:
+            inx += len(self)
+        if not 0 <= inx < len(self):
+            raise IndexError("position index out of range")
+        c = inx * self.AXES
+        f = self.flags[inx * 3:inx * 3 + 3].decode("ascii")
+        return Position(*self.coords[c:c + self.AXES], f[0], f[1], f[2])
+
+    def __iter__(self):
+        for inx in range(len(self)):
+            yield self[inx]
+
+    def to_strings(self) -> List[str]:
+        """ The positions in the same format as str(Position) """
+        return [str(position) for position in self]
+
+    def column(self, axis: int) -> array:
+        """ All values of one axis, 0-4 for x,y,z,A,B """
+        return self.coords[axis::self.AXES]
+
+    def offset(self, x=0, y=0, z=0, A=0, B=0) -> 'PositionArray':
+        """ New array with every position moved by the offsets """
+        coords = array('d', self.coords)
+        for axis, delta in enumerate((x, y, z, A, B)):
+            if delta != 0:
+                coords[axis::self.AXES] = array('d', [v + delta for v in self.column(axis)])
+        return PositionArray(coords, self.flags)
+
+    def limit_violations(self, lower_limits, upper_limits) -> List[int]:
+        """ Indices of the positions with any axis outside [lower, upper], limits given per axis """
+        violating = set()
+        for axis in range(self.AXES):
+            lower, upper = lower_limits[axis], upper_limits[axis]
+            violating.update(inx for inx, v in enumerate(self.column(axis)) if v < lower or v > upper)
+        return sorted(violating)
+
+    def distances_to(self, x, y, z) -> array:
+        """ Cartesian distance from every position to the point x,y,z """
+        return array('d', [math.sqrt((px - x) ** 2 + (py - y) ** 2 + (pz - z) ** 2)
+                           for px, py, pz in zip(self.column(0), self.column(1), self.column(2))])
+
+    def segment_lengths(self) -> array:
+        """ Cartesian distance between each position and the next one """
+        xs, ys, zs = self.column(0), self.column(1), self.column(2)
+        return array('d', [math.sqrt((xs[i + 1] - xs[i]) ** 2 + (ys[i + 1] - ys[i]) ** 2 + (zs[i + 1] - zs[i]) ** 2)
+                           for i in range(len(xs) - 1)])
+
+
+class PoseCache:
+    """ Positions known without asking the controller: the position table and the current pose.
+
+    Entries expire after a ttl, the current pose has its own shorter ttl since the arm may still
+    be moving after a motion command has been sent. Positions are copied in and out. """
+    CURRENT = "current"
+
+    def __init__(self, ttl=10.0, current_ttl=1.0, clock=time.monotonic):
+        self.ttl = ttl
+        self.current_ttl = current_ttl
+        self.clock = clock
+        self.entries = dict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key) -> Position:
+        """ Cached position for a table index or CURRENT, None if unknown or expired """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > self.clock():
+                self.hits += 1
+                return entry[1].copy()
+            self.entries.pop(key, None)
+            self.misses += 1
+            return None
+
+    def put(self, key, position: Position):
+        ttl = self.current_ttl if key == self.CURRENT else self.ttl
+        with self.lock:
+            self.entries[key] = (self.clock() + ttl, position.copy())
+
+    def invalidate(self, key=None):
+        """ Forget one entry, or everything when key is None """
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+
+class LimitViolationError(ValueError):
+    """ Raised with the indices of every position outside the workspace limits """
+
+    def __init__(self, indices: List[int]):
+        super().__init__("positions out of bounds at index:"+str(indices))
+        self.indices = indices
+
+
+class WorkspaceLimits:
+    """ Lower and upper limit per axis x,y,z,A,B """
+
+    def __init__(self, lower=(-1000, -1000, -1000, -180, -180), upper=(1000, 1000, 1000, 180, 180)):
+        if len(lower) != PositionArray.AXES or len(upper) != PositionArray.AXES:
+            raise ValueError("expected one limit per axis x,y,z,A,B")
+        self.lower = tuple(lower)
+        self.upper = tuple(upper)
+
+    def get_joint_range(self) -> Tuple[float, float]:
+        """ Range allowed for both joint axes A and B """
+        return max(self.lower[3], self.lower[4]), min(self.upper[3], self.upper[4])
+
+
+class BaseRobotMovement:
+    """ Validation and Melfa message building shared by the blocking and the asyncio movement API """
+    def __init__(self, controller, limits: WorkspaceLimits = None):
         self.controller = controller
+        self.limits = limits if limits is not None else WorkspaceLimits()
         self.gripper_open_port = 1
         self.gripper_close_port = 0
+        self.gripper_duration = 1
 
     def validate_limits(self, lower_limit, upper_limit, *x):
 
@@ -70,33 +256,116 @@ class RobotMovement:
                 raise ValueError("requested coordinate out of bounds:"+str(c))
 
     def validate_joint(self,*x):
-        self.validate_limits(-180,180,*x)
+        self.validate_limits(*self.limits.get_joint_range(), *x)
+
+    def find_limit_violations(self, positions) -> List[int]:
+        """ Indices of all positions outside the workspace limits, checked in one pass per axis.
+            positions is a PositionArray, a list of Position or N rows of x,y,z,A,B """
+        return self._as_position_array(positions).limit_violations(self.limits.lower, self.limits.upper)
+
+    def validate_positions(self, positions):
+        """ Raises a LimitViolationError listing every violating index """
+        violations = self.find_limit_violations(positions)
+        if violations:
+            raise LimitViolationError(violations)
+
+    @staticmethod
+    def _as_position_array(positions) -> PositionArray:
+        if isinstance(positions, PositionArray):
+            return positions
+        positions = list(positions)
+        if all(isinstance(position, Position) for position in positions):
+            return PositionArray.from_positions(positions)
+        return PositionArray.from_coordinates(positions)
+
+    def _where_msg(self) -> 'MelfaMessage':
+        return MelfaMessage("WH", MelfaResponseType.POSITION)
+
+    def _read_position_msg(self, pos_inx) -> 'MelfaMessage':
+        return MelfaMessage(f'PR {pos_inx}', MelfaResponseType.POSITION)
+
+    def _write_position_msg(self, position, pos_inx) -> 'MelfaMessage':
+        return MelfaMessage(f'PD {pos_inx},{str(position)}', MelfaResponseType.NONE)
+
+    def _move_straight_msg(self, x, y, z) -> 'MelfaMessage':
+        self.validate_limits(-1000, 1000, x, y, z)
+        return MelfaMessage(f'DS {x},{y},{z}', MelfaResponseType.NONE)
+
+    def _move_tool_straight_msg(self, distance) -> 'MelfaMessage':
+        self.validate_limits(-100, 100, distance)
+        return MelfaMessage(f'DS {distance}', MelfaResponseType.NONE)
+
+    def _gripper_msg(self, bit_number) -> 'MelfaMessage':
+        return MelfaMessage(f'OB +{bit_number}', MelfaResponseType.NONE)
+
+    def _de_power_gripper_msgs(self) -> List['MelfaMessage']:
+        deactivate_close_msg = MelfaMessage(f'OB -{self.gripper_close_port}', MelfaResponseType.NONE)
+        deactivate_open_msg = MelfaMessage(f'OB -{self.gripper_open_port}', MelfaResponseType.NONE)
+        return [deactivate_close_msg, deactivate_open_msg]
+
+
+class RobotMovement(BaseRobotMovement):
+    """ Responsible for all movement changes and position of the robot"""
+    def __init__(self,controller: 'MySerial', timer_service: TimerService = None, limits: WorkspaceLimits = None,
+                 pose_cache: PoseCache = None):
+        super().__init__(controller, limits)
+        self.timer_service = timer_service
+        self.pose_cache = pose_cache if pose_cache is not None else PoseCache()
 
     def get_position(self) -> Position:
         """ WHERE - Get current position """
+        pos_obj = self.pose_cache.get(PoseCache.CURRENT)
+        if pos_obj is not None:
+            return pos_obj
 
-        wh_msg = MelfaMessage("WH", MelfaResponseType.POSITION)
-        print("built Melfamessage")
+        wh_msg = self._where_msg()
         curr_pos_str = self.controller.send_melfa_msg(wh_msg)
+        position_logger.debug("current position %s", curr_pos_str)
         pos_obj = Position.from_string(curr_pos_str)
+        self.pose_cache.put(PoseCache.CURRENT, pos_obj)
         return pos_obj
 
     def read_position_inx(self, pos_inx) -> Position:
-        wh_msg = MelfaMessage(f'PR {pos_inx}', MelfaResponseType.POSITION)
+        pos_obj = self.pose_cache.get(pos_inx)
+        if pos_obj is not None:
+            return pos_obj
+
+        wh_msg = self._read_position_msg(pos_inx)
         curr_pos_str = self.controller.send_melfa_msg(wh_msg)
-        print(f'read position inx{pos_inx}={curr_pos_str}')
-        return Position.from_string(curr_pos_str)
+        position_logger.debug("read position inx%s=%s", pos_inx, curr_pos_str)
+        pos_obj = Position.from_string(curr_pos_str)
+        self.pose_cache.put(pos_inx, pos_obj)
+        return pos_obj
 
     def write_pos_to_controller(self,position,pos_inx):
-        wh_msg = MelfaMessage(f'PD {pos_inx},{str(position)}', MelfaResponseType.NONE)
+        wh_msg = self._write_position_msg(position, pos_inx)
+        # the controller may have stored the position even if the command fails
+        self.pose_cache.invalidate(pos_inx)
         self.controller.send_melfa_msg(wh_msg)
+        self.pose_cache.put(pos_inx, position)
+
+    def write_positions_to_controller(self, positions, first_inx):
+        """ write_pos_to_controller for consecutive table indices from first_inx, in one burst """
+        positions = list(positions)
+        for inx in range(len(positions)):
+            self.pose_cache.invalidate(first_inx + inx)
+        self.controller.send_melfa_msgs([self._write_position_msg(position, first_inx + inx)
+                                         for inx, position in enumerate(positions)])
+        for inx, position in enumerate(positions):
+            self.pose_cache.put(first_inx + inx, position)
+
+    def trajectory(self, chunk_size=16) -> 'Trajectory':
+        """ A Trajectory to collect straight moves in and send them as one stream """
+        return Trajectory(self, chunk_size)
 
     def move_to_position_with_offset(self, base_pos_inx, offset_pos):
         """ MOVE APPROACH - the controller only accepts using presaved positions
             could also use """
         if self.read_position_inx(99).is_empty():
-            self.write_pos_to_controller(offset_pos)
+            self.write_pos_to_controller(offset_pos, 99)
             ma_msg = MelfaMessage(f'MA {base_pos_inx},{str(offset_pos)}', MelfaResponseType.NONE)
+            # before sending, the arm may move even if the command times out
+            self.pose_cache.invalidate(PoseCache.CURRENT)
             self.controller.send_melfa_msg(ma_msg)
 
 
@@ -105,46 +374,134 @@ class RobotMovement:
     def move_straight(self, x=0, y=0, z=0):
         """ DRAW STRAIGHT - Move from current position with linear interpolation"""
 
-        self.validate_limits(-1000, 1000, x, y, z)
-        print("coordinates validated")
-        mov_msg = MelfaMessage(f'DS {x},{y},{z}', MelfaResponseType.NONE)
-        print("built Melfamessage")
+        mov_msg = self._move_straight_msg(x, y, z)
+        self.pose_cache.invalidate(PoseCache.CURRENT)
         self.controller.send_melfa_msg(mov_msg)
-        print("sent melfa message")
+        movement_logger.debug("moved straight by %s,%s,%s", x, y, z)
 
 
     def move_tool_straight(self,distance):
 
-        self.validate_limits(-100, 100, distance)
-        print("distance validated")
-        mov_msg = MelfaMessage(f'DS {distance}', MelfaResponseType.NONE)
-        print("built Melfamessage")
+        mov_msg = self._move_tool_straight_msg(distance)
+        self.pose_cache.invalidate(PoseCache.CURRENT)
         self.controller.send_melfa_msg(mov_msg)
-        print("sent melfa message")
+        movement_logger.debug("moved tool straight by %s", distance)
 
 
     def close_gripper(self):
-        close_duration = 1
-        self._gripper_call(self.gripper_close_port,close_duration)
+        self._gripper_call(self.gripper_close_port,self.gripper_duration)
 
 
     def open_gripper(self):
-        open_duration = 1
-        self._gripper_call(self.gripper_open_port,open_duration)
+        self._gripper_call(self.gripper_open_port,self.gripper_duration)
 
     def _gripper_call(self, bit_number, duration):
-        grip_msg = MelfaMessage(f'OB +{bit_number}', MelfaResponseType.NONE)
+        grip_msg = self._gripper_msg(bit_number)
+        # the grip flag of the current pose changes
+        self.pose_cache.invalidate(PoseCache.CURRENT)
         self.controller.send_melfa_msg(grip_msg)
         try:
-            threading.Timer(duration,self.de_power_gripper).start()
+            timer_service = self.timer_service or get_timer_service()
+            timer_service.schedule(duration, self.de_power_gripper)
         except Exception: #if anything goes wrong with turn off delay, turn off directly.
             self.de_power_gripper()
 
     def de_power_gripper(self):
-        deactivate_close_msg = MelfaMessage(f'OB -{self.gripper_close_port}', MelfaResponseType.NONE)
-        deactivate_open_msg = MelfaMessage(f'OB -{self.gripper_open_port}', MelfaResponseType.NONE)
-        self.controller.send_melfa_msg(deactivate_close_msg)
-        self.controller.send_melfa_msg(deactivate_open_msg)
+        self.controller.send_melfa_msgs(self._de_power_gripper_msgs())
+
+
+class Trajectory:
+    """ Straight moves collected to be checked and sent as one stream instead of one by one.
+
+    Moves that change nothing are dropped and a move in the same direction as the one before is
+    merged into it, as long as the merged move is still a valid DS command, so the arm does not
+    stop in between. The whole trajectory is checked against the workspace limits before
+    anything is sent, then the commands are written in bursts of chunk_size without waiting for
+    each other. For the limit check tool moves are taken to go along -z, the tool pointing down. """
+    STRAIGHT = "straight"
+    TOOL = "tool"
+
+    def __init__(self, movement: RobotMovement, chunk_size=16, tolerance=1e-6):
+        self.movement = movement
+        self.chunk_size = chunk_size
+        self.tolerance = tolerance
+        self.segments: List[Tuple[str, tuple]] = list()
+        self.moves = 0
+
+    def straight(self, x=0, y=0, z=0) -> 'Trajectory':
+        self.movement.validate_limits(-1000, 1000, x, y, z)
+        self._add(self.STRAIGHT, (x, y, z))
+        return self
+
+    def tool_straight(self, distance) -> 'Trajectory':
+        self.movement.validate_limits(-100, 100, distance)
+        self._add(self.TOOL, (distance,))
+        return self
+
+    def _add(self, kind, delta):
+        self.moves += 1
+        if all(abs(d) <= self.tolerance for d in delta):
+            return
+        if self.segments:
+            last_kind, last = self.segments[-1]
+            if last_kind == kind and self._same_direction(last, delta):
+                merged = tuple(round(a + b, 6) for a, b in zip(last, delta))
+                limit = 1000 if kind == self.STRAIGHT else 100
+                if all(abs(d) <= limit for d in merged):
+                    self.segments[-1] = (kind, merged)
+                    return
+        self.segments.append((kind, delta))
+
+    def _same_direction(self, a, b):
+        dot = sum(p * q for p, q in zip(a, b))
+        if len(a) == 1 or dot <= 0:
+            return dot > 0
+        ax, ay, az = a
+        bx, by, bz = b
+        cross = math.sqrt((ay * bz - az * by) ** 2 + (az * bx - ax * bz) ** 2 + (ax * by - ay * bx) ** 2)
+        return cross <= self.tolerance * math.sqrt(sum(p * p for p in a) * sum(q * q for q in b))
+
+    def __len__(self):
+        return len(self.segments)
+
+    def get_waypoints(self, start: Position) -> PositionArray:
+        """ The pose after each merged move, starting from start """
+        waypoints = PositionArray()
+        position = start.copy()
+        for kind, delta in self.segments:
+            if kind == self.STRAIGHT:
+                position.x, position.y, position.z = position.x + delta[0], position.y + delta[1], position.z + delta[2]
+            else:
+                position.z -= delta[0]
+            waypoints.append(position)
+        return waypoints
+
+    def validate(self, start: Position = None):
+        """ Raises a LimitViolationError with the index of every merged move ending out of bounds,
+            start defaults to the current position """
+        start = start if start is not None else self.movement.get_position()
+        self.movement.validate_positions(self.get_waypoints(start))
+
+    def get_messages(self) -> List['MelfaMessage']:
+        return [self.movement._move_straight_msg(*delta) if kind == self.STRAIGHT
+                else self.movement._move_tool_straight_msg(*delta) for kind, delta in self.segments]
+
+    def send(self, validate=True, start: Position = None) -> int:
+        """ Validate and stream the merged moves, returns the number of commands sent """
+        if validate:
+            self.validate(start)
+        msgs = self.get_messages()
+        # before the first chunk, the arm moves even if a later chunk fails
+        self.movement.pose_cache.invalidate(PoseCache.CURRENT)
+        for inx in range(0, len(msgs), self.chunk_size):
+            self.movement.controller.send_melfa_msgs(msgs[inx:inx + self.chunk_size])
+        movement_logger.debug("streamed %s moves as %s commands", self.moves, len(msgs))
+        return len(msgs)
+
+    def store(self, first_inx, start: Position = None):
+        """ Write the waypoints to the position table from first_inx on, to move along them later """
+        start = start if start is not None else self.movement.get_position()
+        self.movement.write_positions_to_controller(self.get_waypoints(start), first_inx)
 
 
 class Robot:
@@ -165,52 +522,124 @@ class MelfaMessage:
 
         if self.responseType == MelfaResponseType.POSITION:
             args = str(response).split(",")
-            print("after parse:"+str(args))
             if len(args)!=8:
                 raise NameError("Validation error, Expected Position response")
 
     def expects_response(self) -> bool:
         return self.responseType != MelfaResponseType.NONE
 
+    def encode(self) -> bytes:
+        return bytes((self.content + '\r\n'), encoding="ascii")
+
 
 class MySerial:
-    def __init__(self, comport: str, w_timeout=None):
+    def __init__(self, comport: str, w_timeout=None, r_timeout=2):
         self.ser=None
+        self.r_timeout = r_timeout
+        self.lock = threading.RLock()
+        self.pending_msgs: List[MelfaMessage] = list()
+        # a recording.TraceRecorder that gets every command with its response
+        self.recorder = None
         self.open_serial(comport,w_timeout)
         self.last_msg = None
 
     def open_serial(self,comport, w_timeout):
-        print("Serial opened")
-        self.ser = serial.Serial(comport, baudrate=9600, timeout=2, stopbits=serial.STOPBITS_TWO,
-                                 parity=serial.PARITY_EVEN, rtscts=True, write_timeout=w_timeout)
+        """ comport is a port name or a pyserial URL such as loop:// or socket://host:port """
+        self.ser = serial.serial_for_url(comport, baudrate=9600, timeout=self.r_timeout, stopbits=serial.STOPBITS_TWO,
+                                         parity=serial.PARITY_EVEN, rtscts=True, write_timeout=w_timeout)
+        serial_logger.info("Serial %s opened", comport)
 
     def _set_last_msg(self,msg: MelfaMessage):
         self.last_msg = msg
 
+    @timed("melfa_round_trip_seconds")
     def send_melfa_msg(self, msg: MelfaMessage) -> str:
         serial_response = ""
-        print(f'tries to send {msg.content}')
-        self.ser.write(bytes((msg.content + '\r\n'), encoding="ascii"))
-        print("sent serial text: "+msg.content)
-        self.last_msg = msg
-        if msg.expects_response():
-            timeout, serial_response = self.get_response()
-            if timeout:
-                raise TimeoutError(f'cmd {msg.content} timed out')
-            msg.validate_response(serial_response)
+        with self.lock:
+            start = time.perf_counter() if self.recorder is not None else None
+            self.ser.write(msg.encode())
+            serial_logger.debug("sent serial text: %s", msg.content)
+            self.last_msg = msg
+            if msg.expects_response():
+                serial_response = self._read_response(msg)
+            if start is not None:
+                self.recorder.melfa_round_trip(msg.content, serial_response, time.perf_counter() - start)
 
         return serial_response
 
+    def queue_melfa_msg(self, msg: MelfaMessage):
+        """ Queue a message to be written together with the others on the next flush """
+        with self.lock:
+            self.pending_msgs.append(msg)
+
+    def flush(self) -> List[str]:
+        """ Write all queued messages in one burst, then read the responses in the same order.
+            Returns one response per message, empty for messages not expecting a response """
+        with self.lock:
+            msgs, self.pending_msgs = self.pending_msgs, list()
+            if len(msgs) == 0:
+                return list()
+            metrics = get_metrics()
+            metrics.inc("melfa_burst_messages", len(msgs))
+            burst_start = metrics.start_timing()
+            start = time.perf_counter() if self.recorder is not None else None
+            try:
+                self.ser.write(b"".join(msg.encode() for msg in msgs))
+                if serial_logger.isEnabledFor(logging.DEBUG):
+                    serial_logger.debug("sent serial text: %s", " | ".join(msg.content for msg in msgs))
+                self.last_msg = msgs[-1]
+                responses = list()
+                try:
+                    for msg in msgs:
+                        responses.append(self._read_response(msg) if msg.expects_response() else "")
+                except Exception as error:
+                    # the answers still due would be taken for the answers to the next commands,
+                    # a timed out answer may still come late
+                    due = sum(1 for msg in msgs[len(responses) + 1:] if msg.expects_response())
+                    self._discard_responses(due + isinstance(error, TimeoutError))
+                    raise
+            finally:
+                metrics.stop_timing(burst_start, "melfa_burst_seconds")
+            if start is not None:
+                # the burst shares one round trip, every message gets its part
+                seconds = (time.perf_counter() - start) / len(msgs)
+                for msg, response in zip(msgs, responses):
+                    self.recorder.melfa_round_trip(msg.content, response, seconds)
+            return responses
+
+    def send_melfa_msgs(self, msgs: List[MelfaMessage]) -> List[str]:
+        """ Pipelined version of send_melfa_msg for a sequence of messages """
+        with self.lock:
+            for msg in msgs:
+                self.queue_melfa_msg(msg)
+            return self.flush()
+
+    def _discard_responses(self, count):
+        """ Read and drop up to count responses, until one times out """
+        for _ in range(count):
+            timeout, response = self.get_response()
+            if timeout:
+                break
+            serial_logger.warning("discarded serial response of a failed burst: %s", response)
+
+    def _read_response(self, msg: MelfaMessage) -> str:
+        timeout, serial_response = self.get_response()
+        if timeout:
+            get_metrics().inc("melfa_timeouts")
+            serial_logger.warning("cmd %s timed out", msg.content)
+            raise TimeoutError(f'cmd {msg.content} timed out')
+        msg.validate_response(serial_response)
+        return serial_response
+
     def get_last_msg_content(self):
-        print("MySerial last_msg:"+self.last_msg.content)
         return self.last_msg.content
 
     def get_response(self) -> (bool,str):
         response = str(self.ser.readline(), "utf-8")
-        print("received serial response: " + response)
 
         timeout = len(response) == 0
         response = response.rstrip()
+        serial_logger.debug("received serial response: %s", response)
 
         return timeout, response
 
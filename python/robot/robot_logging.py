@@ -0,0 +1,51 @@
+import logging
+import queue
+from typing import Dict
+from log_pipeline.log_pipeline import DeferredQueueHandler, FlushingQueueListener
+
+""" Logging of the robot layer.
+
+Every component logs to its own child of the robot.robot logger, so its verbosity can be set on
+its own, e.g. the serial traffic at DEBUG while movement stays at INFO:
+
+    set_component_levels(serial=logging.DEBUG)
+    listener = start_queue_logging(logging.FileHandler("robot.log"))
+    ...
+    listener.stop()
+
+With start_queue_logging the command path only puts the log records on a queue, the handlers
+format and write them on the listener thread. """
+
+ROBOT_LOGGER = "robot.robot"
+COMPONENTS = ("serial", "movement", "position")
+
+
+def get_component_logger(component: str) -> logging.Logger:
+    if component not in COMPONENTS:
+        raise ValueError("unknown robot logging component:" + str(component))
+    return logging.getLogger(ROBOT_LOGGER).getChild(component)
+
+
+def set_component_levels(level=None, **component_levels):
+    """ Level of the whole robot layer and/or of single components, by component name """
+    if level is not None:
+        logging.getLogger(ROBOT_LOGGER).setLevel(level)
+    for component, component_level in component_levels.items():
+        get_component_logger(component).setLevel(component_level)
+
+
+def get_component_levels() -> Dict[str, int]:
+    return {component: get_component_logger(component).getEffectiveLevel() for component in COMPONENTS}
+
+
+def start_queue_logging(*handlers, max_records=10000, logger_name=ROBOT_LOGGER,
+                        flush_interval=1.0) -> FlushingQueueListener:
+    """ Send the records of the robot layer through a queue to handlers on a listener thread.
+
+    The logger stops propagating to the root logger, the handlers replace the root handlers for
+    it. Stop the returned listener to flush the queue and restore the logger. """
+    queue_handler = DeferredQueueHandler(queue.Queue(max_records))
+    listener = FlushingQueueListener(queue_handler.queue, *handlers, flush_interval=flush_interval)
+    listener.attach(logging.getLogger(logger_name), queue_handler)
+    listener.start()
+    return listener
@@ -1,38 +1,60 @@
 from control.control import *
 from world.world import *
 from collections import deque
-from threading import Timer
+import functools
+from control.orders import Order, OrderBatcher
+from control.deadlines import DeadlineScheduler
+from control.templates import JobTemplate, JobBlueprint, Param, Computed
+from timer.timer import TimerService, get_timer_service
+from log_pipeline.log_pipeline import LogPipeline
+from recording.recording import TraceRecorder
+import argparse
 import logging
-import sys
 
-logging.basicConfig(format='%(asctime)s %(name)s %(levelname)s:%(message)s', filename='debug.log', filemode="w", level=logging.DEBUG)
-logging.getLogger().addHandler(logging.StreamHandler(sys.stdout))
 ''' TASK TYPES '''
 
 
 class RobotTask(BaseTask):
+    robot = LazyResource("robot")
+    tool_stand = LazyResource("tool")
 
     def __init__(self,name, res_handler: ResourceHandler,prio=2):
-        super().__init__(name,prio)
+        super().__init__(name, None, prio)
         self.res_handler = res_handler
-        self.robot = self.res_handler.get_free_equipment_by_string("robot")
-        self.tool_stand = self.res_handler.get_free_equipment_by_string("tool")
         self.tool_req = Tool.GRIPPER #the "base" tool when nothing else is equipped
 
-    def need_toolchange(self):
-        tool_ok = self.tool_stand.get_equipped_tool() != self.tool_req
+    def need_toolchange(self, robot=None):
+        tool_stand = self.tool_stand if robot is None else robot.get_tool_stand()
+        tool_ok = tool_stand.get_equipped_tool() != self.tool_req
         return tool_ok
 
+    def get_tool_affinity(self):
+        return self.tool_req
+
+    def can_run_on(self, robot):
+        return isinstance(robot, RobotArm)
+
+    def assign_robot(self, robot):
+        self.robot = robot
+        self.tool_stand = robot.get_tool_stand()
+
 
 class PourBatter(RobotTask):
+    bowl = LazyResource("bowl")
 
-    def __init__(self, name, iron, res_handler: ResourceHandler,slot=1):
+    def __init__(self, name, iron, res_handler: ResourceHandler,slot=1, order: Order = None):
         super().__init__(name, res_handler)
+        self.slot = slot
+        self.order = order
         self.iron = iron
-        self.res_handler = res_handler
-        self.bowl = self.res_handler.get_free_equipment_by_string("bowl")
         self.tool_req = Tool.SCOOP
 
+    def get_shared_resources(self):
+        return ("bowl",)
+
+    def bind_resource(self, item_name, item):
+        self.bowl = item
+
     def run(self):
         self.tool_stand.get_tool(self.tool_req)
         self.bowl.retrieve()
@@ -43,15 +65,23 @@ class PourBatter(RobotTask):
 
 
 class ServeWaffle(RobotTask):
+    tray = LazyResource("tray")
 
-    def __init__(self, name, iron, res_handler: ResourceHandler,slot=1):
+    def __init__(self, name, iron, res_handler: ResourceHandler,slot=1, order: Order = None):
         super().__init__(name,res_handler,3) #High priority to serve the waffle
+        self.slot = slot
+        self.order = order
         self.iron = iron
-        self.res_handler = res_handler
-        self.tray = self.res_handler.get_free_equipment_by_string("tray")
+        self.tool_req = Tool.FORK
+
+    def get_shared_resources(self):
+        return ("tray",)
+
+    def bind_resource(self, item_name, item):
+        self.tray = item
 
     def run(self):
-        self.tool_stand.get_tool(Tool.FORK)
+        self.tool_stand.get_tool(self.tool_req)
         self.iron.grab_waffle()
 
     def __str__(self):
@@ -63,7 +93,6 @@ class OperateIron(RobotTask):
     def __init__(self, name, iron, res_handler: ResourceHandler, command, prio=2):
         super().__init__(name,res_handler,prio)
         self.command = command
-        self.res_handler = res_handler
         self.iron = iron
 
     def run(self):
@@ -81,17 +110,33 @@ class OperateIron(RobotTask):
 
 class WaitingTask(BaseTask):
 
-    def __init__(self,name,time):
-        super().__init__(name,4) # its very high priority to start waiting timer for time to be accurate
+    def __init__(self,name,time, timer_service: TimerService = None):
+        super().__init__(name, None, 4) # its very high priority to start waiting timer for time to be accurate
         self.finished = False
         self.time = time
+        self.timer_service = timer_service
+        self.timer = None
+        self.deadline_tasks = list()
+
+    def add_deadline_task(self, task: BaseTask, slack):
+        """ task must start at most slack seconds after the waiting time is over """
+        self.deadline_tasks.append((task, slack))
 
     def run(self):
-        t = Timer(self.time, self.set_finished)
-        t.start()
+        timer_service = self.timer_service or get_timer_service()
+        self.timer = timer_service.schedule(self.time, self.set_finished)
+        for task, slack in self.deadline_tasks:
+            task.deadline = self.timer.deadline + slack
+
+    def get_finish_time(self):
+        """ Deadline of the running timer on the timer service clock, None if not started """
+        if self.timer is None:
+            return None
+        return self.timer.deadline
 
     def set_finished(self):
         self.finished = True
+        self._notify_finished()
 
     def is_finished(self):
         return self.finished
@@ -101,37 +146,84 @@ class WaitingTask(BaseTask):
 ''' JOB TYPES '''
 
 
-class SingleWaffleJob(BaseJob):
+@functools.lru_cache(maxsize=None)
+def waffle_blueprint(slots, preheat=False) -> JobBlueprint:
+    """ The tasks frying one waffle in each of slots slots, compiled once per variant.
+
+    With preheat the iron heats for preheat_time after it is turned on. As a DagJob the iron is
+    opened while it heats, the slots are poured and served in any order, and the iron is turned
+    off and closed independently once all waffles are out. """
+
+    def slot_name(name, slot):
+        return name if slots == 1 else name + " slot " + str(slot)
+
+    iron = Param("iron")
+    res_handler = Param("res_handler")
+    pours = ["pour " + str(slot) for slot in range(1, slots + 1)]
+    serves = ["serve " + str(slot) for slot in range(1, slots + 1)]
+    template = JobTemplate("waffles x" + str(slots))
+    template.add(OperateIron, "start iron", key="start", iron=iron, res_handler=res_handler, command="turn on")
+    if preheat:
+        template.add(WaitingTask, "preheating", key="preheat", time=Param("preheat_time"))
+    template.add(OperateIron, "open for fill", key="open for fill", after=["start"],
+                 iron=iron, res_handler=res_handler, command="open")
+    for slot in range(1, slots + 1):
+        template.add(PourBatter, slot_name("pouring batter", slot), key=pours[slot - 1],
+                     after=["open for fill", "preheat"] if preheat else ["open for fill"],
+                     iron=iron, res_handler=res_handler, slot=slot, order=Param("orders", slot - 1))
+    template.add(OperateIron, "close for frying", after=pours, iron=iron, res_handler=res_handler, command="close")
+    template.add(WaitingTask, "waiting while frying", key="frying", time=Param("fry_time"))
+    template.add(OperateIron, "open for retrieving", key="open for retrieving", deadline_after="frying",
+                 slack=Param("over_fry_time"), iron=iron, res_handler=res_handler, command="open", prio=3)
+    for slot in range(1, slots + 1):
+        template.add(ServeWaffle, slot_name("serving waffle", slot), key=serves[slot - 1],
+                     after=["open for retrieving"], deadline_after="frying",
+                     slack=Computed(lambda x, slot=slot: x["over_fry_time"] + slot * x["serve_time"]),
+                     iron=iron, res_handler=res_handler, slot=slot, order=Param("orders", slot - 1))
+    template.add(OperateIron, "turn off iron", after=serves, iron=iron, res_handler=res_handler, command="turn off")
+    template.add(OperateIron, "close finish", after=serves, iron=iron, res_handler=res_handler, command="close")
+    return template.compile()
+
+
+class WaffleJob(BaseJob):
+    """ Fries one waffle per order in an iron with any number of slots.
+
+    The iron has to be opened at most over_fry_time seconds after the frying time is over and
+    every waffle gets serve_time seconds more to be served, later than that they count as burnt. """
+
+    def __init__(self, res_handler, iron, fry_time=5, orders=None, slots=None, over_fry_time=20.0,
+                 serve_time=30.0, preheat_time=None):
+        super().__init__(res_handler, iron)
+        if orders:
+            self.orders = list(orders)
+            slots = len(self.orders)
+        elif slots is None:
+            slots = 1
+        blueprint = waffle_blueprint(slots, preheat_time is not None)
+        blueprint.instantiate(self, iron=self.iron, res_handler=self.res_handler, orders=self.orders,
+                              fry_time=fry_time, over_fry_time=over_fry_time, serve_time=serve_time,
+                              preheat_time=preheat_time)
 
-    def __init__(self, res_handler, iron):
-        super().__init__(res_handler,iron)
+    def get_order(self, slot):
+        """ The order fried in a slot, counting from 1, None for jobs made without orders """
+        return self.orders[slot - 1] if slot <= len(self.orders) else None
 
-        self.task_queue.appendleft(OperateIron("start iron", self.iron, self.res_handler, "turn on"))
-        self.task_queue.appendleft(OperateIron("open for fill", self.iron, self.res_handler, "open"))
-        self.task_queue.appendleft(PourBatter("pouring batter", self.iron, self.res_handler))
-        self.task_queue.appendleft(OperateIron("close for frying", self.iron, self.res_handler, "close"))
-        self.task_queue.appendleft(WaitingTask("waiting while frying", 5)) # Cook for 5 sek
-        self.task_queue.appendleft(OperateIron("open for retrieving", self.iron, self.res_handler, "open", 3))
-        self.task_queue.appendleft(ServeWaffle("serving waffle", self.iron, self.res_handler))
-        self.task_queue.appendleft(OperateIron("turn off iron", self.iron, self.res_handler, "turn off"))
-        self.task_queue.appendleft(OperateIron("close finish", self.iron, self.res_handler, "close"))
 
+class WaffleDagJob(WaffleJob, DagJob):
+    """ WaffleJob with the tasks as a dependency graph, see waffle_blueprint """
+    pass
 
-class DualWaffleJob(BaseJob):
 
-    def __init__(self, res_handler, iron):
-        super().__init__(res_handler, iron)
-        self.task_queue.appendleft(OperateIron("start iron", self.iron, self.res_handler, "turn on"))
-        self.task_queue.appendleft(OperateIron("open for fill", self.iron, self.res_handler, "open"))
-        self.task_queue.appendleft(PourBatter("pouring batter slot1", self.iron, self.res_handler,1))
-        self.task_queue.appendleft(PourBatter("pouring batter slot2", self.iron, self.res_handler,2))
-        self.task_queue.appendleft(OperateIron("close for frying", self.iron, self.res_handler, "close"))
-        self.task_queue.appendleft(WaitingTask("waiting while frying", 5)) # Cook for 5 sek
-        self.task_queue.appendleft(OperateIron("open for retrieving", self.iron, self.res_handler, "open", 3))
-        self.task_queue.appendleft(ServeWaffle("serving waffle slot 1", self.iron, self.res_handler, 1))
-        self.task_queue.appendleft(ServeWaffle("serving waffle slot 2", self.iron, self.res_handler, 2))
-        self.task_queue.appendleft(OperateIron("turn off iron", self.iron, self.res_handler, "turn off"))
-        self.task_queue.appendleft(OperateIron("close finish", self.iron, self.res_handler, "close"))
+class SingleWaffleJob(WaffleJob):
+
+    def __init__(self, res_handler, iron, fry_time=5):
+        super().__init__(res_handler, iron, fry_time, slots=1)
+
+
+class DualWaffleJob(WaffleJob):
+
+    def __init__(self, res_handler, iron, fry_time=5):
+        super().__init__(res_handler, iron, fry_time, slots=2)
 
 
 
@@ -145,23 +237,52 @@ class WaffleResourceHandler(ResourceHandler):
         pass
 
 
+# Seconds of arm time per task type, for keeping the arm free in time for the frying deadlines.
+# Other task types count as the longest, a tool change adds TOOL_CHANGE_ESTIMATE
+TASK_DURATION_ESTIMATES = {
+    "OperateIron": 4.0,
+    "PourBatter": 10.0,
+    "ServeWaffle": 8.0,
+    "WaitingTask": 0.0,
+}
+TOOL_CHANGE_ESTIMATE = 6.0
+
+
+def estimate_task_duration(task: BaseTask) -> float:
+    """ Estimated arm time of a task, with a tool change if the task would need one now """
+    duration = TASK_DURATION_ESTIMATES.get(type(task).__name__, max(TASK_DURATION_ESTIMATES.values()))
+    if task.need_toolchange():
+        duration += TOOL_CHANGE_ESTIMATE
+    return duration
+
+
 class WaffleCoordinator(JobCoordinator):
 
-    def __init__(self, job_factory, res_handler):
-        super().__init__(job_factory, res_handler)
+    def __init__(self, job_factory, res_handler, policy: SchedulingPolicy = None,
+                 order_batcher: OrderBatcher = None, deadline_scheduler: DeadlineScheduler = None):
+        if deadline_scheduler is None:
+            deadline_scheduler = DeadlineScheduler(estimate_task_duration)
+        super().__init__(job_factory, res_handler, policy, order_batcher, deadline_scheduler)
 
 
 class WaffleJobFactory(JobFactory):
 
-    def __init__(self):
+    def __init__(self, fry_time=5, over_fry_time=20.0, preheat_time=None, dag=False):
         super().__init__()
-        pass
-
-    def create_job(self, jobtype:str, iron:Equipment, res_handler):
-        if jobtype == "base":
-            job = SingleWaffleJob(res_handler, iron)
+        self.fry_time = fry_time
+        self.over_fry_time = over_fry_time
+        self.preheat_time = preheat_time
+        self.dag = dag
+
+    def create_job(self, jobtype:str, iron:Equipment, res_handler, orders=None):
+        if orders:
+            job_cls = WaffleDagJob if self.dag else WaffleJob
+            job = job_cls(res_handler, iron, self.fry_time, orders, over_fry_time=self.over_fry_time,
+                          preheat_time=self.preheat_time)
+        elif jobtype == "base":
+            job = SingleWaffleJob(res_handler, iron, self.fry_time)
         elif jobtype == "big":
-            job = DualWaffleJob(res_handler, iron)
+            job = DualWaffleJob(res_handler, iron, self.fry_time)
         else:
             job = None
 
@@ -181,32 +302,41 @@ class RoboticWaffles:
         self.res_handler.add_item("iron", WaffleIron(None, "Big nasty iron", 2))
         self.res_handler.add_item("bowl", Bowl(None, "red bowling bowl"))
         self.res_handler.add_item("tray", Tray(None, "plastic tray"))
-        self.res_handler.add_item("tool", ToolStand(None, "tool stand"))
+        arm = RobotArm(None, "melfa arm")
+        self.res_handler.add_item("robot", arm)
+        self.res_handler.add_item("tool", arm.get_tool_stand())
 
         self.coordinator = WaffleCoordinator(self.job_factory, self.res_handler)
         print("init program")
 
-    def main(self):
-        self.run()
+    def main(self, log_path="debug.log", events_path=None, trace_path=None):
+        """ Run with the log written on a listener thread, see LogPipeline, and the session
+            recorded to trace_path for replaying it later, see recording """
+        recorder = TraceRecorder.open(trace_path) if trace_path is not None else None
+        if recorder is not None:
+            recorder.attach(self.coordinator)
+        try:
+            with LogPipeline(log_path, events_path=events_path):
+                self.run()
+        finally:
+            if recorder is not None:
+                recorder.close()
 
     def run(self):
-        print("o: order a waffle")
-        print("p: process orders")
-        print("e: execute orders")
+        print("o: order a waffle, o <variant> for another variant")
+        print("empty: quit")
 
+        loop = CoordinatorEventLoop(self.coordinator)
+        loop.start()
         cmd = "o"
         while cmd != "":
             cmd = input("Select cmd:")
-            if cmd == "o":
+            if cmd.startswith("o"):
                 logging.info("Add order selected")
-                self.coordinator.add_order()
-            elif cmd == "p":
-                logging.info("Process orders selected")
-                self.coordinator.process_orders()
-            elif cmd == "e":
-                logging.info("Executing next job task")
-                self.coordinator.execute_next_job_task()
+                variant = cmd[1:].strip() or "plain"
+                loop.post_order(Order(variant))
 
+        loop.stop()
         self.close()
 
     def close(self):
@@ -214,5 +344,10 @@ class RoboticWaffles:
 
 
 if __name__== "__main__":
+    parser = argparse.ArgumentParser(description="Robotic waffles")
+    parser.add_argument("--log", default="debug.log", help="rotated debug log file")
+    parser.add_argument("--events", default=None, help="JSON lines event file to replay later")
+    parser.add_argument("--trace", default=None, help="record orders and dispatched tasks to this file")
+    args = parser.parse_args()
     r=RoboticWaffles()
-    r.main()
+    r.main(args.log, args.events, args.trace)
@@ -0,0 +1,267 @@
+from robotic_waffles import *
+from control.policy import ToolBatchingPolicy
+from control.deadlines import DeadlineStats
+from timer.timer import TimerService, get_timer_service, set_timer_service
+from metrics.metrics import get_metrics
+from recording.recording import TraceRecorder
+from typing import List, Dict
+import argparse
+import math
+import random
+import logging
+
+logger = logging.getLogger(__name__)
+
+""" python -m simulation.simulation --orders-per-hour 60 --hours 4 """
+
+# Seconds of arm time per task type, a tool change adds DEFAULT_TOOL_CHANGE_TIME
+DEFAULT_TASK_DURATIONS = TASK_DURATION_ESTIMATES
+DEFAULT_TOOL_CHANGE_TIME = TOOL_CHANGE_ESTIMATE
+DEFAULT_FRY_TIME = 180.0
+DEFAULT_IRONS = (("Small cute iron", 1), ("Big nasty iron", 2))
+
+
+def poisson_arrivals(orders_per_hour, hours, seed=None) -> List[float]:
+    """ Order arrival times in seconds for a Poisson stream """
+    rnd = random.Random(seed)
+    arrivals = list()
+    t = rnd.expovariate(orders_per_hour / 3600.0)
+    while t < hours * 3600.0:
+        arrivals.append(t)
+        t += rnd.expovariate(orders_per_hour / 3600.0)
+    return arrivals
+
+
+def percentile(values, p):
+    """ Nearest-rank percentile, p in 0-100 """
+    if len(values) == 0:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(p / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+class SimulationReport:
+
+    def __init__(self, duration, waffles, latencies, iron_busy_time: Dict[str, float], tool_changes,
+                 arm_busy_time, robots=1, jobs=0, deadline_stats: DeadlineStats = None):
+        self.duration = duration
+        self.jobs = jobs
+        self.deadline_stats = deadline_stats if deadline_stats is not None else DeadlineStats()
+        self.robots = robots
+        self.waffles = waffles
+        self.latencies = latencies
+        self.iron_busy_time = iron_busy_time
+        self.tool_changes = tool_changes
+        self.arm_busy_time = arm_busy_time
+
+    def get_throughput(self):
+        """ Served waffles per hour """
+        if self.duration == 0:
+            return 0.0
+        return self.waffles * 3600.0 / self.duration
+
+    def get_latency_percentile(self, p):
+        return percentile(self.latencies, p)
+
+    def get_iron_utilization(self) -> Dict[str, float]:
+        if self.duration == 0:
+            return {name: 0.0 for name in self.iron_busy_time}
+        return {name: busy / self.duration for name, busy in self.iron_busy_time.items()}
+
+    def get_arm_utilization(self):
+        """ Average over all arms """
+        if self.duration == 0:
+            return 0.0
+        return self.arm_busy_time / (self.duration * self.robots)
+
+    def get_waffles_per_job(self):
+        if self.jobs == 0:
+            return 0.0
+        return self.waffles / self.jobs
+
+    def get_tool_changes_per_hour(self):
+        if self.duration == 0:
+            return 0.0
+        return self.tool_changes * 3600.0 / self.duration
+
+    def __str__(self):
+        lines = [f'simulated time: {self.duration / 3600.0:.2f} h',
+                 f'waffles served: {self.waffles} in {self.jobs} jobs',
+                 f'throughput: {self.get_throughput():.1f} waffles/h']
+        if self.latencies:
+            lines.append(f'order latency p50/p95/p99/max: {self.get_latency_percentile(50):.0f}/'
+                         f'{self.get_latency_percentile(95):.0f}/{self.get_latency_percentile(99):.0f}/'
+                         f'{max(self.latencies):.0f} s')
+        for name, utilization in self.get_iron_utilization().items():
+            lines.append(f'iron "{name}" utilization: {utilization:.0%}')
+        lines.append(f'arm utilization: {self.get_arm_utilization():.0%}')
+        lines.append(f'tool changes: {self.tool_changes} ({self.get_tool_changes_per_hour():.1f}/h)')
+        lines.append(f'deadlines: {self.deadline_stats}')
+        return "\n".join(lines)
+
+
+class WaffleCellSimulator:
+    """ Discrete-event simulation of the waffle cell.
+
+    Runs the real WaffleCoordinator, WaffleJobFactory, jobs and world equipment against a
+    virtual TimerService. Executing a task occupies an arm for its configured duration,
+    WaitingTasks run on the virtual clock, nothing touches real timers or the serial port. """
+
+    def __init__(self, irons=DEFAULT_IRONS, task_durations=None, tool_change_time=DEFAULT_TOOL_CHANGE_TIME,
+                 fry_time=DEFAULT_FRY_TIME, coordinator_cls=WaffleCoordinator, robots=1,
+                 policy: SchedulingPolicy = None, max_wait=0.0, over_fry_time=20.0, reserve_arm_time=True,
+                 preheat_time=None, dag_jobs=False, recorder=None):
+        self.irons = irons
+        self.recorder = recorder
+        self.robots = robots
+        self.policy = policy
+        self.max_wait = max_wait
+        self.over_fry_time = over_fry_time
+        self.reserve_arm_time = reserve_arm_time
+        self.preheat_time = preheat_time
+        self.dag_jobs = dag_jobs
+        self.task_durations = dict(DEFAULT_TASK_DURATIONS)
+        if task_durations is not None:
+            self.task_durations.update(task_durations)
+        self.tool_change_time = tool_change_time
+        self.fry_time = fry_time
+        self.coordinator_cls = coordinator_cls
+
+    def build_cell(self):
+        res_handler = WaffleResourceHandler()
+        for name, slots in self.irons:
+            res_handler.add_item("iron", WaffleIron(None, name, slots))
+        res_handler.add_item("bowl", Bowl(None, "red bowling bowl"))
+        res_handler.add_item("tray", Tray(None, "plastic tray"))
+        for num in range(self.robots):
+            arm = RobotArm(None, "arm " + str(num + 1))
+            res_handler.add_item("robot", arm)
+            res_handler.add_item("tool", arm.get_tool_stand())
+        deadline_scheduler = DeadlineScheduler(self.estimate_task_duration if self.reserve_arm_time else None)
+        coordinator = self.coordinator_cls(WaffleJobFactory(self.fry_time, self.over_fry_time, self.preheat_time, self.dag_jobs), res_handler,
+                                           order_batcher=OrderBatcher(self.max_wait),
+                                           deadline_scheduler=deadline_scheduler)
+        if self.policy is not None:
+            coordinator.set_policy(self.policy)
+        if self.recorder is not None:
+            self.recorder.reset_clock()
+            self.recorder.attach(coordinator)
+        return coordinator, res_handler
+
+    def get_task_duration(self, task):
+        return self.task_durations.get(type(task).__name__, 0.0)
+
+    def estimate_task_duration(self, task):
+        """ Task duration with a tool change if the task would need one now """
+        if task.need_toolchange():
+            return self.get_task_duration(task) + self.tool_change_time
+        return self.get_task_duration(task)
+
+    def run(self, arrivals: List[float]) -> SimulationReport:
+        """ Simulate until every order in the arrival stream (seconds, ascending) is served """
+        timer_service = TimerService(virtual=True)
+        previous_service = get_timer_service()
+        set_timer_service(timer_service)
+        previous_disable = logging.root.manager.disable
+        logging.disable(logging.WARNING)
+        try:
+            return self._run(timer_service, sorted(arrivals))
+        finally:
+            logging.disable(previous_disable)
+            set_timer_service(previous_service)
+
+    def _run(self, timer_service: TimerService, arrivals: List[float]) -> SimulationReport:
+        coordinator, res_handler = self.build_cell()
+        irons = res_handler.items["iron"]
+        arms = res_handler.items["robot"]
+        idle_arms = list(arms)
+        latencies = list()
+        iron_busy_time = {iron.get_name(): 0.0 for iron in irons}
+        iron_busy_since = dict()
+        busy_time = [0.0]
+        next_arrival = 0
+
+        def track_irons():
+            now = timer_service.now()
+            for iron in irons:
+                if not iron.is_free() and iron not in iron_busy_since:
+                    iron_busy_since[iron] = now
+                elif iron.is_free() and iron in iron_busy_since:
+                    iron_busy_time[iron.get_name()] += now - iron_busy_since.pop(iron)
+
+        def task_done(arm, job, task):
+            coordinator.complete_claimed_task(job)
+            if isinstance(task, ServeWaffle):
+                latencies.append(task.order.get_age(timer_service.now()))
+            idle_arms.append(arm)
+            track_irons()
+
+        while True:
+            now = timer_service.now()
+            while next_arrival < len(arrivals) and arrivals[next_arrival] <= now:
+                coordinator.add_order(Order(created=arrivals[next_arrival]))
+                next_arrival += 1
+            while coordinator.orders > 0 and coordinator.process_orders_if_possible():
+                pass
+            track_irons()
+
+            # every idle arm claims a task, the arm is busy until the task's completion timer fires
+            dispatched = False
+            for arm in sorted(idle_arms, key=arms.index):
+                job = coordinator.claim_next_job(arm)
+                if job is None:
+                    continue
+                tool_changes_before = arm.get_tool_stand().tool_changes
+                task = coordinator.run_claimed_task(job, arm)
+                duration = self.get_task_duration(task)
+                duration += (arm.get_tool_stand().tool_changes - tool_changes_before) * self.tool_change_time
+                busy_time[0] += duration
+                idle_arms.remove(arm)
+                timer_service.schedule(duration, task_done, arm, job, task)
+                dispatched = True
+            if dispatched:
+                continue
+
+            next_events = [deadline for deadline in (timer_service.next_deadline(),) if deadline is not None]
+            if next_arrival < len(arrivals):
+                next_events.append(arrivals[next_arrival])
+            if not next_events:
+                break
+            timer_service.advance_to(min(next_events))
+
+        tool_changes = sum(arm.get_tool_stand().tool_changes for arm in arms)
+        return SimulationReport(timer_service.now(), len(latencies), latencies, iron_busy_time,
+                                tool_changes, busy_time[0], len(arms), len(coordinator.finished_jobs),
+                                coordinator.deadline_scheduler.stats)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate the waffle cell for an order stream")
+    parser.add_argument("--orders-per-hour", type=float, default=60)
+    parser.add_argument("--hours", type=float, default=4)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--fry-time", type=float, default=DEFAULT_FRY_TIME)
+    parser.add_argument("--robots", type=int, default=1)
+    parser.add_argument("--tool-batching", action="store_true", help="group tasks needing the same tool")
+    parser.add_argument("--max-wait", type=float, default=0.0, help="seconds orders may wait to fill an iron")
+    parser.add_argument("--preheat-time", type=float, default=None, help="seconds an iron heats after turn on")
+    parser.add_argument("--dag", action="store_true", help="run the waffle jobs as dependency graphs")
+    parser.add_argument("--metrics", choices=("json", "prometheus"), default=None,
+                        help="print the scheduler timings and counters afterwards")
+    parser.add_argument("--sample-every", type=int, default=1, help="time one call in this many")
+    parser.add_argument("--record", default=None, help="write the orders and dispatched tasks to a trace file")
+    args = parser.parse_args()
+    recorder = TraceRecorder.open(args.record) if args.record is not None else None
+    get_metrics().configure(enabled=args.metrics is not None, sample_every=args.sample_every)
+
+    simulator = WaffleCellSimulator(fry_time=args.fry_time, robots=args.robots, max_wait=args.max_wait,
+                                    preheat_time=args.preheat_time, dag_jobs=args.dag,
+                                    policy=ToolBatchingPolicy() if args.tool_batching else None, recorder=recorder)
+    print(simulator.run(poisson_arrivals(args.orders_per_hour, args.hours, args.seed)))
+    if recorder is not None:
+        recorder.close()
+    if args.metrics == "json":
+        print(get_metrics().to_json())
+    elif args.metrics == "prometheus":
+        print(get_metrics().to_prometheus(), end="")
@@ -0,0 +1,104 @@
+import unittest
+import asyncio
+import socket
+from robot.async_robot import *
+from robot.robot import MelfaResponseType
+
+""" python -m unittest test.test_async_robot """
+
+standard_pos = "+500.00,+0.00,-46.30,+0.01,-179.99,R,A,C"
+
+
+class SocketControllerStandIn:
+    """ Answers position queries on one end of a socket pair after a delay """
+
+    def __init__(self, sock, delay=0.0):
+        self.sock = sock
+        self.delay = delay
+        self.received = list()
+        self.task = None
+
+    async def start(self):
+        reader, self.writer = await asyncio.open_connection(sock=self.sock)
+        self.task = asyncio.ensure_future(self.serve(reader))
+
+    async def serve(self, reader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            cmd = line.decode("ascii").rstrip()
+            self.received.append(cmd)
+            if cmd == "WH" or cmd.startswith("PR"):
+                await asyncio.sleep(self.delay)
+                self.writer.write(bytes(standard_pos + "\r\n", encoding="ascii"))
+                await self.writer.drain()
+
+    async def close(self):
+        self.writer.close()
+        self.task.cancel()
+
+
+class AsyncRobotMovementTest(unittest.IsolatedAsyncioTestCase):
+
+    async def open(self, delay=0.0, r_timeout=2):
+        pc_sock, controller_sock = socket.socketpair()
+        self.controller = SocketControllerStandIn(controller_sock, delay)
+        await self.controller.start()
+        self.serial = await AsyncMySerial.from_socket(pc_sock, r_timeout)
+        return AsyncRobotMovement(self.serial)
+
+    async def asyncTearDown(self):
+        await self.serial.close()
+        await self.controller.close()
+
+    async def test_get_position(self):
+        rm = await self.open()
+        pos = await rm.get_position()
+        self.assertEqual(pos.B, -179.99)
+        self.assertEqual(pos.grip, "C")
+
+    async def test_move_straight(self):
+        rm = await self.open()
+        await rm.move_straight(y=5, x=-10)
+        self.assertEqual(self.serial.get_last_msg_content(), "DS -10,5,0")
+        with self.assertRaises(ValueError):
+            await rm.move_straight(x=2000)
+
+    async def test_work_overlaps_robot_command(self):
+        rm = await self.open(delay=0.2)
+        ticks = list()
+
+        async def plan_next_task():
+            while len(ticks) < 5:
+                ticks.append(len(ticks))
+                await asyncio.sleep(0.01)
+
+        planner = asyncio.ensure_future(plan_next_task())
+        await rm.get_position()
+        self.assertEqual(len(ticks), 5)
+        await planner
+
+    async def test_gripper_de_powered_later(self):
+        rm = await self.open()
+        rm.gripper_duration = 0.05
+        await rm.close_gripper()
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.controller.received, ["OB +0"])
+        await rm.de_power_task
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.controller.received, ["OB +0", "OB -0", "OB -1"])
+
+    async def test_timeout(self):
+        rm = await self.open(delay=1, r_timeout=0.1)
+        with self.assertRaisesRegex(TimeoutError, "PR 99"):
+            await rm.read_position_inx(99)
+
+    async def test_commands_are_serialized(self):
+        await self.open(delay=0.05)
+        responses = await asyncio.gather(
+            self.serial.send_melfa_msg(MelfaMessage("WH", MelfaResponseType.POSITION)),
+            self.serial.send_melfa_msgs([MelfaMessage("OB +1", MelfaResponseType.NONE),
+                                         MelfaMessage("PR 1", MelfaResponseType.POSITION)]))
+        self.assertEqual(responses, [standard_pos, ["", standard_pos]])
+        self.assertEqual(self.controller.received, ["WH", "OB +1", "PR 1"])
@@ -1,6 +1,7 @@
 import unittest
 from unittest.mock import Mock
 import random
+import threading
 from control.control import *
 from world.world import Equipment, WaffleIron
 
@@ -29,10 +30,51 @@ class MockBaseJob(BaseJob):
     def need_toolchange(self):
         return self.req_tool_change
 
+    def get_tool_affinity(self):
+        return self.req_tool_change
+
     def get_current_priority(self):
         return self.prio
 
 
+def sorted_priority_job(jobs, high_prio_treshold=3):
+    """ Reference implementation: the filter and double sort used before the ready queue """
+    ready_jobs = list(filter(lambda x: x.is_ready(), jobs))
+    jobs_prio_sort = sorted(ready_jobs, key=lambda x: (x.get_current_priority()), reverse=True)
+    if len(jobs_prio_sort) == 0:
+        return None
+    if jobs_prio_sort[0].get_current_priority() >= high_prio_treshold:
+        return jobs_prio_sort[0]
+    jobs_tool_sort = sorted(ready_jobs, key=lambda x: (not x.need_toolchange(), x.get_current_priority()),
+                            reverse=True)
+    return jobs_tool_sort[0]
+
+
+class ManualTask(BaseTask):
+    """ Task that is finished from the outside, like a timer """
+
+    def __init__(self, name):
+        super().__init__(name, None)
+        self.finished = False
+
+    def set_finished(self):
+        self.finished = True
+        self._notify_finished()
+
+    def is_finished(self):
+        return self.finished
+
+
+class EventTask(BaseTask):
+
+    def __init__(self, name, event: threading.Event):
+        super().__init__(name, None)
+        self.event = event
+
+    def run(self):
+        self.event.set()
+
+
 class LoadedResourceHandler(ResourceHandler):
 
     def __init__(self):
@@ -47,7 +89,7 @@ class LoadedResourceHandler(ResourceHandler):
         return bowl
 
     def get_iron(self,free,res,name,slots):
-        iron = WaffleIron(None,slots)
+        iron = WaffleIron(None,name,slots)
         iron.free = free
         iron.has_reservation = res
         iron.name = name
@@ -107,6 +149,48 @@ class ResourceHandlerTest(unittest.TestCase):
         self.assertEqual(b3, None)
         self.assertEqual(b4, None)
 
+        rh.check_in(b1)
+        self.assertIs(rh.checkout_prechecked_item("bowl"), b1)
+
+    def test_checkout_matches_sorted_selection(self):
+        random.seed(5)
+        rh = ResourceHandler()
+        items = list()
+        for num in range(40):
+            item = Equipment(None, str(num), random.randint(1, 6))
+            item.free = random.random() > 0.3
+            items.append(item)
+            rh.add_item("iron", item)
+        for _ in range(200):
+            capacity = random.randint(0, 7)
+            free_items = list(filter(lambda x: x.is_free(), items))
+            expected = sorted(free_items, key=lambda x: abs(x.get_capacity() - capacity))
+            expected = expected[0] if expected else None
+            self.assertIs(rh.checkout_prechecked_item("iron", capacity), expected)
+            # flip some items back and forth from the outside
+            for item in random.sample(items, 3):
+                item.free = not item.is_free()
+
+    def test_concurrent_checkout(self):
+        rh = ResourceHandler()
+        for num in range(200):
+            rh.add_item("bowl", Equipment(None, str(num)))
+        taken = list()
+
+        def take():
+            item = rh.checkout_prechecked_item("bowl")
+            while item is not None:
+                taken.append(item)
+                item = rh.checkout_prechecked_item("bowl")
+
+        threads = [threading.Thread(target=take) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(taken), 200)
+        self.assertEqual(len(set(taken)), 200)
+
 
 class JobCoordinatorTest(unittest.TestCase):
 
@@ -118,6 +202,7 @@ class JobCoordinatorTest(unittest.TestCase):
         iron_mock_small.get_capacity.return_value = 1
 
         res_mock.checkout_prechecked_item.return_value = iron_mock
+        res_mock.get_free_capacities.return_value = [1, 2]
 
         jc = JobCoordinator(JobFactory(), res_mock)
         jc.add_order()
@@ -173,3 +258,139 @@ class JobCoordinatorTest(unittest.TestCase):
             else:
                 self.assertEqual(prioJob, None)
 
+    def test_ready_queue_matches_sorted_selection(self):
+        random.seed(3)
+        for _ in range(50):
+            joblist = [MockBaseJob(random.random() > 0.2, random.random() > 0.5, random.randint(1, 4))
+                       for _ in range(20)]
+            jc = JobCoordinator(JobFactory(), ResourceHandler())
+            jc.add_run_jobs(joblist.copy())
+            while True:
+                expected = sorted_priority_job(jc.running_jobs)
+                self.assertIs(jc.get_highest_priority_job(), expected)
+                if expected is None:
+                    break
+                jc.cancel_job(expected)
+
+    def test_ready_queue_update(self):
+        jc = JobCoordinator(JobFactory(), ResourceHandler())
+        waiting_job = MockBaseJob(False, False, 3)
+        other_job = MockBaseJob(True, False, 1)
+        jc.add_run_jobs([waiting_job, other_job])
+        self.assertIs(jc.get_highest_priority_job(), other_job)
+
+        # the job notifies the coordinator when its task is finished
+        waiting_job.ready = True
+        waiting_job._notify_changed()
+        self.assertIs(jc.get_highest_priority_job(), waiting_job)
+
+
+class CoordinatorEventLoopTest(unittest.TestCase):
+
+    def test_wakes_on_order_and_finished_task(self):
+        wait_task = ManualTask("wait")
+        served = threading.Event()
+        job = BaseJob(None, Equipment(None, "iron"))
+        job.task_queue.appendleft(wait_task)
+        job.task_queue.appendleft(EventTask("serve", served))
+        factory = Mock()
+        factory.create_job.return_value = job
+        rh = ResourceHandler()
+        rh.add_item("iron", job.iron)
+
+        loop = CoordinatorEventLoop(JobCoordinator(factory, rh))
+        loop.start()
+        loop.post_order()
+        # the waiting task is started but nothing more can be done until it finishes
+        self.assertFalse(served.wait(0.2))
+        wait_task.set_finished()
+        self.assertTrue(served.wait(2))
+        loop.stop(2)
+
+        self.assertEqual(loop.coordinator.finished_jobs, [job])
+        self.assertTrue(job.iron.is_free())
+
+
+class BarrierTask(BaseTask):
+    """ Task that only completes when another robot runs its BarrierTask at the same time """
+
+    def __init__(self, name, barrier: threading.Barrier):
+        super().__init__(name, None)
+        self.barrier = barrier
+
+    def run(self):
+        self.barrier.wait(2)
+
+
+class RobotWorkerPoolTest(unittest.TestCase):
+
+    def test_robots_work_in_parallel(self):
+        barrier = threading.Barrier(2)
+        rh = ResourceHandler()
+        jobs = list()
+        tasks = list()
+        for name in ("iron 1", "iron 2"):
+            job = BaseJob(None, Equipment(None, name))
+            tasks.append(BarrierTask("together", barrier))
+            job.task_queue.appendleft(tasks[-1])
+            rh.add_item("iron", job.iron)
+            jobs.append(job)
+        factory = Mock()
+        factory.create_job.side_effect = jobs
+
+        pool = RobotWorkerPool(JobCoordinator(factory, rh), ["left arm", "right arm"])
+        pool.start()
+        pool.post_order()
+        pool.post_order()
+        for _ in range(200):
+            if len(pool.coordinator.finished_jobs) == 2:
+                break
+            threading.Event().wait(0.01)
+        pool.stop(2)
+
+        self.assertFalse(barrier.broken)
+        self.assertCountEqual(pool.coordinator.finished_jobs, jobs)
+        self.assertCountEqual([task.robot for task in tasks], ["left arm", "right arm"])
+
+
+class DagJobTest(unittest.TestCase):
+
+    def test_runs_any_ready_task(self):
+        job = DagJob(None, None)
+        wait = job.add_task(ManualTask("preheat"))
+        fill = job.add_task(BaseTask("open for fill", None))
+        pour = job.add_task(BaseTask("pour", None), [wait, fill])
+        serve = job.add_task(BaseTask("serve", None, 3), [pour])
+        self.assertEqual(job.get_runnable_tasks(), [wait, fill])
+
+        self.assertIs(job.run_next_task(), wait)
+        # the preheat runs in the background, the fill does not wait for it
+        self.assertTrue(job.is_ready())
+        self.assertIs(job.run_next_task(), fill)
+        self.assertFalse(job.is_ready())
+        self.assertFalse(pour.prereq_met())
+        wait.set_finished()
+        self.assertTrue(pour.prereq_met())
+        self.assertEqual(list(job.get_upcoming_tasks()), [pour, serve])
+        job.run_next_task()
+        self.assertIs(job.run_next_task(), serve)
+        self.assertTrue(job.is_finished())
+
+    def test_finishes_in_background(self):
+        job = DagJob(None, Equipment(None, "iron"))
+        work = job.add_task(BaseTask("work", None))
+        wait = job.add_task(ManualTask("cool down"), [work])
+        factory = Mock()
+        factory.create_job.return_value = job
+        rh = ResourceHandler()
+        rh.add_item("iron", job.iron)
+        jc = JobCoordinator(factory, rh)
+        jc.add_order()
+        jc.process_orders_if_possible()
+
+        self.assertIs(jc.execute_next_job_task(), work)
+        self.assertIs(jc.execute_next_job_task(), wait)
+        self.assertEqual(jc.running_jobs, [job])
+        wait.set_finished()
+        self.assertEqual(jc.finished_jobs, [job])
+        self.assertTrue(job.iron.is_free())
@@ -0,0 +1,100 @@
+import unittest
+from unittest.mock import Mock
+from control.deadlines import *
+from control.control import BaseTask, BaseJob, JobCoordinator, ResourceHandler
+
+""" python -m unittest test.test_deadlines """
+
+
+class Task(BaseTask):
+
+    def __init__(self, name, deadline=None, finish_time=None):
+        super().__init__(name, None)
+        self.deadline = deadline
+        self.finish_time = finish_time
+
+    def get_finish_time(self):
+        return self.finish_time
+
+    def is_finished(self):
+        return self.finish_time is None
+
+
+def make_job(*tasks):
+    job = BaseJob(None, None)
+    for task in tasks:
+        job.task_queue.appendleft(task)
+    return job
+
+
+class DeadlineStatsTest(unittest.TestCase):
+
+    def test_record(self):
+        stats = DeadlineStats()
+        stats.record(Task("no deadline"), 10)
+        stats.record(Task("open", deadline=10), 8)
+        stats.record(Task("open", deadline=10), 13)
+        self.assertEqual(stats.tasks, 2)
+        self.assertEqual(stats.misses, 1)
+        self.assertEqual(stats.max_lateness, 3)
+        self.assertEqual(stats.missed_by_task, {"open": 1})
+        self.assertEqual(stats.get_miss_rate(), 0.5)
+
+
+class DeadlineSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.coordinator = JobCoordinator(Mock(), ResourceHandler())
+        self.scheduler = DeadlineScheduler(task_duration=lambda task: 10, clock=lambda: self.now)
+
+    def test_earliest_deadline_first(self):
+        late = make_job(Task("serve", deadline=50))
+        early = make_job(Task("open", deadline=20))
+        other = make_job(Task("pour"))
+        self.coordinator.add_run_jobs([other, late, early])
+        self.assertIs(self.scheduler.select_due(self.coordinator), early)
+        self.assertIs(self.scheduler.select_due(self.coordinator, lambda job: job is not early), late)
+
+    def test_reserves_arm_time(self):
+        frying = make_job(Task("fry", finish_time=15), Task("open", deadline=20), Task("serve", deadline=35))
+        frying.run_next_task()
+        pour = make_job(Task("pour"))
+        self.coordinator.add_run_jobs([frying, pour])
+        # a pour started at 0 is done before the frying is, one started at 12 delays the open past 20
+        self.now = 0
+        self.assertTrue(self.scheduler.can_start(self.coordinator, pour))
+        self.now = 12
+        self.assertFalse(self.scheduler.can_start(self.coordinator, pour))
+        # without duration estimates nothing is reserved
+        self.assertTrue(DeadlineScheduler(clock=lambda: self.now).can_start(self.coordinator, pour))
+
+    def test_deadline_index(self):
+        pour = make_job(Task("pour"))
+        self.coordinator.add_run_jobs([pour])
+        self.assertFalse(self.coordinator.ready_queue.has_deadline_jobs())
+        self.assertIsNone(self.scheduler.get_start_check(self.coordinator))
+
+        frying = make_job(Task("fry", finish_time=15), Task("open", deadline=20))
+        frying.run_next_task()
+        due = make_job(Task("open", deadline=30))
+        self.coordinator.add_run_jobs([pour, frying, due])
+        self.assertEqual(self.coordinator.ready_queue.get_deadline_jobs(), [frying, due])
+        self.assertIsNotNone(self.scheduler.get_start_check(self.coordinator))
+        self.assertIs(self.scheduler.select_due(self.coordinator), due)
+        # a claimed job is not due again, but its deadline task still counts as upcoming
+        self.coordinator.ready_queue.claim(due)
+        self.assertIsNone(self.scheduler.select_due(self.coordinator))
+        self.assertEqual(len(self.scheduler.get_upcoming(self.coordinator)), 2)
+        self.coordinator.ready_queue.remove(due)
+        self.coordinator.ready_queue.remove(frying)
+        self.assertIsNone(self.scheduler.get_start_check(self.coordinator))
+
+    def test_coordinator_records_misses(self):
+        coordinator = JobCoordinator(Mock(), ResourceHandler(), deadline_scheduler=self.scheduler)
+        job = make_job(Task("open", deadline=5))
+        coordinator.add_run_jobs([job])
+        self.now = 7
+        claimed = coordinator.claim_next_job()
+        coordinator.run_claimed_task(claimed)
+        self.assertEqual(self.scheduler.stats.misses, 1)
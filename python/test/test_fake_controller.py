@@ -0,0 +1,110 @@
+import os
+import time
+import unittest
+from robot.fake_controller import *
+from robot.robot import MySerial, RobotMovement, MelfaMessage, MelfaResponseType, Position
+
+""" python -m unittest test.test_fake_controller """
+
+
+class FakeMelfaControllerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.controller = FakeMelfaController()
+
+    def test_where(self):
+        self.assertEqual(self.controller.handle_line("WH"), "+500.00,+0.00,+46.30,+0.00,+180.00,R,A,O")
+        # the response is what Position parses
+        self.assertEqual(Position.from_string(self.controller.handle_line("WH")).z, 46.3)
+
+    def test_position_table(self):
+        self.assertEqual(self.controller.handle_line("PR 3"), "+0.00,+0.00,+0.00,+0.00,+0.00,R,A,O")
+        self.assertIsNone(self.controller.handle_line("PD 3,1.5,-2,3,4,5,L,B,C"))
+        self.assertEqual(self.controller.handle_line("PR 3"), "+1.50,-2.00,+3.00,+4.00,+5.00,L,B,C")
+
+    def test_moves(self):
+        self.controller.handle_line("DS 10,-5,0")
+        self.assertEqual(self.controller.position.get_coordinates(), (510, -5, 46.3, 0, 180))
+        self.controller.handle_line("DS 6.3")
+        self.assertAlmostEqual(self.controller.position.z, 40)
+        self.controller.handle_line("PD 1,100,0,50,0,180,R,A,O")
+        self.controller.handle_line("MA 1,0,0,10,0,0,R,A,O")
+        self.assertEqual(self.controller.position.get_coordinates(), (100, 0, 60, 0, 180))
+
+    def test_outputs(self):
+        self.controller.handle_line("OB +0")
+        self.assertEqual((self.controller.outputs, self.controller.position.grip), ({0}, "C"))
+        self.controller.handle_line("OB -0")
+        self.controller.handle_line("OB +1")
+        self.assertEqual((self.controller.outputs, self.controller.position.grip), ({1}, "O"))
+
+    def test_unknown_command(self):
+        self.assertRaises(ValueError, self.controller.handle_line, "XX 1")
+        self.assertRaises(ValueError, FakeMelfaController, error_mode="sometimes")
+
+    def test_wrong_arguments(self):
+        for line in ("OB", "PR", "PR x", "PD 3", "PD 3,1,2", "MA 1", "DS", "DS 1,2", "WH 1"):
+            self.assertRaises(ValueError, self.controller.handle_line, line)
+        # nothing was stored or moved
+        self.assertEqual(self.controller.table, dict())
+        self.assertEqual(self.controller.handle_line("WH"), "+500.00,+0.00,+46.30,+0.00,+180.00,R,A,O")
+
+    def test_timing(self):
+        controller = FakeMelfaController(baudrate=9600, speed=1000)
+        self.assertAlmostEqual(controller.transfer_time(b"WH\r\n"), 4 * 12 / 9600)
+        start = time.monotonic()
+        controller.handle_line("DS 100,0,0")
+        self.assertAlmostEqual(controller.busy_until - start, 0.1, places=2)
+
+
+class FakeControllerConnectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.controller = None
+        self.serial = None
+
+    def tearDown(self):
+        if self.serial is not None:
+            self.serial.close()
+        self.controller.stop()
+
+    def connect(self, controller, pty=False, r_timeout=2) -> RobotMovement:
+        self.controller = controller
+        address = controller.serve_pty() if pty else f'socket://127.0.0.1:{controller.serve_socket()}'
+        self.serial = MySerial(address, r_timeout=r_timeout)
+        return RobotMovement(self.serial)
+
+    def test_socket(self):
+        movement = self.connect(FakeMelfaController(speed=10000))
+        self.assertEqual(movement.get_position().x, 500)
+        movement.move_straight(-100, 0, 0)
+        movement.write_pos_to_controller(Position(1, 2, 3, 4, 5), 7)
+        movement.pose_cache.invalidate()
+        self.assertEqual(movement.get_position().x, 400)
+        self.assertEqual(movement.read_position_inx(7).get_coordinates(), (1, 2, 3, 4, 5))
+        self.assertEqual(self.controller.commands, 5)
+
+    @unittest.skipUnless(hasattr(os, "openpty"), "needs a pseudo terminal")
+    def test_pty(self):
+        movement = self.connect(FakeMelfaController(), pty=True)
+        self.assertEqual(movement.get_position().B, 180)
+
+    def test_malformed_commands(self):
+        self.connect(FakeMelfaController(), r_timeout=0.2)
+        for content in ("OB", "MA 1", "PD 3", "XX"):
+            self.serial.send_melfa_msg(MelfaMessage(content, MelfaResponseType.NONE))
+        self.assertRaises(TimeoutError, self.serial.send_melfa_msg, MelfaMessage("PR", MelfaResponseType.POSITION))
+        # the controller keeps serving, PD 3 stored nothing
+        self.assertEqual(self.serial.send_melfa_msg(MelfaMessage("WH", MelfaResponseType.POSITION)),
+                         "+500.00,+0.00,+46.30,+0.00,+180.00,R,A,O")
+        self.assertEqual(self.serial.send_melfa_msg(MelfaMessage("PR 3", MelfaResponseType.POSITION)),
+                         "+0.00,+0.00,+0.00,+0.00,+0.00,R,A,O")
+
+    def test_dropped_answer(self):
+        self.connect(FakeMelfaController(error_rate=1.0), r_timeout=0.1)
+        self.assertRaises(TimeoutError, self.serial.send_melfa_msg, MelfaMessage("WH", MelfaResponseType.POSITION))
+        self.assertEqual(self.controller.errors, 1)
+
+    def test_garbled_answer(self):
+        self.connect(FakeMelfaController(error_rate=1.0, error_mode="garble"))
+        self.assertRaises(NameError, self.serial.send_melfa_msg, MelfaMessage("WH", MelfaResponseType.POSITION))
@@ -0,0 +1,127 @@
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import unittest
+from log_pipeline.log_pipeline import *
+
+""" python -m unittest test.test_log_pipeline """
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+
+def record(msg, *args, level=logging.INFO, name="test"):
+    return logging.LogRecord(name, level, __file__, 1, msg, args, None)
+
+
+def read_lines(path):
+    with open(path) as log_file:
+        return log_file.read().splitlines()
+
+
+class BatchingRotatingFileHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "test.log")
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_batches(self):
+        handler = BatchingRotatingFileHandler(self.path, batch_size=3, flush_interval=10, clock=self.clock)
+        handler.handle(record("one"))
+        handler.handle(record("two"))
+        self.assertEqual(read_lines(self.path), [])
+        handler.handle(record("three"))
+        self.assertEqual(read_lines(self.path), ["one", "two", "three"])
+        handler.handle(record("four"))
+        self.clock.time = 10
+        handler.handle(record("five"))
+        self.assertEqual(len(read_lines(self.path)), 5)
+        handler.close()
+
+    def test_rotates_by_size(self):
+        handler = BatchingRotatingFileHandler(self.path, max_bytes=10, backup_count=2, clock=self.clock)
+        for msg in ("first", "second", "third", "fourth"):
+            handler.handle(record(msg))
+        handler.close()
+        self.assertEqual(read_lines(self.path), ["fourth"])
+        self.assertEqual(read_lines(self.path + ".1"), ["third"])
+        self.assertEqual(read_lines(self.path + ".2"), ["second"])
+        self.assertFalse(os.path.exists(self.path + ".3"))
+
+    def test_rotates_by_age(self):
+        handler = BatchingRotatingFileHandler(self.path, max_bytes=0, rotate_interval=60, clock=self.clock)
+        handler.handle(record("old"))
+        self.clock.time = 30
+        handler.handle(record("newer"))
+        self.clock.time = 60
+        handler.handle(record("new"))
+        handler.close()
+        self.assertEqual(read_lines(self.path), ["new"])
+        self.assertEqual(read_lines(self.path + ".1"), ["old", "newer"])
+
+
+class JsonLinesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "events.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_read_and_replay(self):
+        handler = BatchingRotatingFileHandler(self.path)
+        handler.setFormatter(JsonLinesFormatter())
+        handler.handle(record("Job %s is completed", 7, name="control.control"))
+        handler.handle(record("sent %s", "WH", level=logging.DEBUG, name="robot.robot.serial"))
+        handler.close()
+
+        events = list(read_events(self.path))
+        self.assertEqual([(event.name, event.levelno, event.getMessage()) for event in events],
+                         [("control.control", logging.INFO, "Job 7 is completed"),
+                          ("robot.robot.serial", logging.DEBUG, "sent WH")])
+
+        with self.assertLogs("control", logging.DEBUG) as logs:
+            self.assertEqual(replay(self.path, logging.INFO), 1)
+        self.assertEqual(logs.output, ["INFO:control.control:Job 7 is completed"])
+
+
+class LogPipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_pipeline(self):
+        path = os.path.join(self.directory, "debug.log")
+        events_path = os.path.join(self.directory, "events.jsonl")
+        root = logging.getLogger()
+        handlers, level = list(root.handlers), root.level
+        with LogPipeline(path, console_level=None, events_path=events_path, fmt="%(name)s:%(message)s") as pipeline:
+            self.assertEqual(root.handlers, [pipeline.queue_handler])
+            logging.getLogger("control.control").debug("Task %s started", "pour")
+        self.assertEqual(read_lines(path), ["control.control:Task pour started"])
+        self.assertEqual([event.getMessage() for event in read_events(events_path)], ["Task pour started"])
+        self.assertEqual((root.handlers, root.level), (handlers, level))
+
+    def test_drops_when_full(self):
+        handler = DeferredQueueHandler(queue.Queue(1))
+        handler.handle(record("sent %s", "WH"))
+        handler.handle(record("sent %s", "PR 1"))
+        self.assertEqual(handler.dropped, 1)
+        # formatting is left to the listener
+        self.assertEqual(handler.queue.get_nowait().args, ("WH",))
@@ -0,0 +1,99 @@
+import json
+import unittest
+from metrics.metrics import *
+
+""" python -m unittest test.test_metrics """
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_observe(self):
+        histogram = Histogram("latency", buckets=(1, 2, 4))
+        for value in (0.5, 1.5, 1.5, 3, 10):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [1, 2, 1, 1])
+        self.assertEqual(histogram.count, 5)
+        self.assertAlmostEqual(histogram.get_mean(), 3.3)
+        self.assertEqual((histogram.min, histogram.max), (0.5, 10))
+
+    def test_quantile(self):
+        histogram = Histogram("latency", buckets=(1, 2, 4))
+        self.assertEqual(histogram.get_quantile(0.5), 0.0)
+        for value in (1.2, 1.4, 1.6, 1.8):
+            histogram.observe(value)
+        # interpolated between the smallest and largest value of the bucket
+        self.assertAlmostEqual(histogram.get_quantile(0.5), 1.5)
+        self.assertAlmostEqual(histogram.get_quantile(1.0), 1.8)
+
+
+class MetricsRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.metrics = MetricsRegistry(clock=self.clock)
+
+    def test_counters_by_labels(self):
+        self.metrics.inc("tool_changes")
+        self.metrics.inc("tool_changes", 2)
+        self.metrics.inc("timeouts", port="COM1")
+        self.assertEqual(self.metrics.counter("tool_changes").value, 3)
+        self.assertEqual(self.metrics.counter("timeouts", port="COM1").value, 1)
+        self.assertEqual(self.metrics.counter("timeouts", port="COM2").value, 0)
+
+    def test_sampling(self):
+        self.metrics.configure(sample_every=4)
+        for _ in range(8):
+            start = self.metrics.start_timing()
+            self.clock.time += 0.5
+            self.metrics.stop_timing(start, "call_seconds")
+            self.metrics.inc("calls")
+        self.assertEqual(self.metrics.histogram("call_seconds").count, 2)
+        self.assertAlmostEqual(self.metrics.histogram("call_seconds").sum, 1.0)
+        self.assertEqual(self.metrics.counter("calls").value, 8)
+        with self.assertRaises(ValueError):
+            self.metrics.configure(sample_every=0)
+
+    def test_disabled(self):
+        self.metrics.configure(enabled=False)
+        self.assertIsNone(self.metrics.start_timing())
+        self.metrics.inc("calls")
+        self.assertEqual(self.metrics.snapshot()["counters"], [])
+
+    def test_timed(self):
+        previous = get_metrics()
+        set_metrics(self.metrics)
+        try:
+            @timed("work_seconds")
+            def work():
+                self.clock.time += 0.25
+                raise KeyError()
+            with self.assertRaises(KeyError):
+                work()
+        finally:
+            set_metrics(previous)
+        self.assertEqual(self.metrics.histogram("work_seconds").count, 1)
+        self.assertAlmostEqual(self.metrics.histogram("work_seconds").sum, 0.25)
+
+    def test_export(self):
+        self.metrics.inc("idles")
+        self.metrics.histogram("run_seconds", task="Pour \"batter\"").observe(0.002)
+        snapshot = json.loads(self.metrics.to_json())
+        self.assertEqual(snapshot["counters"][0]["value"], 1)
+        self.assertEqual(snapshot["histograms"][0]["count"], 1)
+        self.assertEqual(snapshot["histograms"][0]["buckets"][-1], ["+Inf", 0])
+
+        text = self.metrics.to_prometheus()
+        self.assertIn("# TYPE idles_total counter\nidles_total 1\n", text)
+        self.assertIn('run_seconds_bucket{task="Pour \\"batter\\"",le="0.001"} 0\n', text)
+        self.assertIn('run_seconds_bucket{task="Pour \\"batter\\"",le="0.0025"} 1\n', text)
+        self.assertIn('run_seconds_bucket{task="Pour \\"batter\\"",le="+Inf"} 1\n', text)
+        self.assertIn('run_seconds_count{task="Pour \\"batter\\""} 1\n', text)
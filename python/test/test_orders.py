@@ -0,0 +1,71 @@
+import unittest
+from unittest.mock import Mock
+from control.control import JobCoordinator, ResourceHandler, CoordinatorEvent
+from control.orders import *
+from timer.timer import TimerService, get_timer_service, set_timer_service
+from world.world import WaffleIron
+
+""" python -m unittest test.test_orders """
+
+
+def orders_at(*created):
+    return [Order(created=time) for time in created]
+
+
+class OrderBatcherTest(unittest.TestCase):
+
+    def test_immediate(self):
+        batcher = OrderBatcher()
+        self.assertEqual(batcher.get_capacity(orders_at(0), [1, 2], 0), 1)
+        self.assertEqual(batcher.get_capacity(orders_at(0), [2, 4], 0), 2)
+        self.assertEqual(batcher.get_capacity(orders_at(0, 0, 0), [1, 2], 0), 2)
+        self.assertEqual(batcher.get_capacity(orders_at(0, 0, 0), [2, 4], 0), 4)
+        self.assertIsNone(batcher.get_capacity(orders_at(0), [], 0))
+        self.assertIsNone(batcher.get_capacity([], [1], 0))
+
+    def test_waits_to_fill(self):
+        batcher = OrderBatcher(max_wait=60)
+        orders = orders_at(10, 20)
+        # full irons go right away, partly empty ones wait for the oldest order to reach max_wait
+        self.assertEqual(batcher.get_capacity(orders, [2, 4], 30), 2)
+        self.assertIsNone(batcher.get_capacity(orders, [3, 4], 30))
+        self.assertEqual(batcher.get_dispatch_time(orders), 70)
+        self.assertEqual(batcher.get_capacity(orders, [3, 4], 70), 3)
+        # three orders fill the small iron now, the third waits for the big one to fill
+        self.assertEqual(batcher.get_capacity(orders_at(10, 20, 30), [2, 4], 30), 2)
+
+
+class OrderIntakeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.default_service = get_timer_service()
+        self.timer_service = TimerService(virtual=True)
+        set_timer_service(self.timer_service)
+        self.rh = ResourceHandler()
+        self.triple = WaffleIron(None, "triple", 3)
+        self.rh.add_item("iron", self.triple)
+        self.factory = Mock()
+        self.factory.create_job.side_effect = lambda jobtype, iron, res_handler, orders: Mock(
+            is_ready=lambda: False, get_upcoming_tasks=lambda: iter(()))
+        self.jc = JobCoordinator(self.factory, self.rh, order_batcher=OrderBatcher(max_wait=30))
+        self.events = list()
+        self.jc.set_event_sink(lambda event, payload: self.events.append(event))
+
+    def tearDown(self):
+        set_timer_service(self.default_service)
+
+    def test_fills_iron_with_arbitrary_slots(self):
+        orders = [self.jc.add_order(Order("chocolate")) for _ in range(4)]
+        self.assertEqual(self.jc.orders, 4)
+        self.assertTrue(self.jc.process_orders_if_possible())
+        self.assertEqual(self.factory.create_job.call_args[1]["orders"], orders[:3])
+        self.assertEqual(self.jc.get_pending_orders(), orders[3:])
+        self.assertFalse(self.triple.is_free())
+
+    def test_waits_then_dispatches_partly_filled(self):
+        self.jc.add_order()
+        self.assertFalse(self.jc.process_orders_if_possible())
+        self.timer_service.advance(30)
+        self.assertEqual(self.events, [CoordinatorEvent.ORDERS_DUE])
+        self.assertTrue(self.jc.process_orders_if_possible())
+        self.assertEqual(self.jc.orders, 0)
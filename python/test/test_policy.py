@@ -0,0 +1,151 @@
+import unittest
+from unittest.mock import Mock
+from control.policy import *
+from control.control import BaseTask, BaseJob, JobCoordinator, ResourceHandler, PriorityPolicy
+
+""" python -m unittest test.test_policy """
+
+
+class Arm:
+
+    def __init__(self, tool):
+        self.tool = tool
+
+
+class ToolTask(BaseTask):
+
+    def __init__(self, name, tool, prio=2, arm=None):
+        super().__init__(name, None, prio)
+        self.tool = tool
+        self.arm = arm
+
+    def need_toolchange(self, robot=None):
+        return (robot or self.arm).tool != self.tool
+
+    def get_tool_affinity(self):
+        return self.tool
+
+
+class TimedTask(BaseTask):
+
+    def __init__(self, name, finish_time):
+        super().__init__(name, None, 4)
+        self.finish_time = finish_time
+
+    def get_finish_time(self):
+        return self.finish_time
+
+    def is_finished(self):
+        return False
+
+
+def make_job(*tasks):
+    job = BaseJob(None, None)
+    for task in tasks:
+        job.task_queue.appendleft(task)
+    return job
+
+
+class ToolBatchingPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.arm = Arm("gripper")
+        self.coordinator = JobCoordinator(Mock(), ResourceHandler())
+        self.policy = ToolBatchingPolicy(horizon=10, max_batch=2, clock=lambda: self.now)
+
+    def select(self, *jobs):
+        self.coordinator.add_run_jobs(list(jobs))
+        return self.policy.select_job(self.coordinator, self.arm)
+
+    def test_keeps_equipped_tool(self):
+        scoop = make_job(ToolTask("pour", "scoop", 2))
+        gripper = make_job(ToolTask("close", "gripper", 1))
+        self.assertIs(self.select(scoop, gripper), gripper)
+
+    def test_urgent_first_grouped_by_tool(self):
+        scoop = make_job(ToolTask("pour", "scoop", 2))
+        fork = make_job(ToolTask("serve", "fork", 3))
+        gripper = make_job(ToolTask("open", "gripper", 3))
+        self.assertIs(self.select(scoop, fork, gripper), gripper)
+        self.assertIs(self.select(scoop, fork), fork)
+
+    def test_switches_to_tool_with_most_work(self):
+        one_scoop = make_job(ToolTask("pour", "scoop"))
+        two_forks = make_job(ToolTask("serve 1", "fork"), ToolTask("serve 2", "fork"))
+        self.assertIs(self.select(one_scoop, two_forks), two_forks)
+
+    def test_counts_jobs_finishing_within_horizon(self):
+        one_scoop = make_job(ToolTask("pour", "scoop"))
+        one_fork = make_job(ToolTask("serve", "fork"))
+        frying = make_job(TimedTask("fry", 5), ToolTask("serve", "fork"))
+        frying.run_next_task()
+        self.assertIs(self.select(one_scoop, one_fork, frying), one_fork)
+        frying.current_task.finish_time = 50
+        self.assertIs(self.select(one_scoop, one_fork, frying), one_scoop)
+
+    def test_max_batch(self):
+        scoop = make_job(ToolTask("pour", "scoop"))
+        gripper = make_job(*[ToolTask("operate", "gripper") for _ in range(3)])
+        self.assertIs(self.select(scoop, gripper), gripper)
+        self.assertIs(self.select(scoop, gripper), gripper)
+        # the scoop has waited for two gripper tasks in a row
+        self.assertIs(self.select(scoop, gripper), scoop)
+
+
+class EarliestDeadlinePolicyTest(unittest.TestCase):
+
+    def test_earliest_deadline_urgent_first(self):
+        now = [0]
+        coordinator = JobCoordinator(Mock(), ResourceHandler())
+        policy = EarliestDeadlinePolicy(due_time=100, clock=lambda: now[0])
+        late = make_job(ToolTask("pour", "scoop"))
+        policy.job_created(coordinator, late)
+        now[0] = 10
+        early = make_job(ToolTask("pour", "scoop"))
+        early.deadline = 50
+        no_deadline = make_job(ToolTask("pour", "scoop"))
+        self.assertEqual(late.get_deadline(), 100)
+
+        coordinator.add_run_jobs([no_deadline, late, early])
+        self.assertIs(policy.select_job(coordinator), early)
+        urgent = make_job(ToolTask("serve", "fork", 3))
+        coordinator.add_run_jobs([no_deadline, late, early, urgent])
+        self.assertIs(policy.select_job(coordinator), urgent)
+
+
+class ShortestRemainingWorkPolicyTest(unittest.TestCase):
+
+    def test_least_work_first(self):
+        coordinator = JobCoordinator(Mock(), ResourceHandler())
+        policy = ShortestRemainingWorkPolicy(lambda task: 10 if task.tool == "scoop" else 1)
+        long_job = make_job(ToolTask("pour", "scoop"))
+        short_job = make_job(ToolTask("open", "gripper"), ToolTask("close", "gripper"))
+        coordinator.add_run_jobs([long_job, short_job])
+        self.assertEqual(policy.get_remaining_work(short_job), 2)
+        self.assertIs(policy.select_job(coordinator), short_job)
+
+
+class PreferredCapacityTest(unittest.TestCase):
+
+    def test_coordinator_asks_policy_for_capacity(self):
+        rh = ResourceHandler()
+        small = Mock()
+        small.get_capacity.return_value = 1
+        big = Mock()
+        big.get_capacity.return_value = 2
+        for item in (small, big):
+            item.is_free.return_value = True
+            rh.add_item("iron", item)
+
+        class SmallFirstPolicy(PriorityPolicy):
+            def get_preferred_capacity(self, coordinator, item_name="iron"):
+                return 1 if coordinator.orders > 0 else None
+
+        coordinator = JobCoordinator(Mock(), rh, SmallFirstPolicy())
+        self.assertIsNone(coordinator.get_equip_for_orders("iron"))
+        coordinator.add_order()
+        coordinator.add_order()
+        self.assertIs(coordinator.get_equip_for_orders("iron"), small)
+        coordinator.set_policy(PriorityPolicy())
+        self.assertIs(coordinator.get_equip_for_orders("iron"), big)
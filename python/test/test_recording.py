@@ -0,0 +1,104 @@
+import io
+import json
+import logging
+import os
+import tempfile
+import unittest
+from recording.recording import *
+from robot.robot import MelfaMessage, MelfaResponseType
+from simulation.simulation import WaffleCellSimulator
+
+""" python -m unittest test.test_recording """
+
+standard_pos = "+500.00,+0.00,-46.30,+0.01,-179.99,R,A,C"
+
+
+def read_trace(recorder: TraceRecorder) -> Trace:
+    recorder.flush()
+    return Trace([json.loads(line) for line in recorder.stream.getvalue().splitlines()])
+
+
+class TraceRecorderTest(unittest.TestCase):
+
+    def test_simulated_session(self):
+        recorder = TraceRecorder(io.StringIO())
+        WaffleCellSimulator(recorder=recorder).run([5.0, 5.0, 100.0])
+        trace = read_trace(recorder)
+        self.assertEqual(trace.get_arrivals(), [5.0, 5.0, 100.0])
+        self.assertEqual(trace.get_variants(), ["plain"] * 3)
+        first = trace.dispatches[0]
+        self.assertEqual((first["task"], first["robot"], first["t"]), ("start iron", "arm 1", 5.0))
+        # orders by arrival number, both first orders share the big iron
+        self.assertEqual(sorted(trace.get_order_latencies().keys()), [0, 1, 2])
+        self.assertIn([0, 1], [event["orders"] for event in trace.dispatches])
+
+    def test_replay_is_deterministic(self):
+        recorded = TraceRecorder(io.StringIO())
+        WaffleCellSimulator(recorder=recorded).run([0.0, 30.0, 45.0, 200.0])
+        trace = read_trace(recorded)
+        replayed = TraceRecorder(io.StringIO())
+        WaffleCellSimulator(recorder=replayed).run(trace.get_arrivals())
+        diff = compare_dispatches(trace, read_trace(replayed))
+        self.assertTrue(diff.is_identical())
+        self.assertEqual(diff.get_mean_latency_change(), 0.0)
+
+    def test_latency_change(self):
+        recorded = TraceRecorder(io.StringIO())
+        WaffleCellSimulator(recorder=recorded).run([0.0, 30.0])
+        replayed = TraceRecorder(io.StringIO())
+        WaffleCellSimulator(recorder=replayed, fry_time=100).run([0.0, 30.0])
+        diff = compare_dispatches(read_trace(recorded), read_trace(replayed))
+        self.assertTrue(diff.is_identical())
+        self.assertAlmostEqual(diff.get_mean_latency_change(), -80.0)
+
+    def test_divergence(self):
+        recorded = TraceRecorder(io.StringIO())
+        WaffleCellSimulator(recorder=recorded).run([0.0, 30.0])
+        replayed = TraceRecorder(io.StringIO())
+        WaffleCellSimulator(recorder=replayed, irons=(("Big nasty iron", 2),)).run([0.0, 30.0])
+        diff = compare_dispatches(read_trace(recorded), read_trace(replayed))
+        self.assertEqual(diff.first_divergence, 0)
+        self.assertIn("first difference at dispatch 0", str(diff))
+
+    def test_close_writes_queued_events(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "trace.jsonl")
+            recorder = TraceRecorder.open(path, clock=lambda: 0.0)
+            for inx in range(1000):
+                recorder.melfa_round_trip(f'PR {inx}', "", 0.01)
+            recorder.close()
+            recorder.close()
+            trace = load_trace(path)
+        self.assertEqual([event["cmd"] for event in trace.melfa], [f'PR {inx}' for inx in range(1000)])
+
+    def test_write_error(self):
+        stream = io.StringIO()
+        recorder = TraceRecorder(stream, clock=lambda: 0.0)
+        stream.close()
+        with self.assertLogs("recording.recording", logging.ERROR):
+            recorder.melfa_round_trip("WH", standard_pos, 0.01)
+            self.assertRaises(ValueError, recorder.flush)
+        # later events are dropped instead of queued
+        recorder.melfa_round_trip("WH", standard_pos, 0.01)
+        self.assertEqual(recorder.events.qsize(), 0)
+        self.assertRaises(ValueError, recorder.flush)
+
+
+class ReplaySerialTest(unittest.TestCase):
+
+    def setUp(self):
+        self.trace = Trace([{"kind": "melfa", "cmd": "WH", "response": standard_pos, "seconds": 0.05, "t": 0},
+                            {"kind": "melfa", "cmd": "DS 10,0,0", "response": "", "seconds": 0.02, "t": 1}])
+
+    def test_replay(self):
+        serial = ReplaySerial(self.trace)
+        recorder = TraceRecorder(io.StringIO())
+        recorder.attach(serial=serial)
+        self.assertEqual(len(replay_melfa(self.trace, serial)), 2)
+        self.assertTrue(serial.ser.is_done())
+        self.assertEqual([(event["cmd"], event["response"]) for event in read_trace(recorder).melfa],
+                         [("WH", standard_pos), ("DS 10,0,0", "")])
+
+    def test_mismatch(self):
+        serial = ReplaySerial(self.trace)
+        self.assertRaises(ReplayMismatchError, serial.send_melfa_msg, MelfaMessage("PR 1", MelfaResponseType.POSITION))
@@ -0,0 +1,120 @@
+import unittest
+import threading
+from control.reservation import *
+from world.world import Equipment, WaffleIron
+
+""" python -m unittest test.test_reservation """
+
+
+class ReservationManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.rh = ResourceHandler()
+        self.small = WaffleIron(None, "small", 1)
+        self.big = WaffleIron(None, "big", 2)
+        self.rh.add_item("iron", self.small)
+        self.rh.add_item("iron", self.big)
+        self.rm = ReservationManager(self.rh, clock=lambda: self.now)
+
+    def test_best_fit_and_release(self):
+        r1 = self.rm.try_reserve("iron", 1)
+        self.assertIs(r1.get_item(), self.small)
+        self.assertTrue(self.small.is_reserved())
+        self.assertFalse(self.small.is_free())
+
+        r2 = self.rm.try_reserve("iron", 1)
+        r3 = self.rm.try_reserve("iron", 1)
+        self.assertIs(r2.get_item(), self.big)
+        self.assertIs(r3.get_item(), self.big)
+        self.assertEqual(self.big.get_capacity_used(), 2)
+        self.assertIsNone(self.rm.try_reserve("iron", 1))
+        # reserved items are not handed out by a plain checkout either
+        self.assertIsNone(self.rh.checkout_prechecked_item("iron"))
+
+        r2.release()
+        r2.release()
+        self.assertEqual(self.big.get_capacity_used(), 1)
+        self.assertFalse(self.big.is_free())
+        r3.release()
+        self.assertTrue(self.big.is_free())
+        self.assertFalse(self.big.is_reserved())
+
+        stats = self.rm.get_stats()["iron"]
+        self.assertEqual(stats["granted"], 3)
+        self.assertEqual(stats["denied"], 1)
+        self.assertEqual(stats["released"], 2)
+
+    def test_checked_out_items_are_skipped(self):
+        self.rh.checkout_prechecked_item("iron", 2)
+        self.assertIsNone(self.rm.try_reserve("iron", 2))
+        self.assertIs(self.rm.try_reserve("iron", 1).get_item(), self.small)
+
+    def test_expiry(self):
+        r1 = self.rm.try_reserve("iron", 2, ttl=5)
+        self.assertIsNone(self.rm.try_reserve("iron", 2))
+        self.now = 6
+        r2 = self.rm.try_reserve("iron", 2)
+        self.assertIs(r2.get_item(), self.big)
+        self.assertFalse(r1.is_active())
+        self.assertEqual(self.rm.get_stats()["iron"]["expired"], 1)
+
+    def test_expiry_in_deadline_order(self):
+        rh = ResourceHandler()
+        for num in range(3):
+            rh.add_item("bowl", Equipment(None, str(num), 2))
+        rm = ReservationManager(rh, clock=lambda: self.now)
+        late = rm.try_reserve("bowl", 2, ttl=20)
+        early = rm.try_reserve("bowl", 2, ttl=5)
+        kept = rm.try_reserve("bowl", 1)
+        early.release()
+        self.now = 10
+        rm.expire_reservations("bowl")
+        self.assertTrue(late.is_active())
+        self.assertEqual(rm.get_stats()["bowl"]["expired"], 0)
+        # the partly reserved bowl fits better than a free one
+        shared = rm.try_reserve("bowl", 1)
+        self.assertIs(shared.get_item(), kept.get_item())
+        self.now = 20
+        rm.expire_reservations("bowl")
+        self.assertFalse(late.is_active())
+        self.assertEqual(rm.get_reservations("bowl"), [kept, shared])
+        self.assertEqual(rm.get_stats()["bowl"]["expired"], 1)
+
+    def test_context_manager(self):
+        with self.rm.try_reserve("iron", 2) as reservation:
+            self.assertEqual(self.big.get_capacity_used(), 2)
+        self.assertFalse(reservation.is_active())
+        self.assertTrue(self.big.is_free())
+
+    def test_reserve_waits_for_release(self):
+        held = self.rm.try_reserve("iron", 2)
+        timer = threading.Timer(0.05, held.release)
+        timer.start()
+        reservation = self.rm.reserve("iron", 2, timeout=2)
+        self.assertIs(reservation.get_item(), self.big)
+        self.assertIsNone(self.rm.reserve("iron", 2, timeout=0.05))
+
+    def test_concurrent_requesters(self):
+        rh = ResourceHandler()
+        for num in range(10):
+            rh.add_item("bowl", Equipment(None, str(num), 3))
+        rm = ReservationManager(rh)
+        granted = list()
+
+        def requester():
+            for _ in range(20):
+                reservation = rm.try_reserve("bowl", 1)
+                if reservation is not None:
+                    granted.append(reservation)
+
+        threads = [threading.Thread(target=requester) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # 10 bowls with 3 slots each, never more
+        self.assertEqual(len(granted), 30)
+        for item in rh.items["bowl"]:
+            self.assertEqual(item.get_capacity_used(), 3)
+        self.assertEqual(rm.get_stats()["bowl"]["attempts"], 160)
@@ -1,7 +1,14 @@
 import unittest
 from robot.robot import *
+from robot.robot_logging import *
+from metrics.metrics import MetricsRegistry, get_metrics, set_metrics
+from timer.timer import TimerService
 from queue import Queue
 from threading import Thread
+import contextlib
+import io
+import logging
+import os
 import time
 
 """ python -m unittest test.test_robot """
@@ -34,6 +41,9 @@ class MockMySerialUp(MySerial):
         print("in mock, last msg content:"+self.get_last_msg_content())
         return self.test_output
 
+    def send_melfa_msgs(self, msgs):
+        return [self.send_melfa_msg(msg) for msg in msgs]
+
     def get_sent_msgs(self):
         return self.sent_msgs
 
@@ -127,6 +137,116 @@ class MySerialTest(unittest.TestCase):
         pc_port.close()
         controller_port.close()
 
+class PtyControllerStandIn:
+    """ Answers position queries on the master side of a pty, MySerial opens the slave side """
+
+    def __init__(self, answer=True, first_delay=0.0, pr_response=standard_pos):
+        self.master, self.slave = os.openpty()
+        self.answer = answer
+        self.first_delay = first_delay
+        self.pr_response = pr_response
+        self.received = list()
+        self.reads = 0
+        self.thread = Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def port_name(self):
+        return os.ttyname(self.slave)
+
+    def serve(self):
+        buffer = b""
+        while True:
+            try:
+                data = os.read(self.master, 1024)
+            except OSError:
+                return
+            if not data:
+                return
+            self.reads += 1
+            buffer += data
+            while b"\r\n" in buffer:
+                line, buffer = buffer.split(b"\r\n", 1)
+                cmd = line.decode("ascii")
+                self.received.append(cmd)
+                if self.answer and (cmd == "WH" or cmd.startswith("PR")):
+                    time.sleep(self.first_delay)
+                    self.first_delay = 0.0
+                    response = standard_pos if cmd == "WH" else self.pr_response
+                    os.write(self.master, bytes(response + "\r\n", encoding="ascii"))
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+
+@unittest.skipUnless(hasattr(os, "openpty"), "needs a pty")
+class PipelinedSerialTest(unittest.TestCase):
+
+    def test_responses_matched_in_order(self):
+        controller = PtyControllerStandIn()
+        ser = MySerial(controller.port_name())
+        msgs = [MelfaMessage("OB +1", MelfaResponseType.NONE),
+                MelfaMessage("WH", MelfaResponseType.POSITION),
+                MelfaMessage("OB -1", MelfaResponseType.NONE),
+                MelfaMessage("PR 99", MelfaResponseType.POSITION)]
+        responses = ser.send_melfa_msgs(msgs)
+        ser.close()
+        controller.close()
+
+        self.assertEqual(responses, ["", standard_pos, "", standard_pos])
+        self.assertEqual(controller.received, ["OB +1", "WH", "OB -1", "PR 99"])
+        self.assertEqual(ser.get_last_msg_content(), "PR 99")
+
+    def test_queue_and_flush(self):
+        controller = PtyControllerStandIn()
+        ser = MySerial(controller.port_name())
+        ser.queue_melfa_msg(MelfaMessage("OB -0", MelfaResponseType.NONE))
+        ser.queue_melfa_msg(MelfaMessage("OB -1", MelfaResponseType.NONE))
+        self.assertEqual(controller.received, [])
+        self.assertEqual(ser.flush(), ["", ""])
+        self.assertEqual(ser.flush(), [])
+        ser.send_melfa_msg(MelfaMessage("WH", MelfaResponseType.POSITION))
+        ser.close()
+        controller.close()
+        self.assertEqual(controller.received, ["OB -0", "OB -1", "WH"])
+
+    def test_burst_metrics(self):
+        previous = get_metrics()
+        set_metrics(MetricsRegistry())
+        try:
+            controller = PtyControllerStandIn()
+            ser = MySerial(controller.port_name())
+            ser.send_melfa_msgs([MelfaMessage("OB +1", MelfaResponseType.NONE),
+                                 MelfaMessage("WH", MelfaResponseType.POSITION)])
+            ser.flush()
+            ser.close()
+            controller.close()
+            self.assertEqual(get_metrics().histogram("melfa_burst_seconds").count, 1)
+            self.assertEqual(get_metrics().counter("melfa_burst_messages").value, 2)
+        finally:
+            set_metrics(previous)
+
+    def test_pipelined_timeout(self):
+        controller = PtyControllerStandIn(answer=False)
+        ser = MySerial(controller.port_name(), r_timeout=0.2)
+        msgs = [MelfaMessage("OB +1", MelfaResponseType.NONE), MelfaMessage("WH", MelfaResponseType.POSITION)]
+        with self.assertRaisesRegex(TimeoutError, "WH"):
+            ser.send_melfa_msgs(msgs)
+        ser.close()
+        controller.close()
+
+        # answers arriving after the timeout are not taken for the answers to the next command
+        other_pos = "+1.00,+2.00,+3.00,+0.00,+0.00,R,A,O"
+        controller = PtyControllerStandIn(first_delay=0.3, pr_response=other_pos)
+        ser = MySerial(controller.port_name(), r_timeout=0.2)
+        msgs = [MelfaMessage("PR 1", MelfaResponseType.POSITION), MelfaMessage("PR 2", MelfaResponseType.POSITION)]
+        with self.assertRaisesRegex(TimeoutError, "PR 1"):
+            ser.send_melfa_msgs(msgs)
+        self.assertEqual(ser.send_melfa_msg(MelfaMessage("WH", MelfaResponseType.POSITION)), standard_pos)
+        ser.close()
+        controller.close()
+
+
 class RobotMovementTest(unittest.TestCase):
 
     def test_co_validation(self):
@@ -135,6 +255,26 @@ class RobotMovementTest(unittest.TestCase):
         self.assertRaises(ValueError, rm.validate_limits, -999, 999, 1001)
         self.assertRaises(TypeError, rm.validate_limits, -999, 999, "a")
 
+    def test_joint_validation(self):
+        rm = RobotMovement(None)
+        rm.validate_joint(-180, 180)
+        self.assertRaises(ValueError, rm.validate_joint, 181)
+        rm = RobotMovement(None, limits=WorkspaceLimits(upper=(1000, 1000, 1000, 90, 120)))
+        self.assertRaises(ValueError, rm.validate_joint, 100)
+
+    def test_batch_validation(self):
+        rm = RobotMovement(None, limits=WorkspaceLimits((-100, -100, 0, -180, -180), (100, 100, 50, 180, 180)))
+        rows = [(0, 0, 10, 0, 0), (0, 0, -1, 0, 0), (50, 50, 50, 0, 0), (101, 0, 0, 0, 200)]
+        self.assertEqual(rm.find_limit_violations(rows), [1, 3])
+        positions = [Position(*row) for row in rows]
+        self.assertEqual(rm.find_limit_violations(positions), [1, 3])
+        self.assertEqual(rm.find_limit_violations(PositionArray.from_positions(positions)), [1, 3])
+        with self.assertRaises(LimitViolationError) as error:
+            rm.validate_positions(rows)
+        self.assertEqual(error.exception.indices, [1, 3])
+        rm.validate_positions(rows[:1])
+        self.assertRaises(ValueError, rm.validate_positions, [(0, 0, 0)])
+
     def test_move_straight(self):
         mys = MockMySerialUp("")
         rm = RobotMovement(mys)
@@ -152,11 +292,12 @@ class RobotMovementTest(unittest.TestCase):
     def test_close_gripper(self):
         """ Make sure it first activates, and then after a while, sends deactivation of output """
         mys = MockMySerialUp(standard_pos)
-        rm = RobotMovement(mys)
+        timer_service = TimerService(virtual=True)
+        rm = RobotMovement(mys, timer_service)
         rm.close_gripper()
         num_msgs_sent = len(mys.get_sent_msgs())
         self.assertEqual(num_msgs_sent, 1)
-        time.sleep(4) # wait for the timer to send de_activation_msgs
+        timer_service.advance(4) # let the timer send de_activation_msgs
         num_msgs_sent = len(mys.get_sent_msgs())
         self.assertEqual(num_msgs_sent, 3)
         self.assertEqual(mys.get_last_msg_content(), "OB -1")
@@ -168,6 +309,67 @@ class RobotMovementTest(unittest.TestCase):
         self.assertEqual(str(std_pos_obj), standard_pos_simple)
 
 
+class PoseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.mys = MockMySerialUp(standard_pos)
+        self.rm = RobotMovement(self.mys, pose_cache=PoseCache(ttl=10, current_ttl=1, clock=lambda: self.now))
+
+    def test_read_position_cached(self):
+        self.rm.read_position_inx(5)
+        pos = self.rm.read_position_inx(5)
+        assert_standard_pos(self, pos)
+        self.assertEqual(len(self.mys.get_sent_msgs()), 1)
+        # a copy is handed out, changing it does not change the cache
+        pos.x = 1
+        assert_standard_pos(self, self.rm.read_position_inx(5))
+        self.now = 11
+        self.rm.read_position_inx(5)
+        self.assertEqual(len(self.mys.get_sent_msgs()), 2)
+
+    def test_write_updates_cache(self):
+        self.rm.write_pos_to_controller(Position(x=1), 7)
+        self.assertEqual(self.rm.read_position_inx(7).x, 1)
+        self.assertEqual(self.mys.get_last_msg_content(), "PD 7,1,0,0,0,0,R,A,O")
+
+    def test_motion_invalidates_current(self):
+        self.rm.get_position()
+        self.rm.get_position()
+        self.assertEqual(len(self.mys.get_sent_msgs()), 1)
+        self.rm.move_straight(x=1)
+        self.rm.get_position()
+        self.assertEqual(self.mys.get_last_msg_content(), "WH")
+        self.assertEqual(len(self.mys.get_sent_msgs()), 3)
+        self.now = 2
+        self.rm.get_position()
+        self.assertEqual(len(self.mys.get_sent_msgs()), 4)
+
+    def test_timed_out_motion_invalidates_current(self):
+        self.rm.get_position()
+        send = self.mys.send_melfa_msg
+
+        def time_out(msg):
+            send(msg)
+            raise TimeoutError(f'cmd {msg.content} timed out')
+        self.mys.send_melfa_msg = time_out
+        self.assertRaises(TimeoutError, self.rm.move_tool_straight, 5)
+        self.assertRaises(TimeoutError, self.rm.write_pos_to_controller, Position(x=1), 7)
+        self.mys.send_melfa_msg = send
+        # the arm may have moved, the pose is asked for again
+        self.rm.get_position()
+        self.rm.read_position_inx(7)
+        self.assertEqual([msg.content for msg in self.mys.get_sent_msgs()][-2:], ["WH", "PR 7"])
+
+    def test_move_with_offset_reads_slot_once(self):
+        self.mys.test_output = "+0.00,+0.00,+0.00,+0.00,+0.00,R,A,O"
+        self.rm.move_to_position_with_offset(1, Position(z=10))
+        self.assertEqual([msg.content for msg in self.mys.get_sent_msgs()],
+                         ["PR 99", "PD 99,0,0,10,0,0,R,A,O", "MA 1,0,0,10,0,0,R,A,O"])
+        self.rm.move_to_position_with_offset(1, Position(z=10))
+        self.assertEqual(len(self.mys.get_sent_msgs()), 3)
+
+
 class PositionTest(unittest.TestCase):
 
     def test_pos_string_to_dict(self):
@@ -176,6 +378,22 @@ class PositionTest(unittest.TestCase):
         self.assertEqual(dict.__len__(), 8)
         self.assertEqual(dict.get("B"), -179.99)
 
+    def test_pos_string_to_dict_quiet(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            Position.pos_string_to_dict(standard_pos)
+        self.assertEqual(out.getvalue(), "")
+
+    def test_pos_string_to_dict_illegal(self):
+        self.assertRaises(SyntaxError, Position.pos_string_to_dict, "+500.00,+0.00,+46.30,+0.00+179.99,R,A,O")
+
+    def test_parse_position_table(self):
+        lines = [standard_pos + "\r\n", "+1.00,+2.00,+3.00,+4.00,+5.00,L,B,O"]
+        coords, flags = Position.parse_position_table(lines)
+        self.assertEqual(list(coords), [500, 0, -46.3, 0.01, -179.99, 1, 2, 3, 4, 5])
+        self.assertEqual(flags, "RACLBO")
+        self.assertRaises(SyntaxError, Position.parse_position_table, [standard_pos, "WH"])
+
     def test_constructor(self):
         myPos = Position(y=5)
         self.assertTrue(myPos.y,5)
@@ -197,5 +415,149 @@ class PositionTest(unittest.TestCase):
         self.assertEqual(str(pos_obj),"500.0,0.0,46.3,0.0,-179.99,R,A,O")
 
 
+    def test_slots(self):
+        pos_obj = Position.from_string(standard_pos)
+        self.assertFalse(hasattr(pos_obj, "__dict__"))
+        self.assertRaises(AttributeError, setattr, pos_obj, "q", 1)
+
+
+class PositionArrayTest(unittest.TestCase):
+
+    lines = [standard_pos, "+1.00,+2.00,+3.00,+4.00,+5.00,L,B,O", "+0.00,+2.00,+3.00,+0.00,+0.00,R,A,O"]
+
+    def test_round_trip(self):
+        pos_array = PositionArray.from_strings(self.lines)
+        self.assertEqual(len(pos_array), 3)
+        assert_standard_pos(self, pos_array[0])
+        self.assertEqual(pos_array.to_strings(), [str(Position.from_string(line)) for line in self.lines])
+        from_positions = PositionArray.from_positions(Position.from_string(line) for line in self.lines)
+        self.assertEqual(from_positions.to_strings(), pos_array.to_strings())
+        self.assertEqual(str(pos_array[-1]), "0.0,2.0,3.0,0.0,0.0,R,A,O")
+        self.assertRaises(IndexError, pos_array.__getitem__, 3)
+
+    def test_offset(self):
+        pos_array = PositionArray.from_strings(self.lines).offset(x=10, B=-1)
+        self.assertEqual(pos_array[1].x, 11)
+        self.assertEqual(pos_array[1].B, 4)
+        self.assertEqual(pos_array[1].y, 2)
+        self.assertEqual(pos_array[1].arg1, "L")
+
+    def test_limit_violations(self):
+        pos_array = PositionArray.from_strings(self.lines)
+        lower = [-10, -10, -10, -10, -10]
+        upper = [10, 10, 10, 10, 10]
+        # the standard position is outside in both x and B but reported once
+        self.assertEqual(pos_array.limit_violations(lower, upper), [0])
+        self.assertEqual(pos_array.limit_violations([-1000] * 5, [1000] * 5), [])
+
+    def test_distances(self):
+        pos_array = PositionArray.from_strings(self.lines[1:])
+        self.assertEqual(list(pos_array.distances_to(1, 2, 3)), [0, 1])
+        self.assertEqual(list(pos_array.segment_lengths()), [1])
+
+
+class RobotLoggingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mys = MySerial("loop://")
+        self.rm = RobotMovement(self.mys)
+
+    def tearDown(self):
+        set_component_levels(logging.NOTSET, serial=logging.NOTSET, movement=logging.NOTSET)
+        self.mys.close()
+
+    def test_quiet_stdout(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.rm.move_straight(10, 0, 0)
+            self.mys.get_response()
+        self.assertEqual(out.getvalue(), "")
+
+    def test_component_levels(self):
+        set_component_levels(serial=logging.DEBUG, movement=logging.INFO)
+        self.assertEqual(get_component_levels()["movement"], logging.INFO)
+        with self.assertLogs("robot.robot", logging.DEBUG) as logs:
+            self.rm.move_straight(10, 0, 0)
+        self.assertEqual(logs.output, ["DEBUG:robot.robot.serial:sent serial text: DS 10,0,0"])
+        self.assertRaises(ValueError, get_component_logger, "gripper")
+
+    def test_queue_logging(self):
+        set_component_levels(logging.DEBUG)
+        records = list()
+        handler = logging.Handler()
+        handler.emit = records.append
+        listener = start_queue_logging(handler)
+        self.rm.move_tool_straight(5)
+        listener.stop()
+        self.assertEqual([record.getMessage() for record in records],
+                         ["sent serial text: DS 5", "moved tool straight by 5"])
+        self.assertTrue(logging.getLogger("robot.robot").propagate)
+
+
+class TrajectoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mys = MockMySerialUp(standard_pos)
+        self.rm = RobotMovement(self.mys)
+
+    def sent(self):
+        return [msg.content for msg in self.mys.get_sent_msgs()]
+
+    def test_merges_collinear_moves(self):
+        trajectory = self.rm.trajectory()
+        trajectory.straight(z=-5).straight(z=-5).straight(z=-0.1).straight(z=-0.2)
+        trajectory.straight(0, 0, 0)
+        trajectory.straight(1, 1, 0).straight(2, 2, 0)
+        trajectory.straight(z=5)
+        trajectory.tool_straight(10).tool_straight(5).tool_straight(-15)
+        self.assertEqual(trajectory.send(start=Position(500, 0, 100)), 5)
+        self.assertEqual(self.sent(), ["DS 0,0,-10.3", "DS 3,3,0", "DS 0,0,5", "DS 15", "DS -15"])
+
+    def test_merge_stays_a_valid_command(self):
+        trajectory = self.rm.trajectory()
+        trajectory.tool_straight(60).tool_straight(60)
+        self.assertEqual(len(trajectory), 2)
+        self.assertRaises(ValueError, trajectory.straight, 1001, 0, 0)
+
+    def test_validates_before_sending(self):
+        trajectory = self.rm.trajectory()
+        trajectory.straight(x=600).straight(y=10).straight(x=-600).tool_straight(50)
+        with self.assertRaises(LimitViolationError) as error:
+            trajectory.send()
+        self.assertEqual(error.exception.indices, [0, 1])
+        # the start comes from the controller, nothing was moved
+        self.assertEqual(self.sent(), ["WH"])
+        self.assertEqual(trajectory.get_waypoints(Position()).column(2).tolist(), [0, 0, 0, -50])
+
+    def test_streams_in_chunks(self):
+        batches = list()
+        self.mys.send_melfa_msgs = lambda msgs: batches.append([msg.content for msg in msgs])
+        trajectory = self.rm.trajectory(chunk_size=2)
+        for step in range(5):
+            trajectory.straight(x=1 if step % 2 else -1)
+        trajectory.send(validate=False)
+        self.assertEqual(batches, [["DS -1,0,0", "DS 1,0,0"], ["DS -1,0,0", "DS 1,0,0"], ["DS -1,0,0"]])
+
+    def test_failed_chunk_invalidates_current(self):
+        self.rm.get_position()
+        trajectory = self.rm.trajectory(chunk_size=1).straight(x=1).tool_straight(5)
+        chunks = list()
+
+        def send_melfa_msgs(msgs):
+            chunks.append(msgs)
+            if len(chunks) == 2:
+                raise TimeoutError("cmd DS 5 timed out")
+        self.mys.send_melfa_msgs = send_melfa_msgs
+        self.assertRaises(TimeoutError, trajectory.send, validate=False)
+        self.rm.get_position()
+        self.assertEqual(self.sent(), ["WH", "WH"])
+
+    def test_store(self):
+        self.rm.trajectory().straight(z=-5).tool_straight(5).store(20, start=Position(500, 0, 100))
+        self.assertEqual(self.sent(), ["PD 20,500.0,0.0,95.0,0.0,0.0,R,A,O", "PD 21,500.0,0.0,90.0,0.0,0.0,R,A,O"])
+        self.assertEqual(self.rm.read_position_inx(21).z, 90)
+        self.assertEqual(len(self.sent()), 2)
+
+
 if __name__ == '__main__':
     unittest.main()
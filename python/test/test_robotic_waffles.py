@@ -7,10 +7,12 @@ from robotic_waffles import *
 class WaitingTaskTest(unittest.TestCase):
 
     def test_run(self):
-        t = WaitingTask("testwait", 2)
+        timer_service = TimerService(virtual=True)
+        t = WaitingTask("testwait", 2, timer_service)
         t.run()
         self.assertFalse(t.is_finished())
-        time.sleep(3) # wait for the timer to send de_activation_msgs
+        self.assertEqual(t.get_finish_time(), 2)
+        timer_service.advance(3) # let the virtual clock pass the waiting time
         self.assertTrue(t.is_finished())
 
 
@@ -38,4 +40,73 @@ class SingleWaffleJobTest(unittest.TestCase):
         mock_iron.start.assert_called()
 
 
+class RobotTaskTest(unittest.TestCase):
 
+    def test_priority_and_tool(self):
+        res_handler = Mock()
+        res_handler.get_free_equipment_by_string.return_value = "mock_item"
+        serve = ServeWaffle("serve", None, res_handler)
+        self.assertEqual(serve.get_priority(), 3)
+        self.assertEqual(serve.get_tool_affinity(), Tool.FORK)
+        self.assertEqual(serve.robot, "mock_item")
+        self.assertEqual(WaitingTask("wait", 1).get_priority(), 4)
+
+
+class WaffleCoordinatorTest(unittest.TestCase):
+
+    def test_reserves_arm_time_by_default(self):
+        coordinator = WaffleCoordinator(Mock(), ResourceHandler())
+        self.assertIs(coordinator.deadline_scheduler.task_duration, estimate_task_duration)
+
+    def test_estimate_task_duration(self):
+        tool_stand = Mock()
+        res_handler = Mock()
+        res_handler.get_free_equipment_by_string.return_value = tool_stand
+        tool_stand.get_equipped_tool.return_value = Tool.FORK
+        self.assertEqual(estimate_task_duration(ServeWaffle("serve", None, res_handler)), 8.0)
+        tool_stand.get_equipped_tool.return_value = Tool.GRIPPER
+        self.assertEqual(estimate_task_duration(ServeWaffle("serve", None, res_handler)), 14.0)
+        # unknown task types count as the longest
+        self.assertEqual(estimate_task_duration(BaseTask("other", None)), 10.0)
+
+
+class WaffleJobTest(unittest.TestCase):
+
+    def test_one_slot_per_order(self):
+        res_handler = Mock()
+        res_handler.get_free_equipment_by_string.return_value = "mock_item"
+        orders = [Order("plain", 0), Order("chocolate", 0), Order("plain", 0)]
+
+        job = WaffleJob(res_handler, None, 5, orders)
+        serves = [task for task in job.get_upcoming_tasks() if isinstance(task, ServeWaffle)]
+        pours = [task for task in job.get_upcoming_tasks() if isinstance(task, PourBatter)]
+        self.assertEqual([task.order for task in serves], orders)
+        self.assertEqual([task.slot for task in pours], [1, 2, 3])
+        self.assertEqual(serves[1].get_name(), "serving waffle slot 2")
+
+    def test_frying_deadlines(self):
+        res_handler = Mock()
+        res_handler.get_free_equipment_by_string.return_value = "mock_item"
+        timer_service = TimerService(virtual=True)
+
+        job = WaffleJob(res_handler, None, 100, slots=2, over_fry_time=10, serve_time=20)
+        tasks = list(job.get_upcoming_tasks())
+        frying = tasks[5]
+        frying.timer_service = timer_service
+        self.assertIsNone(tasks[6].get_deadline())
+        frying.run()
+        self.assertEqual(tasks[6].get_name(), "open for retrieving")
+        self.assertEqual([task.get_deadline() for task in tasks[6:9]], [110, 130, 150])
+        self.assertIsNone(tasks[9].get_deadline())
+
+    def test_no_equipment_lookup_at_creation(self):
+        res_handler = Mock()
+        job = WaffleJob(res_handler, None, 5, slots=2)
+        res_handler.get_free_equipment_by_string.assert_not_called()
+
+        pour = list(job.get_upcoming_tasks())[2]
+        pour.bind_resource("bowl", "blue bowl")
+        self.assertEqual(pour.bowl, "blue bowl")
+        res_handler.get_free_equipment_by_string.return_value = "first tool stand"
+        self.assertEqual(pour.tool_stand, "first tool stand")
+        res_handler.get_free_equipment_by_string.assert_called_once_with("tool")
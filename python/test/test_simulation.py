@@ -0,0 +1,57 @@
+import unittest
+from simulation.simulation import *
+from timer.timer import get_timer_service
+
+""" python -m unittest test.test_simulation """
+
+
+class PercentileTest(unittest.TestCase):
+
+    def test_nearest_rank(self):
+        values = [5, 1, 4, 2, 3]
+        self.assertEqual(percentile(values, 50), 3)
+        self.assertEqual(percentile(values, 100), 5)
+        self.assertEqual(percentile([1, 2, 3, 4], 75), 3)
+        self.assertEqual(percentile([], 50), None)
+
+
+class WaffleCellSimulatorTest(unittest.TestCase):
+
+    def test_all_orders_served(self):
+        default_service = get_timer_service()
+        sim = WaffleCellSimulator(fry_time=100)
+        report = sim.run([0, 0, 0, 50, 400])
+
+        self.assertEqual(report.waffles, 5)
+        self.assertEqual(len(report.latencies), 5)
+        self.assertTrue(min(report.latencies) > 100)
+        self.assertTrue(report.tool_changes > 0)
+        self.assertTrue(0 < report.get_arm_utilization() <= 1)
+        for utilization in report.get_iron_utilization().values():
+            self.assertTrue(0 < utilization <= 1)
+        # the simulation must not leave its virtual clock behind
+        self.assertIs(get_timer_service(), default_service)
+
+    def test_single_order_timeline(self):
+        sim = WaffleCellSimulator(irons=(("iron", 1),), fry_time=60, tool_change_time=0,
+                                  task_durations={"OperateIron": 1, "PourBatter": 2, "ServeWaffle": 3})
+        report = sim.run([10])
+        # start, open, pour, close, fry, open, serve
+        self.assertEqual(report.latencies, [1 + 1 + 2 + 1 + 60 + 1 + 3])
+        # ... then turn off and close
+        self.assertEqual(report.duration, 10 + 69 + 2)
+
+    def test_more_irons_more_throughput(self):
+        arrivals = poisson_arrivals(120, 2, seed=4)
+        small = WaffleCellSimulator(irons=(("a", 1),)).run(arrivals)
+        big = WaffleCellSimulator(irons=(("a", 1), ("b", 2), ("c", 2))).run(arrivals)
+        self.assertTrue(big.get_throughput() > small.get_throughput())
+
+    def test_more_robots_at_least_same_throughput(self):
+        arrivals = poisson_arrivals(240, 1, seed=2)
+        irons = (("a", 2), ("b", 2), ("c", 2), ("d", 2))
+        one = WaffleCellSimulator(irons=irons, robots=1).run(arrivals)
+        two = WaffleCellSimulator(irons=irons, robots=2).run(arrivals)
+        self.assertEqual(two.waffles, one.waffles)
+        self.assertTrue(two.get_throughput() >= one.get_throughput())
+        self.assertTrue(0 < two.get_arm_utilization() <= 1)
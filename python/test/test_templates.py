@@ -0,0 +1,59 @@
+import unittest
+from control.templates import *
+from control.control import BaseTask, BaseJob, DagJob
+
+""" python -m unittest test.test_templates """
+
+
+class Step(BaseTask):
+
+    def __init__(self, name, value=None, prio=2):
+        super().__init__(name, None, prio)
+        self.value = value
+        self.deadline_tasks = list()
+
+    def add_deadline_task(self, task, slack):
+        self.deadline_tasks.append((task, slack))
+
+
+class JobTemplateTest(unittest.TestCase):
+
+    def test_instantiate(self):
+        template = JobTemplate("test")
+        template.add(Step, "first", key="wait", value=Param("speed"))
+        template.add(Step, "second", deadline_after="wait", slack=Param("slack"), value=Param("items", 1))
+        template.add(Step, "third", deadline_after="wait", slack=Computed(lambda x: x["slack"] * 2),
+                     value=Param("items", 5), prio=3)
+        blueprint = template.compile()
+        self.assertEqual(len(blueprint), 3)
+
+        job = blueprint.instantiate(BaseJob(None, None), speed=7, items=["a", "b"], slack=10)
+        first, second, third = job.get_upcoming_tasks()
+        self.assertEqual([first.value, second.value, third.value], [7, "b", None])
+        self.assertEqual(third.get_priority(), 3)
+        self.assertEqual(first.deadline_tasks, [(second, 10), (third, 20)])
+        # every job gets its own tasks
+        other = blueprint.instantiate(BaseJob(None, None), speed=1, items=[], slack=0)
+        self.assertIsNot(next(other.get_upcoming_tasks()), first)
+
+    def test_compile_errors(self):
+        with self.assertRaises(ValueError):
+            JobTemplate("unknown").add(Step, "late", deadline_after="wait").compile()
+        with self.assertRaises(ValueError):
+            JobTemplate("duplicate").add(Step, "a", key="x").add(Step, "b", key="x").compile()
+
+    def test_dependencies(self):
+        template = JobTemplate("graph")
+        template.add(Step, "a", key="a")
+        template.add(Step, "b", key="b", after=[])
+        template.add(Step, "c", after=["a", "b"])
+        template.add(Step, "d")
+        blueprint = template.compile()
+
+        job = blueprint.instantiate(DagJob(None, None))
+        a, b, c, d = job.tasks
+        self.assertEqual([a.prereqs, b.prereqs, c.prereqs, d.prereqs], [[], [], [a, b], [c]])
+        linear = blueprint.instantiate(BaseJob(None, None))
+        self.assertEqual([task.get_name() for task in linear.get_upcoming_tasks()], ["a", "b", "c", "d"])
+        with self.assertRaises(ValueError):
+            JobTemplate("unknown").add(Step, "a", after=["b"]).compile()
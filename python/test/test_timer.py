@@ -0,0 +1,52 @@
+import unittest
+import threading
+from timer.timer import *
+
+""" python -m unittest test.test_timer """
+
+
+class TimerServiceTest(unittest.TestCase):
+
+    def test_virtual_order(self):
+        ts = TimerService(virtual=True)
+        fired = list()
+        ts.schedule(3, fired.append, "c")
+        ts.schedule(1, fired.append, "a")
+        ts.schedule(2, fired.append, "b")
+        self.assertEqual(ts.next_deadline(), 1)
+        ts.advance(2)
+        self.assertEqual(fired, ["a", "b"])
+        self.assertEqual(ts.now(), 2)
+        self.assertEqual(ts.run_until_idle(), 3)
+        self.assertEqual(fired, ["a", "b", "c"])
+
+    def test_cancel(self):
+        ts = TimerService(virtual=True)
+        fired = list()
+        handle = ts.schedule(1, fired.append, "a")
+        ts.schedule(2, fired.append, "b")
+        handle.cancel()
+        self.assertEqual(ts.next_deadline(), 2)
+        self.assertEqual(ts.pending(), 1)
+        ts.advance(5)
+        self.assertEqual(fired, ["b"])
+        self.assertFalse(handle.is_active())
+
+    def test_callback_schedules_callback(self):
+        ts = TimerService(virtual=True)
+        fired = list()
+        ts.schedule(1, lambda: ts.schedule(1, fired.append, ts.now()))
+        ts.advance(3)
+        self.assertEqual(fired, [1])
+
+    def test_real_time(self):
+        ts = TimerService()
+        done = threading.Event()
+        order = list()
+        ts.schedule(0.1, lambda: (order.append(2), done.set()))
+        ts.schedule(0.05, order.append, 1)
+        self.assertTrue(done.wait(2))
+        self.assertEqual(order, [1, 2])
+
+    def test_virtual_advance_not_allowed_in_real_mode(self):
+        self.assertRaises(RuntimeError, TimerService().advance, 1)
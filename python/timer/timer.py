@@ -0,0 +1,151 @@
+import heapq
+import itertools
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TimerHandle:
+    """ A scheduled callback, returned by TimerService.schedule """
+
+    def __init__(self, service: 'TimerService', deadline, callback, args):
+        self.service = service
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self.fired = False
+
+    def cancel(self):
+        self.service.cancel(self)
+
+    def is_active(self):
+        return not (self.cancelled or self.fired)
+
+    def time_remaining(self):
+        return max(0.0, self.deadline - self.service.now())
+
+
+class TimerService:
+    """ Runs all delayed callbacks from one min-heap of deadlines.
+
+    In real mode a single daemon thread sleeps until the earliest deadline, callbacks run on
+    that thread one after another so they should be short. In virtual mode time only moves
+    when advance() is called and the callbacks run on the calling thread, which makes
+    timed code testable and simulatable without sleeping. """
+
+    def __init__(self, virtual=False, start_time=0.0):
+        self.virtual = virtual
+        self._virtual_now = start_time
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def now(self):
+        if self.virtual:
+            return self._virtual_now
+        return time.monotonic()
+
+    def schedule(self, delay, callback, *args) -> TimerHandle:
+        """ Call callback(*args) after delay seconds """
+        with self._cond:
+            handle = TimerHandle(self, self.now() + delay, callback, args)
+            heapq.heappush(self._heap, (handle.deadline, next(self._seq), handle))
+            if not self.virtual:
+                self._ensure_thread()
+                self._cond.notify()
+        return handle
+
+    def cancel(self, handle: TimerHandle):
+        """ Cancelled handles stay in the heap and are skipped when they come up """
+        with self._cond:
+            handle.cancelled = True
+
+    def next_deadline(self):
+        """ Deadline of the earliest pending callback, None if nothing is scheduled """
+        with self._cond:
+            self._drop_cancelled()
+            return self._heap[0][0] if self._heap else None
+
+    def pending(self):
+        with self._cond:
+            return sum(1 for entry in self._heap if entry[2].is_active())
+
+    def advance(self, seconds):
+        """ Virtual mode only: move the clock forward and fire every callback that is due """
+        self.advance_to(self._virtual_now + seconds)
+
+    def advance_to(self, deadline):
+        if not self.virtual:
+            raise RuntimeError("advance is only possible on a virtual TimerService")
+        while True:
+            with self._cond:
+                self._drop_cancelled()
+                if not self._heap or self._heap[0][0] > deadline:
+                    break
+                handle = heapq.heappop(self._heap)[2]
+                self._virtual_now = max(self._virtual_now, handle.deadline)
+                handle.fired = True
+            self._fire(handle)
+        self._virtual_now = max(self._virtual_now, deadline)
+
+    def run_until_idle(self):
+        """ Virtual mode only: fire callbacks until nothing is scheduled, returns the end time """
+        deadline = self.next_deadline()
+        while deadline is not None:
+            self.advance_to(deadline)
+            deadline = self.next_deadline()
+        return self._virtual_now
+
+    def _drop_cancelled(self):
+        while self._heap and self._heap[0][2].cancelled:
+            heapq.heappop(self._heap)
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="timer-service", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._drop_cancelled()
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                wait_time = self._heap[0][0] - self.now()
+                if wait_time > 0:
+                    self._cond.wait(wait_time)
+                    continue
+                handle = heapq.heappop(self._heap)[2]
+                handle.fired = True
+            self._fire(handle)
+
+    def _fire(self, handle: TimerHandle):
+        try:
+            handle.callback(*handle.args)
+        except Exception:
+            logger.exception("Timer callback failed")
+
+
+_default_service = None
+_default_lock = threading.Lock()
+
+
+def get_timer_service() -> TimerService:
+    """ The shared real-time TimerService, created on first use """
+    global _default_service
+    with _default_lock:
+        if _default_service is None:
+            _default_service = TimerService()
+        return _default_service
+
+
+def set_timer_service(service: TimerService):
+    """ Replace the shared TimerService, e.g. with a virtual one in tests and simulations """
+    global _default_service
+    with _default_lock:
+        _default_service = service
@@ -1,4 +1,5 @@
 from enum import Enum
+from metrics.metrics import get_metrics
 import logging
 
 logger = logging.getLogger(__name__)
@@ -9,6 +10,7 @@ Tool = Enum('Tool', 'GRIPPER SCOOP FORK')
 class Equipment:
 
     def __init__(self, origin, name="Unnamed Equipment", capacity=1):
+        self.free_listeners = list()
         self.origin = origin
         self.name = name
         self.has_reservation = False
@@ -16,6 +18,20 @@ class Equipment:
         self.capacity = capacity
         self.reserve_capacity_used = 0 # Refactor. used to add more orders to reserved item
 
+    @property
+    def free(self):
+        return self._free
+
+    @free.setter
+    def free(self, free):
+        self._free = free
+        for listener in self.free_listeners:
+            listener(self)
+
+    def add_free_listener(self, listener):
+        """ listener(equipment) is called whenever the free flag is set """
+        self.free_listeners.append(listener)
+
     def is_free(self):
         return self.free
 
@@ -59,6 +75,7 @@ class ToolStand(Equipment):
     def __init__(self, origin, name):
         super().__init__(origin, name)
         self.current_tool = Tool.GRIPPER
+        self.tool_changes = 0
 
     def get_equipped_tool(self):
         return self.current_tool
@@ -70,6 +87,19 @@ class ToolStand(Equipment):
         else:
             logger.info("Not implemented: Switching tools from "+str(self.current_tool)+" to "+ str(tool))
             self.current_tool = tool
+            self.tool_changes += 1
+            get_metrics().inc("tool_changes")
+
+
+class RobotArm(Equipment):
+    """ A robot with its own tool changer, several arms can serve the same cell """
+
+    def __init__(self, origin, name, tool_stand: ToolStand = None):
+        super().__init__(origin, name)
+        self.tool_stand = tool_stand if tool_stand is not None else ToolStand(origin, name + " tool stand")
+
+    def get_tool_stand(self) -> ToolStand:
+        return self.tool_stand
 
 
 class WaffleIron(Equipment):
@@ -114,7 +144,7 @@ class Bowl(Equipment):
         pass
 
     def retrieve(self):
-        print("retrieve")
+        logger.info("retrieve")
 
     def req_tool(self, op):
         if op == "retrieve":